@@ -0,0 +1,7 @@
+def __getattr__(name):
+    # Imported lazily: the loader needs the app registry, which is not ready
+    # while Django imports this package.
+    if name == 'ingest_dataframe':
+        from .dataframes import ingest_dataframe
+        return ingest_dataframe
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import Host, Discovery, Planet, SystemParameterReference, PlanetarySystem
+from .models import Host, Discovery, Planet, SystemParameterReference, PlanetarySystem, QuarantinedRow
 
 class PlanetAdmin(admin.ModelAdmin):
     list_display = ('name', 'host_name', 'system_parameters')
+    list_select_related = ('host__system__parameter_reference',)
 
     def host_name(self, obj):
         return obj.host.name
@@ -12,8 +13,18 @@ class PlanetAdmin(admin.ModelAdmin):
         return obj.host.system.parameter_reference.name
     system_parameters.short_description = 'System Parameters'
 
+class PlanetarySystemAdmin(admin.ModelAdmin):
+    # The systems are listed by their __str__, which reads the host.
+    list_select_related = ('host',)
+
 admin.site.register(Host)
 admin.site.register(Discovery)
 admin.site.register(Planet, PlanetAdmin)
 admin.site.register(SystemParameterReference)
-admin.site.register(PlanetarySystem)
+admin.site.register(PlanetarySystem, PlanetarySystemAdmin)
+
+class QuarantinedRowAdmin(admin.ModelAdmin):
+    list_display = ('source', 'row_number', 'reasons', 'created_at')
+    list_filter = ('source',)
+
+admin.site.register(QuarantinedRow, QuarantinedRowAdmin)
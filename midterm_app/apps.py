@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MidtermAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'midterm_app'
+
+    def ready(self):
+        # Connects the receivers keeping the FlatPlanet read model in sync.
+        from . import read_model  # noqa: F401
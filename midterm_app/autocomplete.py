@@ -0,0 +1,66 @@
+"""In-memory prefix index of the planet and host names, for autocompletion."""
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+
+from .models import Host, Planet
+from .read_model import catalog_version
+
+AUTOCOMPLETE_LIMIT = 10
+# How long the index is used before the catalog version is looked up again.
+RECHECK_SECONDS = 1.0
+
+SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(name):
+    """name casefolded without accents, every run of non-alphanumerics one space, without leading spaces."""
+    name = ''.join(char for char in unicodedata.normalize('NFKD', name) if not unicodedata.combining(char))
+    return SEPARATORS.sub(' ', name.casefold()).lstrip()
+
+
+class NameIndex:
+    """The normalized planet and host names of one catalog version, sorted."""
+
+    def __init__(self, version):
+        self.version = version
+        self.checked = time.monotonic()
+        names = [
+            (normalize(name).rstrip(), kind, name, pk)
+            for kind, model in (('host', Host), ('planet', Planet))
+            for pk, name in model.objects.values_list('pk', 'name').iterator()
+        ]
+        names.sort()
+        self.keys = [key for key, _, _, _ in names]
+        self.names = [{'name': name, 'type': kind, 'id': pk} for _, kind, name, pk in names]
+
+    def complete(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """The first limit names, in normalized order, whose normalized form starts with prefix normalized."""
+        prefix = normalize(prefix)
+        if not prefix.strip():
+            return []
+        start = bisect_left(self.keys, prefix)
+        stop = start
+        while stop < len(self.keys) and stop - start < limit and self.keys[stop].startswith(prefix):
+            stop += 1
+        return self.names[start:stop]
+
+
+_index = None
+_lock = threading.Lock()
+
+def name_index():
+    """The NameIndex of the catalog version seen at most RECHECK_SECONDS ago."""
+    global _index
+    index = _index
+    if index is not None and time.monotonic() - index.checked < RECHECK_SECONDS:
+        return index
+    with _lock:
+        if _index is None or time.monotonic() - _index.checked >= RECHECK_SECONDS:
+            version = catalog_version()
+            if _index is None or _index.version != version:
+                _index = NameIndex(version)
+            _index.checked = time.monotonic()
+        return _index
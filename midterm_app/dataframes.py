@@ -0,0 +1,185 @@
+"""Column-typed parsing of archive CSV files with pandas."""
+import io
+import os
+from contextlib import nullcontext
+
+import pandas as pd
+from django.db import connection, transaction
+
+from .ingest import (
+    BATCH_SIZE, COMPRESSED_OPENERS, ENCODING, RECORD_COLUMNS, BulkLoader, DeltaLoader, MissingColumnsError,
+    bulk_load_records, check_columns, records_from_columns, relaxed_gc,
+    parse_float, parse_int, parse_date, parse_month, parse_flag,
+)
+
+CHUNK_ROWS = 50000
+
+FLOAT_COLUMNS = sorted(column for column, converter in RECORD_COLUMNS if converter is parse_float)
+
+# int() only accepts optionally signed digit strings, e.g. not '2009.0'.
+INT_PATTERN = r'\s*[+-]?\d+\s*'
+
+
+def read_csv_chunks(path, chunksize=CHUNK_ROWS, typed=True):
+    """Read path in chunks of text columns, or with the float columns parsed by the C parser if typed."""
+    options = {
+        'encoding': ENCODING,
+        'memory_map': os.path.splitext(path)[1].lower() not in COMPRESSED_OPENERS,
+        'chunksize': chunksize,
+    }
+    return read_csv(path, typed, **options)
+
+def read_csv(source, typed=True, **options):
+    # Empty text cells stay '' as with csv.DictReader; round_trip floats match float().
+    if not typed:
+        return pd.read_csv(source, dtype=str, keep_default_na=False, **options)
+    return pd.read_csv(
+        source, dtype={column: 'float64' for column in FLOAT_COLUMNS}, keep_default_na=False,
+        na_values={column: [''] for column in FLOAT_COLUMNS}, float_precision='round_trip', **options
+    )
+
+def _to_int(values):
+    values = values.astype(str)
+    return pd.to_numeric(values.where(values.str.fullmatch(INT_PATTERN)), errors='coerce').astype('Int64')
+
+def _to_date(values, format):
+    # Archive dates repeat a lot, so only the distinct values are parsed.
+    distinct = values.unique()
+    parsed = pd.to_datetime(pd.Series(distinct), format=format, errors='coerce').dt.date
+    return values.map(dict(zip(distinct, parsed)))
+
+CONVERTERS = {
+    parse_float: lambda values: pd.to_numeric(values, errors='coerce'),
+    parse_int: _to_int,
+    parse_flag: lambda values: _to_int(values).fillna(0).astype(bool),
+    parse_date: lambda values: _to_date(values, '%Y-%m-%d'),
+    parse_month: lambda values: _to_date(values, '%Y-%m'),
+}
+
+def typed_column(frame, column, converter):
+    """Column of frame converted like converter would, with NaN/NA where it gives None."""
+    values = frame[column]
+    if converter is not None:
+        values = CONVERTERS[converter](values)
+    return values
+
+def column_values(values):
+    """A typed column as a list, with None for missing values."""
+    missing = values.isna()
+    if missing.any():
+        values = values.astype(object).where(~missing, None)
+    return values.tolist()
+
+def frame_records(frame):
+    """The records of every row of an archive frame, see ingest.map_row."""
+    return records_from_columns({
+        (column, converter): column_values(typed_column(frame, column, converter))
+        for column, converter in RECORD_COLUMNS
+    })
+
+def iter_csv_chunks(path, chunksize=CHUNK_ROWS):
+    """Chunks of path as frames indexed by row number, typed unless a float column holds a malformed value."""
+    done = 0
+    try:
+        for chunk in read_csv_chunks(path, chunksize):
+            if not done:
+                check_columns(chunk.columns)
+            done += len(chunk)
+            yield chunk
+        return
+    except MissingColumnsError:
+        raise
+    except ValueError:
+        pass
+
+    for index, chunk in enumerate(read_csv_chunks(path, chunksize, typed=False)):
+        if not index:
+            check_columns(chunk.columns)
+        if done >= len(chunk):
+            done -= len(chunk)
+            continue
+        yield chunk.iloc[done:]
+        done = 0
+
+def iter_csv_records(path, chunksize=CHUNK_ROWS):
+    for chunk in iter_csv_chunks(path, chunksize):
+        yield from frame_records(chunk)
+
+def text_records(text):
+    """The records of the rows of archive CSV text, see ingest.map_block."""
+    try:
+        frame = read_csv(io.StringIO(text))
+    except ValueError:
+        frame = read_csv(io.StringIO(text), typed=False)
+    check_columns(frame.columns)
+    return frame_records(frame)
+
+
+DATE_FORMATS = {parse_date: '%Y-%m-%d', parse_month: '%Y-%m'}
+
+def archive_column(values, converter):
+    """A column of an in-memory archive frame as text, the way the CSV parsers would see it."""
+    if converter is None:
+        return values.astype(object).where(values.notna(), '').astype(str)
+    if converter in (parse_int, parse_flag) and pd.api.types.is_numeric_dtype(values):
+        if pd.api.types.is_bool_dtype(values):
+            values = values.astype(int)
+        # Integer columns with gaps arrive as floats; 2009.0 is a year here.
+        values = values.where(values % 1 == 0).astype('Int64')
+        return values.astype('string').fillna('').astype(object)
+    if converter in DATE_FORMATS:
+        format = DATE_FORMATS[converter]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values.dt.strftime(format).fillna('')
+        return values.map(lambda value: value.strftime(format) if hasattr(value, 'strftime') else value)
+    return values
+
+def archive_frame(data):
+    """A DataFrame or dict of arrays with archive column names, with its mapped columns as in archive_column()."""
+    frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    check_columns(frame.columns)
+    return pd.DataFrame(
+        {column: archive_column(frame[column], converter) for column, converter in RECORD_COLUMNS}, index=frame.index
+    )
+
+def iter_frame_records(data, chunksize=CHUNK_ROWS):
+    """The records of every row of an in-memory archive frame, chunksize rows at a time."""
+    frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    check_columns(frame.columns)
+    for start in range(0, len(frame), chunksize):
+        yield from frame_records(archive_frame(frame.iloc[start:start + chunksize]))
+
+INGEST_MODES = ('bulk', 'fast_sqlite', 'copy', 'delta')
+
+def ingest_dataframe(data, mode='bulk', batch_size=BATCH_SIZE, validate=False, source='<dataframe>', stats=None):
+    """
+    Load a DataFrame, or a dict of arrays, with archive column names through the
+    loader of load_data in mode ('bulk', 'fast_sqlite', 'copy' or 'delta'); returns the loader.
+    """
+    from .postgres_bulk import PostgresCopyLoader
+    from .read_model import deferred, refresh_read_models
+    from .sqlite_bulk import SqliteBulkLoader, fast_sqlite
+    from .validation import Quarantine, validate_records
+
+    if mode not in INGEST_MODES:
+        raise ValueError(f'mode must be one of {", ".join(INGEST_MODES)}, not {mode!r}')
+    if validate and mode == 'delta':
+        raise ValueError('validate cannot be combined with the delta mode')
+    loader_class = {'bulk': BulkLoader, 'fast_sqlite': SqliteBulkLoader, 'copy': PostgresCopyLoader}.get(mode)
+
+    if mode == 'copy' and connection.vendor != 'postgresql':
+        raise ValueError(f'the copy mode needs the postgresql backend, not {connection.vendor}')
+    records = iter_frame_records(data)
+    with relaxed_gc(), fast_sqlite() if mode == 'fast_sqlite' else nullcontext(), transaction.atomic(), deferred() as changes:
+        if validate:
+            records = validate_records(records, Quarantine(source, stats=stats))
+        if mode == 'delta':
+            loader = DeltaLoader(batch_size=batch_size, stats=stats)
+            with loader.stats.stage('resolve'):
+                for record in records:
+                    loader.add_record(record)
+                loader.apply()
+        else:
+            loader = bulk_load_records(records, batch_size=batch_size, loader_class=loader_class, stats=stats)
+        refresh_read_models(changes, loader.stats)
+        return loader
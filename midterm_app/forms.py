@@ -1,22 +1,38 @@
 from django import forms
+from .ingest import NATURAL_KEYS, upsert
 from .models import Host, Discovery, PlanetarySystem, Planet
 
-class HostForm(forms.ModelForm):
+class UpsertModelForm(forms.ModelForm):
+    """ModelForm saving with an upsert on the model's natural key."""
+
+    def _get_validation_exclusions(self):
+        # The unique checks of the key would reject exactly the rows the
+        # upsert is meant to update; the database enforces the key instead.
+        return super()._get_validation_exclusions() | set(NATURAL_KEYS[self._meta.model])
+
+    def save(self, commit=True):
+        if not commit:
+            return super().save(commit=False)
+        key = NATURAL_KEYS[self._meta.model]
+        upsert(self._meta.model, [self.instance], [name for name in self.cleaned_data if name not in key])
+        return self.instance
+
+class HostForm(UpsertModelForm):
     class Meta:
         model = Host
         fields = '__all__'
 
-class DiscoveryForm(forms.ModelForm):
+class DiscoveryForm(UpsertModelForm):
     class Meta:
         model = Discovery
         fields = '__all__'
 
-class PlanetarySystemForm(forms.ModelForm):
+class PlanetarySystemForm(UpsertModelForm):
     class Meta:
         model = PlanetarySystem
         fields = '__all__'
 
-class PlanetForm(forms.ModelForm):
+class PlanetForm(UpsertModelForm):
     class Meta:
         model = Planet
         fields = '__all__'
@@ -0,0 +1,741 @@
+import bz2
+import csv
+import gc
+import gzip
+import hashlib
+import io
+import lzma
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+
+import django
+from django.db import connection, transaction
+
+from .models import (
+    Host, Discovery, Planet, SystemParameterReference, PlanetarySystem, IngestState, IngestFingerprint,
+    HOST_KEY, SYSTEM_PARAMETER_REFERENCE_KEY, DISCOVERY_KEY, PLANETARY_SYSTEM_KEY, PLANET_KEY,
+)
+from .signals import catalog_upserted
+from .telemetry import IngestStats
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 5000
+# Allocations between young-generation collections during a load, see relaxed_gc().
+GC_THRESHOLD = 10000
+# Rows per block handed to the parse workers of --workers.
+PARALLEL_BLOCK_ROWS = 10000
+
+
+def parse_float(value, default=None):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return default
+
+def parse_int(value, default=None):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return default
+
+def parse_date(value, format='%Y-%m-%d', default=None):
+    try:
+        return datetime.strptime(value, format).date()
+    except (ValueError, TypeError):
+        return default
+
+def parse_month(value):
+    return parse_date(value, '%Y-%m')
+
+def parse_flag(value):
+    return bool(parse_int(value))
+
+
+# Archive column and converter for each model field, split into the fields
+# get_or_create looks rows up by and the defaults applied on create. Text
+# columns (converter None) are copied as is.
+HOST_MAPPING = (
+    (
+        ('name', 'hostname', None),
+        ('spectral_type', 'st_spectype', None),
+    ),
+    (
+        ('effective_temperature', 'st_teff', parse_float),
+        ('radius', 'st_rad', parse_float),
+        ('mass', 'st_mass', parse_float),
+        ('metallicity', 'st_met', parse_float),
+        ('metallicity_ratio', 'st_metratio', None),
+        ('surface_gravity', 'st_logg', parse_float),
+        ('distance', 'sy_dist', parse_float),
+        ('v_magnitude', 'sy_vmag', parse_float),
+        ('k_magnitude', 'sy_kmag', parse_float),
+        ('gaia_magnitude', 'sy_gaiamag', parse_float),
+    ),
+)
+
+SYSTEM_PARAMETER_REFERENCE_MAPPING = (
+    (
+        ('name', 'sy_refname', None),
+        ('right_ascension', 'rastr', None),
+        ('ra_degrees', 'ra', parse_float),
+        ('declination', 'decstr', None),
+        ('dec_degrees', 'dec', parse_float),
+    ),
+    (
+        ('row_update', 'rowupdate', parse_date),
+        ('planet_publication_date', 'pl_pubdate', parse_month),
+        ('release_date', 'releasedate', parse_date),
+    ),
+)
+
+DISCOVERY_MAPPING = (
+    (
+        ('method', 'discoverymethod', None),
+        ('year', 'disc_year', parse_int),
+        ('reference_name', 'disc_refname', None),
+    ),
+    (
+        ('facility', 'disc_facility', None),
+        ('telescope', 'disc_telescope', None),
+    ),
+)
+
+PLANET_MAPPING = (
+    (
+        ('name', 'pl_name', None),
+    ),
+    (
+        ('default_flag', 'default_flag', parse_flag),
+        ('controversial_flag', 'pl_controv_flag', parse_flag),
+        ('parameter_reference', 'pl_refname', None),
+        ('orbital_period', 'pl_orbper', parse_float),
+        ('semi_major_axis', 'pl_orbsmax', parse_float),
+        ('radius', 'pl_rade', parse_float),
+        ('mass', 'pl_masse', parse_float),
+        ('mass_sin_i_earth', 'pl_bmasse', parse_float),
+        ('mass_sin_i_jupiter', 'pl_bmassj', parse_float),
+        ('mass_provenance', 'pl_bmassprov', None),
+        ('eccentricity', 'pl_orbeccen', parse_float),
+        ('insolation_flux', 'pl_insol', parse_float),
+        ('equilibrium_temperature', 'pl_eqt', parse_float),
+        ('inclination', 'pl_orbincl', parse_float),
+        ('ttv_flag', 'ttv_flag', parse_flag),
+        ('transit_duration', 'pl_trandur', parse_float),
+    ),
+)
+
+# A record is the (lookup, defaults) pair of every model for one archive row.
+RECORD_MAPPINGS = (HOST_MAPPING, SYSTEM_PARAMETER_REFERENCE_MAPPING, DISCOVERY_MAPPING, PLANET_MAPPING)
+
+# Value used when a column is absent from the file. A host without a name
+# cannot be stored, so hostname deliberately has no usable default.
+MISSING_COLUMN_DEFAULTS = {'hostname': None}
+
+
+def map_fields(row, mapping):
+    """Turn an archive row into the (lookup, defaults) pair for one model."""
+    return tuple(
+        {
+            field: (row.get(column, MISSING_COLUMN_DEFAULTS.get(column, '')) if converter is None
+                    else converter(row.get(column, MISSING_COLUMN_DEFAULTS.get(column, ''))))
+            for field, column, converter in fields
+        }
+        for fields in mapping
+    )
+
+def host_fields(row):
+    return map_fields(row, HOST_MAPPING)
+
+def system_parameter_reference_fields(row):
+    return map_fields(row, SYSTEM_PARAMETER_REFERENCE_MAPPING)
+
+def discovery_fields(row):
+    return map_fields(row, DISCOVERY_MAPPING)
+
+def planet_fields(row):
+    return map_fields(row, PLANET_MAPPING)
+
+def map_row(row):
+    return tuple(map_fields(row, mapping) for mapping in RECORD_MAPPINGS)
+
+# Every distinct (archive column, converter) pair the records are built from.
+RECORD_COLUMNS = tuple(dict.fromkeys(
+    (column, converter)
+    for mapping in RECORD_MAPPINGS for fields in mapping for _, column, converter in fields
+))
+
+
+class MissingColumnsError(ValueError):
+    pass
+
+def check_columns(header):
+    """Raise MissingColumnsError unless header has every column the records are built from."""
+    missing = sorted({column for column, _ in RECORD_COLUMNS} - set(header))
+    if missing:
+        raise MissingColumnsError(f'archive is missing columns: {", ".join(missing)}')
+
+# Converters of columns with few distinct values (years, dates, flags),
+# which compile_mapping() memoizes per file.
+MEMOIZED_CONVERTERS = (parse_int, parse_date, parse_month, parse_flag)
+
+def compile_mapping(header, mappings=RECORD_MAPPINGS):
+    """A function turning a csv.reader row of a file with header into the record map_row() returns."""
+    # Generated code indexes the row by position; empty cells skip the converter.
+    check_columns(header)
+    # The last of duplicated columns wins, as in csv.DictReader.
+    positions = {column: index for index, column in enumerate(header)}
+    namespace = {}
+    converters = {}
+
+    def value(column, converter):
+        cell = f'row[{positions[column]}]'
+        if converter is None:
+            return cell
+        if converter not in converters:
+            name = f'convert_{len(converters)}'
+            converters[converter] = name
+            namespace[name] = lru_cache(maxsize=None)(converter) if converter in MEMOIZED_CONVERTERS else converter
+            namespace[f'{name}_empty'] = converter('')
+        name = converters[converter]
+        return f'({name}({cell}) if {cell} else {name}_empty)'
+
+    pairs = ', '.join(
+        '(' + ', '.join(
+            '{' + ', '.join(f'{field!r}: {value(column, converter)}' for field, column, converter in fields) + '}'
+            for fields in mapping
+        ) + ')'
+        for mapping in mappings
+    )
+    exec(f'def map_values(row):\n    return ({pairs},)\n', namespace)
+    return namespace['map_values']
+
+def iter_mapped_rows(lines):
+    """(row number, record) of every row of the archive CSV lines, mapped by compile_mapping()."""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    map_values = compile_mapping(header)
+    width = len(header)
+    index = 0
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            # Short rows are padded with None like csv.DictReader's restval.
+            row += [None] * (width - len(row))
+        yield index, map_values(row)
+        index += 1
+
+def records_from_columns(columns):
+    """The records of a block of rows, from the converted values of each RECORD_COLUMNS pair."""
+    pairs = []
+    for mapping in RECORD_MAPPINGS:
+        for fields in mapping:
+            names = [field for field, _, _ in fields]
+            values = [columns[column, converter] for _, column, converter in fields]
+            pairs.append([dict(zip(names, row)) for row in zip(*values)])
+    return [
+        ((host, host_defaults), (reference, reference_defaults), (discovery, discovery_defaults), (planet, planet_defaults))
+        for host, host_defaults, reference, reference_defaults, discovery, discovery_defaults, planet, planet_defaults in zip(*pairs)
+    ]
+
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+ENCODING = 'utf-8'
+
+@contextmanager
+def open_archive(path):
+    """Text lines of the archive CSV at path, decompressed or memory-mapped."""
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(path)[1].lower())
+    if opener is not None:
+        with opener(path, 'rt', encoding=ENCODING, newline='') as file:
+            yield file
+        return
+
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # Empty files cannot be mapped.
+            yield iter(())
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield _mapped_lines(mapped)
+
+MMAP_RELEASE_BYTES = 16 * 2 ** 20
+
+def _mapped_lines(mapped):
+    # Pages already scanned are dropped from the mapping every
+    # MMAP_RELEASE_BYTES, so resident memory does not grow with the file.
+    # They stay in the page cache; only this process stops holding them.
+    release = hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_DONTNEED')
+    if release:
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    released = 0
+    for line in iter(mapped.readline, b''):
+        yield line.decode(ENCODING)
+        if release and mapped.tell() - released >= MMAP_RELEASE_BYTES:
+            end = mapped.tell() // mmap.PAGESIZE * mmap.PAGESIZE
+            mapped.madvise(mmap.MADV_DONTNEED, released, end - released)
+            released = end
+
+def iter_archive_records(path, parser='csv', workers=1, cache_dir=None, stats=None):
+    """The record of every row in the archive CSV at path, in file order, however it is parsed."""
+    records = _archive_records(path, parser, workers, cache_dir, stats)
+    return records if stats is None else stats.timed(records, 'parse', count=True)
+
+def _archive_records(path, parser, workers, cache_dir, stats):
+    if cache_dir:
+        from .parse_cache import cached_records
+        yield from cached_records(path, cache_dir)
+    elif workers > 1:
+        yield from iter_parallel_records(path, parser, workers)
+    elif parser == 'pandas':
+        from .dataframes import iter_csv_records
+        yield from iter_csv_records(path)
+    else:
+        with open_archive(path) as lines:
+            for _, record in iter_mapped_rows(lines if stats is None else stats.timed_batches(lines, 'read')):
+                yield record
+
+def text_blocks(path, block_rows):
+    """The header line of path and its rows as CSV text, block_rows lines at a time."""
+    with open_archive(path) as lines:
+        lines = iter(lines)
+        header = next(lines, None)
+        if header is None:
+            return
+        check_columns(next(csv.reader([header])))
+        yield header
+        block, quotes = [], 0
+        for line in lines:
+            block.append(line)
+            # An odd number of quotes so far means a quoted field goes on to the next line.
+            quotes += line.count('"')
+            if len(block) >= block_rows and not quotes % 2:
+                yield ''.join(block)
+                block, quotes = [], 0
+        if block:
+            yield ''.join(block)
+
+def map_block(parser, header, block):
+    """The records of a block of text_blocks(), in file order."""
+    if parser == 'pandas':
+        from .dataframes import text_records
+        return text_records(header + block)
+    return [record for _, record in iter_mapped_rows(io.StringIO(header + block))]
+
+def iter_parallel_records(path, parser, workers):
+    # Worker processes only parse and map whole blocks of rows; they never
+    # touch the database, and all writes stay in this process. django.setup
+    # makes the models importable in spawned workers. At most 2 * workers
+    # blocks are in flight, so memory stays flat however large the file.
+    blocks = text_blocks(path, PARALLEL_BLOCK_ROWS)
+    header = next(blocks, None)
+    if header is None:
+        return
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+    try:
+        pending = deque()
+        for block in blocks:
+            pending.append(executor.submit(map_block, parser, header, block))
+            if len(pending) > 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+# The tables a load writes to, parents before children.
+CATALOG_MODELS = (Host, SystemParameterReference, Discovery, PlanetarySystem, Planet)
+
+NATURAL_KEYS = {
+    Host: HOST_KEY,
+    SystemParameterReference: SYSTEM_PARAMETER_REFERENCE_KEY,
+    Discovery: DISCOVERY_KEY,
+    PlanetarySystem: PLANETARY_SYSTEM_KEY,
+    Planet: PLANET_KEY,
+}
+
+def upsert_sql(model, source, update_fields=()):
+    """INSERT of the non-pk columns of model from source (VALUES or SELECT) merged on its natural key, RETURNING id and the key."""
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(field.column) for field in model._meta.concrete_fields if not field.primary_key)
+    key = ', '.join(qn(model._meta.get_field(name).column) for name in NATURAL_KEYS[model])
+    # A conflict has to update something for the row to be returned.
+    assignments = ', '.join(
+        f'{qn(column)} = EXCLUDED.{qn(column)}'
+        for column in (model._meta.get_field(name).column for name in update_fields or NATURAL_KEYS[model][:1])
+    )
+    return (
+        f'INSERT INTO {qn(model._meta.db_table)} ({columns}) {source} '
+        f'ON CONFLICT ({key}) DO UPDATE SET {assignments} RETURNING {qn(model._meta.pk.column)}, {key}'
+    )
+
+def set_upserted_pks(model, objs, rows):
+    """Set the pks of objs from the (id, *natural key) rows upsert_sql() returned."""
+    attnames = [model._meta.get_field(name).attname for name in NATURAL_KEYS[model]]
+    pks = {tuple(key): pk for pk, *key in rows}
+    for obj in objs:
+        obj.pk = pks[tuple(getattr(obj, attname) for attname in attnames)]
+        obj._state.adding = False
+
+def upsert(model, objs, update_fields=(), batch_size=None, write=None):
+    """Write catalog objs with an INSERT ... ON CONFLICT on their natural key, or write(), and set their pks."""
+    key = NATURAL_KEYS[model]
+    attnames = [model._meta.get_field(name).attname for name in key]
+    complete, partial = [], []
+    for obj in objs:
+        # Copies the pks of parents saved since obj was built to its foreign keys.
+        obj._prepare_related_fields_for_save(operation_name='upsert')
+        (partial if any(getattr(obj, attname) is None for attname in attnames) else complete).append(obj)
+
+    if complete and write is not None:
+        write(model, complete, update_fields)
+    elif complete:
+        # A conflict has to update something for the row to be returned;
+        # setting a key field to itself leaves the stored row as it was.
+        model.objects.bulk_create(
+            complete, batch_size=batch_size, update_conflicts=True, unique_fields=key, update_fields=update_fields or key[:1]
+        )
+    # A key with a NULL part conflicts with nothing in a unique index.
+    for obj in partial:
+        values = {field.attname: getattr(obj, field.attname) for field in model._meta.concrete_fields if not field.primary_key}
+        stored, created = model.objects.get_or_create(
+            **{attname: values.pop(attname) for attname in attnames}, defaults=values
+        )
+        if not created and update_fields:
+            for name in update_fields:
+                setattr(stored, name, getattr(obj, name))
+            stored.save(update_fields=update_fields)
+        obj.pk = stored.pk
+        obj._state.adding = False
+    catalog_upserted.send(sender=model, objs=objs)
+    return objs
+
+# A system is repointed at the reference of the last row loaded for its
+# host; every other row keeps the values of the first row that stored it.
+UPDATED_ON_CONFLICT = {PlanetarySystem: ('parameter_reference',)}
+
+
+class BulkLoader:
+    """Set-based counterpart of load_data_from_csv, writing through upsert()."""
+
+    def __init__(self, batch_size=BATCH_SIZE, stats=None):
+        self.batch_size = batch_size
+        self.stats = stats if stats is not None else IngestStats()
+        self.created = {'host': 0, 'system_parameter_reference': 0, 'discovery': 0, 'planetary_system': 0, 'planet': 0}
+        self.updated = {'planetary_system': 0}
+        self.rows = 0
+        self._preload()
+        self._reset_pending()
+
+    def _preload(self):
+        # The natural key constraints rule out duplicate keys, bar rows with
+        # NULL in a key loaded before them; the lowest pk wins like in the
+        # migration that merged the duplicates.
+        self.hosts = {}
+        for host in Host.objects.order_by('-pk').only('pk', *HOST_KEY):
+            self.hosts[(host.name, host.spectral_type)] = host
+
+        self.references = {}
+        for reference in SystemParameterReference.objects.order_by('-pk').only('pk', *SYSTEM_PARAMETER_REFERENCE_KEY):
+            self.references[tuple(getattr(reference, field) for field in SYSTEM_PARAMETER_REFERENCE_KEY)] = reference
+
+        self.discoveries = {}
+        for discovery in Discovery.objects.order_by('-pk').only('pk', *DISCOVERY_KEY):
+            self.discoveries[tuple(getattr(discovery, field) for field in DISCOVERY_KEY)] = discovery
+
+        self.systems = {
+            host_id: (pk, reference_id)
+            for pk, host_id, reference_id in PlanetarySystem.objects.values_list('pk', 'host_id', 'parameter_reference_id')
+        }
+
+        self.planets = set(Planet.objects.values_list('name', 'host_id', 'discovery_id'))
+
+    def _reset_pending(self):
+        self.new_hosts = []
+        self.new_references = []
+        self.new_discoveries = []
+        self.new_planets = {}
+        # id(host) -> (host, reference of the last row seen for it), as the
+        # row-wise loader leaves the system pointing at the last reference.
+        # Unsaved instances are unhashable, hence the id() keys.
+        self.system_references = {}
+
+    def _resolve(self, cache, pending, model, fields):
+        lookup, defaults = fields
+        key = tuple(lookup.values())
+        obj = cache.get(key)
+        if obj is None:
+            obj = model(**lookup, **defaults)
+            cache[key] = obj
+            pending.append(obj)
+        return obj
+
+    def add_row(self, row):
+        self.add_record(map_row(row))
+
+    def add_record(self, record):
+        host_pair, reference_pair, discovery_pair, (lookup, defaults) = record
+        self.rows += 1
+        host = self._resolve(self.hosts, self.new_hosts, Host, host_pair)
+        reference = self._resolve(self.references, self.new_references, SystemParameterReference, reference_pair)
+        discovery = self._resolve(self.discoveries, self.new_discoveries, Discovery, discovery_pair)
+
+        self.system_references[id(host)] = (host, reference)
+
+        key = (lookup['name'], id(host), id(discovery))
+        if key not in self.new_planets and (host.pk is None or discovery.pk is None or (lookup['name'], host.pk, discovery.pk) not in self.planets):
+            self.new_planets[key] = Planet(host=host, discovery=discovery, **lookup, **defaults)
+
+    def insert(self, model, objs):
+        upsert(model, objs, UPDATED_ON_CONFLICT.get(model, ()), self.batch_size)
+
+    def update(self, model, objs, fields):
+        model.objects.bulk_update(objs, fields, batch_size=self.batch_size)
+        catalog_upserted.send(sender=model, objs=objs)
+
+    def flush(self):
+        """Write everything queued since the last flush."""
+        for model, pending, label in (
+            (Host, self.new_hosts, 'host'),
+            (SystemParameterReference, self.new_references, 'system_parameter_reference'),
+            (Discovery, self.new_discoveries, 'discovery'),
+        ):
+            with self.stats.stage(f'write {label}'):
+                self.insert(model, pending)
+            self.created[label] += len(pending)
+
+        new_systems = []
+        changed_systems = []
+        for host, reference in self.system_references.values():
+            existing = self.systems.get(host.pk)
+            if existing is None:
+                new_systems.append(PlanetarySystem(host=host, parameter_reference=reference))
+            elif existing[1] != reference.pk:
+                changed_systems.append(PlanetarySystem(pk=existing[0], host=host, parameter_reference=reference))
+        with self.stats.stage('write planetary_system'):
+            self.insert(PlanetarySystem, new_systems)
+            self.update(PlanetarySystem, changed_systems, ['parameter_reference'])
+        for system in new_systems + changed_systems:
+            self.systems[system.host_id] = (system.pk, system.parameter_reference_id)
+        self.created['planetary_system'] += len(new_systems)
+        self.updated['planetary_system'] += len(changed_systems)
+
+        new_planets = list(self.new_planets.values())
+        with self.stats.stage('write planet'):
+            self.insert(Planet, new_planets)
+        self.planets.update((planet.name, planet.host_id, planet.discovery_id) for planet in new_planets)
+        self.created['planet'] += len(new_planets)
+
+        self._reset_pending()
+
+
+def bulk_load_records(records, batch_size=BATCH_SIZE, loader_class=BulkLoader, stats=None):
+    """Load an iterable of archive records through a BulkLoader and return it."""
+    loader = loader_class(batch_size=batch_size, stats=stats)
+    with loader.stats.stage('resolve'):
+        for record in records:
+            loader.add_record(record)
+        loader.flush()
+    return loader
+
+
+
+# Loaded models in dependency order, with the foreign keys of each mapped to
+# the label of the model they point at.
+DELTA_MODELS = {
+    'host': (Host, {}),
+    'system_parameter_reference': (SystemParameterReference, {}),
+    'discovery': (Discovery, {}),
+    'planetary_system': (PlanetarySystem, {'host': 'host', 'parameter_reference': 'system_parameter_reference'}),
+    'planet': (Planet, {'host': 'host', 'discovery': 'discovery'}),
+}
+
+def _digest(values):
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+
+class DeltaLoader:
+    """Incremental loader writing only the rows whose fingerprint changed since the last delta load."""
+
+    def __init__(self, batch_size=BATCH_SIZE, stats=None):
+        self.batch_size = batch_size
+        self.stats = stats if stats is not None else IngestStats()
+        self.rows = 0
+        self.desired = {label: {} for label in DELTA_MODELS}
+        self.pks = {label: {} for label in DELTA_MODELS}
+        self.counts = {label: {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0} for label in DELTA_MODELS}
+
+    def _want(self, label, fields):
+        lookup, defaults = fields
+        key = tuple(lookup.values())
+        self.desired[label].setdefault(key, {**lookup, **defaults})
+        return key
+
+    def add_row(self, row):
+        self.add_record(map_row(row))
+
+    def add_record(self, record):
+        host_pair, reference_pair, discovery_pair, (lookup, defaults) = record
+        self.rows += 1
+        host = self._want('host', host_pair)
+        reference = self._want('system_parameter_reference', reference_pair)
+        discovery = self._want('discovery', discovery_pair)
+        self.desired['planetary_system'][host] = {'host': host, 'parameter_reference': reference}
+
+        self.desired['planet'].setdefault(
+            (lookup['name'], host, discovery),
+            {**lookup, 'host': host, 'discovery': discovery, **defaults}
+        )
+
+    def _existing(self, label):
+        # Natural key -> pk of rows already in the database, lowest pk first.
+        model, _ = DELTA_MODELS[label]
+        if label == 'host':
+            fields = HOST_KEY
+        elif label == 'system_parameter_reference':
+            fields = SYSTEM_PARAMETER_REFERENCE_KEY
+        elif label == 'discovery':
+            fields = DISCOVERY_KEY
+        elif label == 'planetary_system':
+            fields = ('host_id',)
+        else:
+            fields = ('name', 'host_id', 'discovery_id')
+        existing = {}
+        for pk, *key in model.objects.order_by('-pk').values_list('pk', *fields):
+            existing[key[0] if len(key) == 1 else tuple(key)] = pk
+        return existing
+
+    def _db_key(self, label, key, values):
+        if label == 'planetary_system':
+            return values['host_id']
+        if label == 'planet':
+            return (values['name'], values['host_id'], values['discovery_id'])
+        return key
+
+    def _apply_model(self, label, stored):
+        model, foreign_keys = DELTA_MODELS[label]
+        counts = self.counts[label]
+        pks = self.pks[label]
+        existing = None
+        created, updated, new_fingerprints, changed_fingerprints = [], [], [], []
+
+        for key, fields in self.desired[label].items():
+            key_digest = _digest(key)
+            digest = _digest(tuple(fields.values()))
+            values = {
+                (f'{name}_id' if name in foreign_keys else name): (self.pks[foreign_keys[name]][value] if name in foreign_keys else value)
+                for name, value in fields.items()
+            }
+
+            fingerprint = stored.pop((label, key_digest), None)
+            if fingerprint is not None:
+                pks[key] = fingerprint.object_id
+                if fingerprint.digest == digest:
+                    counts['unchanged'] += 1
+                    continue
+                fingerprint.digest = digest
+                changed_fingerprints.append(fingerprint)
+                updated.append(model(pk=fingerprint.object_id, **values))
+                continue
+
+            if existing is None:
+                existing = self._existing(label)
+            pk = existing.get(self._db_key(label, key, values))
+            if pk is None:
+                created.append((key, model(**values)))
+            else:
+                pks[key] = pk
+                updated.append(model(pk=pk, **values))
+            new_fingerprints.append((key, key_digest, digest))
+
+        model.objects.bulk_create([obj for _, obj in created], batch_size=self.batch_size)
+        for key, obj in created:
+            pks[key] = obj.pk
+        if updated:
+            update_fields = list(next(iter(self.desired[label].values())))
+            model.objects.bulk_update(updated, update_fields, batch_size=self.batch_size)
+        catalog_upserted.send(sender=model, objs=[obj for _, obj in created] + updated)
+        counts['created'] += len(created)
+        counts['updated'] += len(updated)
+
+        IngestFingerprint.objects.bulk_create([
+            IngestFingerprint(label=label, key=key_digest, object_id=pks[key], digest=digest)
+            for key, key_digest, digest in new_fingerprints
+        ], batch_size=self.batch_size)
+        IngestFingerprint.objects.bulk_update(changed_fingerprints, ['digest'], batch_size=self.batch_size)
+
+    def apply(self):
+        """Write the difference between the file and the last delta load."""
+        with transaction.atomic():
+            with self.stats.stage('resolve'):
+                stored = {(fingerprint.label, fingerprint.key): fingerprint for fingerprint in IngestFingerprint.objects.all()}
+            for label in DELTA_MODELS:
+                with self.stats.stage(f'write {label}'):
+                    self._apply_model(label, stored)
+
+            # Whatever is left was loaded before but is no longer in the file.
+            for label in reversed(DELTA_MODELS):
+                model, _ = DELTA_MODELS[label]
+                gone = [fingerprint for (fingerprint_label, _), fingerprint in stored.items() if fingerprint_label == label]
+                with self.stats.stage(f'write {label}'):
+                    for start in range(0, len(gone), self.batch_size):
+                        batch = gone[start:start + self.batch_size]
+                        model.objects.filter(pk__in=[fingerprint.object_id for fingerprint in batch]).delete()
+                        IngestFingerprint.objects.filter(pk__in=[fingerprint.pk for fingerprint in batch]).delete()
+                self.counts[label]['deleted'] += len(gone)
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+@contextmanager
+def relaxed_gc(threshold=GC_THRESHOLD):
+    """Collect the young generation less often for the duration of the block."""
+    # With the default threshold, re-traversing the rows held across a load costs more than validating them.
+    saved = gc.get_threshold()
+    gc.set_threshold(threshold, *saved[1:])
+    try:
+        yield
+    finally:
+        gc.set_threshold(*saved)
+
+def iter_chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+def checkpointed_load(source, records, load_chunk, chunk_size=CHUNK_SIZE, resume=False):
+    """Feed records to load_chunk in chunks, each committed with an IngestState checkpoint; returns the IngestState."""
+    state, _ = IngestState.objects.get_or_create(file_hash=file_sha256(source), defaults={'source': source})
+    if not resume:
+        state.rows_committed = 0
+        state.completed = False
+    state.source = source
+    state.save()
+    if state.completed:
+        return state
+
+    for chunk in iter_chunks(islice(records, state.rows_committed, None), chunk_size):
+        with transaction.atomic():
+            load_chunk(chunk)
+            state.rows_committed += len(chunk)
+            state.save(update_fields=['rows_committed', 'updated_at'])
+
+    state.completed = True
+    state.save(update_fields=['completed', 'updated_at'])
+    return state
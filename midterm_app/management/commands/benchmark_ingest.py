@@ -0,0 +1,163 @@
+import csv
+import os
+import resource
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from ...ingest import COMPRESSED_OPENERS, BulkLoader, bulk_load_records, compile_mapping, iter_archive_records, iter_chunks, map_row, open_archive
+from ...models import Host, Discovery, Planet, SystemParameterReference, PlanetarySystem
+from ...postgres_bulk import PostgresCopyLoader
+from ...sqlite_bulk import SqliteBulkLoader, fast_sqlite
+from ...validation import VALIDATION_BATCH, validate_batch
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+class Command(BaseCommand):
+    help = 'Benchmark the ingest stages of load_data on a csv file; writes only go to a scratch copy of the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file_path', type=str, help='The path to the csv file to benchmark with')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark; the fastest is reported')
+        parser.add_argument('--workers', type=int, default=1, help='Also benchmark parsing in N processes')
+        parser.add_argument('--inputs', action='store_true', help='Also benchmark reading buffered, memory-mapped and compressed copies of the file')
+        parser.add_argument('--cache', action='store_true', help='Also benchmark loading the records from a warm parse cache')
+        parser.add_argument('--mapping', action='store_true', help='Also benchmark mapping rows already read into memory, by field name and through the compiled mapping')
+        parser.add_argument('--validate', action='store_true', help='Also benchmark parsing followed by batch validation, as load_data --validate does')
+        parser.add_argument('--writes', action='store_true', help='Also benchmark writing the records into an empty scratch database, through the ORM and through --fast-sqlite or --copy')
+
+    def handle(self, *args, **kwargs):
+        csv_file_path = kwargs['csv_file_path']
+        repeat = kwargs['repeat']
+        workers = kwargs['workers']
+
+        # Inputs go first so the peak RSS they report is not the parsers'.
+        if kwargs['inputs']:
+            size = os.path.getsize(csv_file_path)
+            report(self, 'read (buffered)', repeat, lambda: read_buffered(csv_file_path), size)
+            report(self, 'read (mmap)', repeat, lambda: read_rows(csv_file_path), size)
+            with tempfile.TemporaryDirectory() as directory:
+                for extension, opener in COMPRESSED_OPENERS.items():
+                    path = os.path.join(directory, os.path.basename(csv_file_path) + extension)
+                    with open(csv_file_path, 'rb') as source, opener(path, 'wb') as target:
+                        shutil.copyfileobj(source, target)
+                    report(self, f'read ({extension[1:]})', repeat, lambda: read_rows(path), size)
+
+        for parser in ('csv', 'pandas'):
+            report(self, f'parse ({parser})', repeat, lambda: parse_rows(csv_file_path, parser))
+            if workers > 1:
+                report(self, f'parse ({parser}, {workers} workers)', repeat, lambda: parse_rows(csv_file_path, parser, workers))
+
+        if kwargs['mapping']:
+            with open_archive(csv_file_path) as lines:
+                rows = list(csv.reader(lines))
+            header, rows = rows[0], [row for row in rows[1:] if row]
+            dicts = [dict(zip(header, row)) for row in rows]
+            report(self, 'map (by name)', repeat, lambda: map_by_name(dicts))
+            report(self, 'map (compiled)', repeat, lambda: map_compiled(header, rows))
+
+        if kwargs['validate']:
+            report(self, 'parse + validate (csv)', repeat, lambda: validate_rows(csv_file_path))
+
+        if kwargs['cache']:
+            with tempfile.TemporaryDirectory() as directory:
+                parse_rows(csv_file_path, 'pandas', cache_dir=directory)
+                report(self, 'parse (cached)', repeat, lambda: parse_rows(csv_file_path, 'pandas', cache_dir=directory))
+
+        if kwargs['writes']:
+            if connection.vendor not in ('sqlite', 'postgresql'):
+                raise CommandError(f'--writes benchmarks the sqlite and postgresql backends, not {connection.vendor}')
+            records = list(iter_archive_records(csv_file_path))
+            with scratch_database():
+                report(self, 'write (bulk)', repeat, lambda: write_rows(records, BulkLoader), setup=clear_catalog)
+                if connection.vendor == 'sqlite':
+                    report(self, 'write (fast sqlite)', repeat, lambda: write_rows(records, SqliteBulkLoader, fast=True), setup=clear_catalog)
+                else:
+                    report(self, 'write (copy)', repeat, lambda: write_rows(records, PostgresCopyLoader), setup=clear_catalog)
+
+def parse_rows(csv_file_path, parser, workers=1, cache_dir=None):
+    rows = 0
+    for _ in iter_archive_records(csv_file_path, parser, workers, cache_dir):
+        rows += 1
+    return rows
+
+def validate_rows(csv_file_path):
+    rows = 0
+    for batch in iter_chunks(iter_archive_records(csv_file_path), VALIDATION_BATCH):
+        valid, _ = validate_batch(batch)
+        rows += len(valid)
+    return rows
+
+def map_by_name(dicts):
+    for row in dicts:
+        map_row(row)
+    return len(dicts)
+
+def map_compiled(header, rows):
+    # Compiling is part of the cost: it happens once per file.
+    map_values = compile_mapping(header)
+    for row in rows:
+        map_values(row)
+    return len(rows)
+
+def read_buffered(csv_file_path):
+    with open(csv_file_path, 'r') as file:
+        return sum(1 for _ in csv.reader(file)) - 1
+
+def read_rows(csv_file_path):
+    with open_archive(csv_file_path) as lines:
+        return sum(1 for _ in csv.reader(lines)) - 1
+
+@contextmanager
+def scratch_database():
+    """Point the default connection at a scratch database for the duration of the block."""
+    if connection.vendor != 'sqlite':
+        # A migrated throwaway database next to the real one, like the test runner's.
+        original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(original, verbosity=0)
+        return
+
+    # A copy of the database file, so the timings include its real journaling.
+    settings = connection.settings_dict
+    original = settings['NAME']
+    with tempfile.TemporaryDirectory() as directory:
+        connection.close()
+        settings['NAME'] = os.path.join(directory, 'db.sqlite3')
+        if os.path.exists(original):
+            shutil.copyfile(original, settings['NAME'])
+        try:
+            call_command('migrate', verbosity=0)
+            yield
+        finally:
+            connection.close()
+            settings['NAME'] = original
+
+def clear_catalog():
+    with connection.cursor() as cursor:
+        for model in (Planet, PlanetarySystem, Host, Discovery, SystemParameterReference):
+            cursor.execute(f'DELETE FROM "{model._meta.db_table}"')
+
+def write_rows(records, loader_class, fast=False):
+    with fast_sqlite() if fast else nullcontext():
+        return bulk_load_records(records, loader_class=loader_class).rows
+
+def report(self, label, repeat, run, size=None, setup=None):
+    """Print the fastest of repeat runs; size is the uncompressed input in bytes."""
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        rows = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    line = f'{label:<28} {rows:>9} rows {best:>8.3f} s {rows / best:>12.0f} rows/s'
+    if size is not None:
+        # ru_maxrss is the peak so far, in KiB on Linux; it only grows if this stage needed more memory.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        line += f' {size / best / 2 ** 20:>8.1f} MiB/s  peak RSS {peak:.0f} MiB'
+    self.stdout.write(line)
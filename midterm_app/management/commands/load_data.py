@@ -1,117 +1,191 @@
-import csv
-from datetime import datetime
-import re
 from ...models import Host, Discovery, Planet, SystemParameterReference, PlanetarySystem
-from django.core.management.base import BaseCommand
-from django.core.exceptions import ObjectDoesNotExist
+from ...ingest import (
+    BATCH_SIZE, CHUNK_SIZE, BulkLoader, DeltaLoader, MissingColumnsError, bulk_load_records, checkpointed_load,
+    iter_archive_records, relaxed_gc, upsert,
+)
+from ...postgres_bulk import PostgresCopyLoader
+from ...read_model import deferred, rebuild_read_models, refresh_read_models
+from ...shadow import ShadowCatalog
+from ...sqlite_bulk import SqliteBulkLoader, fast_sqlite, restore_dropped_indexes
+from ...telemetry import IngestStats
+from ...validation import Quarantine, validate_records
+from contextlib import nullcontext
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand, CommandError
 
 class Command(BaseCommand):
     help = 'Load data from csv file'
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file_path', type=str, help='The path to the csv file to load data from')
+        parser.add_argument('--bulk', action='store_true', help='Resolve natural keys in memory and write with bulk_create/bulk_update')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per bulk_create/bulk_update statement in bulk mode')
+        parser.add_argument('--chunk-size', type=int, help=f'Commit every N rows in one transaction and record a checkpoint (default {CHUNK_SIZE} with --resume)')
+        parser.add_argument('--resume', action='store_true', help='Skip the rows committed by an earlier interrupted run of the same file')
+        parser.add_argument('--delta', action='store_true', help='Only write rows that were added, changed or removed since the last delta load')
+        parser.add_argument('--parser', choices=['csv', 'pandas'], default='csv', help='Parse rows one by one with the csv module, or in column-typed chunks with pandas')
+        parser.add_argument('--workers', type=int, default=1, help='Parse the file in N processes, a block of rows at a time; writes stay in one process')
+        parser.add_argument('--cache-dir', help='Cache the parsed columns of the file in this directory and reuse them on later loads of the same file (parses with pandas)')
+        parser.add_argument('--fast-sqlite', action='store_true', help='Bulk load with relaxed SQLite journaling, deferred index builds and executemany writes (implies --bulk); a crash or power loss can lose the last writes, and the next load rebuilds the indexes a killed run dropped')
+        parser.add_argument('--copy', action='store_true', help='Bulk load through COPY into staging tables merged with INSERT ... ON CONFLICT on PostgreSQL (implies --bulk)')
+        parser.add_argument('--shadow', action='store_true', help='Load into shadow copies of the catalog tables and swap them in atomically at the end, so readers never see a partial load')
+        parser.add_argument('--validate', action='store_true', help='Check every row against the validation rules and quarantine the failing ones instead of loading them')
+        parser.add_argument('--progress-interval', type=float, default=5.0, help='Seconds between progress lines; 0 turns them off (per-row lines need --verbosity 2)')
+        parser.add_argument('--report', help='Write the stage timings, query counts, throughput and peak memory of the load to this JSON file')
 
     def handle(self, *args, **kwargs):
-        csv_file_path = kwargs['csv_file_path']
-        load_data_from_csv(self, csv_file_path)
-
-def parse_float(value, default=None):
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return default
-
-def parse_int(value, default=None):
-    try:
-        return int(value)
-    except (ValueError, TypeError):
-        return default
-
-def parse_date(value, format='%Y-%m-%d', default=None):
-    try:
-        return datetime.strptime(value, format).date()
-    except (ValueError, TypeError):
-        return default
-
-def load_data_from_csv(self, csv_file_path):
-    with open(csv_file_path, 'r') as file:
-        reader = csv.DictReader(file)
-
-        for row in reader:
-            host, _ = Host.objects.get_or_create(
-                name=row.get('hostname'),
-                spectral_type=row.get('st_spectype', ''),
-                defaults={
-                    'effective_temperature': parse_float(row.get('st_teff')),
-                    'radius': parse_float(row.get('st_rad')),
-                    'mass': parse_float(row.get('st_mass')),
-                    'metallicity': parse_float(row.get('st_met')),
-                    'metallicity_ratio': row.get('st_metratio', ''),
-                    'surface_gravity': parse_float(row.get('st_logg')),
-                    'distance': parse_float(row.get('sy_dist')),
-                    'v_magnitude': parse_float(row.get('sy_vmag')),
-                    'k_magnitude': parse_float(row.get('sy_kmag')),
-                    'gaia_magnitude': parse_float(row.get('sy_gaiamag'))
-                }
-            )
+        loader_class = BulkLoader
+        for option, flag, vendor, backend_loader in (
+            ('fast_sqlite', '--fast-sqlite', 'sqlite', SqliteBulkLoader),
+            ('copy', '--copy', 'postgresql', PostgresCopyLoader),
+        ):
+            if not kwargs[option]:
+                continue
+            if connection.vendor != vendor:
+                raise CommandError(f'{flag} needs the {vendor} backend, not {connection.vendor}')
+            if kwargs['delta']:
+                raise CommandError(f'{flag} cannot be combined with --delta')
+            kwargs['bulk'] = True
+            loader_class = backend_loader
+        if kwargs['validate'] and kwargs['delta']:
+            # Quarantined rows would read as rows removed from the file.
+            raise CommandError('--validate cannot be combined with --delta')
+        if kwargs['shadow'] and (kwargs['delta'] or kwargs['chunk_size'] or kwargs['resume']):
+            # Fingerprints and checkpoints live outside the shadow tables.
+            raise CommandError('--shadow cannot be combined with --delta, --chunk-size or --resume')
 
-            system_param_ref, _ = SystemParameterReference.objects.get_or_create(
-                name=row.get('sy_refname', ''),
-                right_ascension=row.get('rastr', ''),
-                ra_degrees=parse_float(row.get('ra')),
-                declination=row.get('decstr', ''),
-                dec_degrees=parse_float(row.get('dec')),
-                defaults={
-                    'row_update': parse_date(row.get('rowupdate')),
-                    'planet_publication_date': parse_date(row.get('pl_pubdate'), '%Y-%m'),
-                    'release_date': parse_date(row.get('releasedate'))
-                }
-            )
+        if connection.vendor == 'sqlite':
+            restore_dropped_indexes()
+        self.verbosity = kwargs['verbosity']
+        interval = kwargs['progress_interval']
+        self.stats = IngestStats(progress=self.stdout.write if interval > 0 and self.verbosity > 0 else None, interval=interval)
+        self.quarantine = None
+        try:
+            # The read models are refreshed once the catalog is in rather than on every write.
+            with relaxed_gc(), connection.execute_wrapper(self.stats.count_query), deferred() as changes:
+                if kwargs['validate']:
+                    self.quarantine = Quarantine(kwargs['csv_file_path'], kwargs['resume'], self.stats)
+                if kwargs['shadow']:
+                    self.shadow_load(loader_class, **kwargs)
+                else:
+                    with fast_sqlite() if kwargs['fast_sqlite'] else nullcontext():
+                        self.load(loader_class, **kwargs)
+                    if kwargs['resume']:
+                        # The chunks an earlier run committed never got their read models.
+                        rebuild_read_models(self.stats)
+                    else:
+                        refresh_read_models(changes, self.stats)
+        except MissingColumnsError as error:
+            raise CommandError(f'{kwargs["csv_file_path"]}: {error}')
 
-            discovery, created = Discovery.objects.get_or_create(
-                method=row.get('discoverymethod', ''),
-                year=parse_int(row.get('disc_year')),
-                reference_name=row.get('disc_refname', ''),
-                defaults={
-                    'facility': row.get('disc_facility', ''),
-                    'telescope': row.get('disc_telescope', '')
-                }
+        if self.quarantine is not None:
+            reasons = ', '.join(f'{code} ({count})' for code, count in self.quarantine.counts.most_common())
+            self.stdout.write(self.style.WARNING(f'Quarantined {self.quarantine.rows} rows' + (f': {reasons}' if reasons else '')))
+        if self.verbosity > 0:
+            for line in self.stats.summary_lines():
+                self.stdout.write(line)
+        if kwargs['report']:
+            mode = next((name for name in ('delta', 'fast_sqlite', 'copy', 'bulk') if kwargs[name]), 'row-wise')
+            self.stats.write_report(
+                kwargs['report'], source=kwargs['csv_file_path'], mode=mode, chunk_size=kwargs['chunk_size'], parser=kwargs['parser'], workers=kwargs['workers'],
+                quarantined=None if self.quarantine is None else dict(self.quarantine.counts, rows=self.quarantine.rows),
             )
 
-            if not created:
-                self.stdout.write(self.style.WARNING(f'Discovery already exists: {discovery}'))
+    def shadow_load(self, loader_class, **kwargs):
+        shadow = ShadowCatalog(stats=self.stats)
+        try:
+            shadow.create()
+            with shadow.patched():
+                with fast_sqlite() if kwargs['fast_sqlite'] else nullcontext():
+                    self.load(loader_class, **kwargs)
+            shadow.build_indexes()
+            # Readers see the new catalog and its read models together.
+            with transaction.atomic():
+                shadow.swap()
+                rebuild_read_models(self.stats)
+        except BaseException:
+            shadow.discard()
+            raise
+        self.stdout.write(self.style.SUCCESS('Swapped in the new catalog; rollback_catalog restores the previous one'))
 
-            planetary_system, created = PlanetarySystem.objects.get_or_create(
-                host=host,
-                defaults={'parameter_reference': system_param_ref}
-            )
+    def load(self, loader_class, **kwargs):
+        csv_file_path = kwargs['csv_file_path']
+        if kwargs['delta']:
+            if kwargs['chunk_size'] or kwargs['resume']:
+                raise CommandError('--delta compares the whole file and cannot be combined with --chunk-size or --resume')
+            delta_load_data_from_csv(self, csv_file_path, kwargs['batch_size'], kwargs['parser'], kwargs['workers'], kwargs['cache_dir'])
+        elif kwargs['chunk_size'] or kwargs['resume']:
+            chunked_load_data_from_csv(self, csv_file_path, kwargs['chunk_size'] or CHUNK_SIZE, kwargs['resume'], kwargs['bulk'], kwargs['batch_size'], kwargs['parser'], kwargs['workers'], kwargs['cache_dir'], loader_class)
+        elif kwargs['bulk']:
+            bulk_load_data_from_csv(self, csv_file_path, kwargs['batch_size'], kwargs['parser'], kwargs['workers'], kwargs['cache_dir'], loader_class)
+        else:
+            load_data_from_csv(self, csv_file_path, kwargs['parser'], kwargs['workers'], kwargs['cache_dir'])
 
-            if not created:
-                planetary_system.parameter_reference = system_param_ref
-                planetary_system.save()
-
-            Planet.objects.get_or_create(
-                name=row.get('pl_name', ''),
-                host=host,
-                discovery=discovery,
-                defaults={
-                    'default_flag': bool(parse_int(row.get('default_flag', 0))),
-                    'controversial_flag': bool(parse_int(row.get('pl_controv_flag', 0))),
-                    'parameter_reference': row.get('pl_refname', ''),
-                    'orbital_period': parse_float(row.get('pl_orbper')),
-                    'semi_major_axis': parse_float(row.get('pl_orbsmax')),
-                    'radius': parse_float(row.get('pl_rade')),
-                    'mass': parse_float(row.get('pl_masse')),
-                    'mass_sin_i_earth': parse_float(row.get('pl_bmasse')),
-                    'mass_sin_i_jupiter': parse_float(row.get('pl_bmassj')),
-                    'mass_provenance': row.get('pl_bmassprov', ''),
-                    'eccentricity': parse_float(row.get('pl_orbeccen')),
-                    'insolation_flux': parse_float(row.get('pl_insol')),
-                    'equilibrium_temperature': parse_float(row.get('pl_eqt')),
-                    'inclination': parse_float(row.get('pl_orbincl')),
-                    'ttv_flag': bool(parse_int(row.get('ttv_flag', 0))),
-                    'transit_duration': parse_float(row.get('pl_trandur'))
-                }
-            )
+def archive_records(self, csv_file_path, parser, workers, cache_dir):
+    records = iter_archive_records(csv_file_path, parser, workers, cache_dir, self.stats)
+    if self.quarantine is not None:
+        records = validate_records(records, self.quarantine)
+    return records
+
+def load_data_from_csv(self, csv_file_path, parser='csv', workers=1, cache_dir=None):
+    for record in archive_records(self, csv_file_path, parser, workers, cache_dir):
+        import_record(self, record)
+
+def import_record(self, record):
+    (host_lookup, host_defaults), (reference_lookup, reference_defaults), (discovery_lookup, discovery_defaults), (planet_lookup, planet_defaults) = record
+    # One upsert per model: existing rows are matched on their natural key
+    # and kept as they are, except for the system's parameter reference.
+    with self.stats.stage('write host'):
+        host, = upsert(Host, [Host(**host_lookup, **host_defaults)])
+    with self.stats.stage('write system_parameter_reference'):
+        system_param_ref, = upsert(SystemParameterReference, [SystemParameterReference(**reference_lookup, **reference_defaults)])
+    with self.stats.stage('write discovery'):
+        discovery, = upsert(Discovery, [Discovery(**discovery_lookup, **discovery_defaults)])
+
+    with self.stats.stage('write planetary_system'):
+        upsert(PlanetarySystem, [PlanetarySystem(host=host, parameter_reference=system_param_ref)], ['parameter_reference'])
+
+    with self.stats.stage('write planet'):
+        upsert(Planet, [Planet(**planet_lookup, host=host, discovery=discovery, **planet_defaults)])
+
+    if self.verbosity > 1:
+        self.stdout.write(self.style.SUCCESS(f'Successfully imported {planet_lookup["name"] or "Unknown"}'))
+
+def bulk_load_data_from_csv(self, csv_file_path, batch_size=BATCH_SIZE, parser='csv', workers=1, cache_dir=None, loader_class=BulkLoader):
+    records = archive_records(self, csv_file_path, parser, workers, cache_dir)
+    loader = bulk_load_records(records, batch_size=batch_size, loader_class=loader_class, stats=self.stats)
+
+    for label, count in loader.created.items():
+        self.stdout.write(f'{label}: {count} created')
+    self.stdout.write(f'planetary_system: {loader.updated["planetary_system"]} updated')
+    self.stdout.write(self.style.SUCCESS(f'Successfully imported {loader.rows} rows'))
+
+def chunked_load_data_from_csv(self, csv_file_path, chunk_size, resume=False, bulk=False, batch_size=BATCH_SIZE, parser='csv', workers=1, cache_dir=None, loader_class=BulkLoader):
+    if bulk:
+        loader = loader_class(batch_size=batch_size, stats=self.stats)
+
+        def load_chunk(records):
+            with self.stats.stage('resolve'):
+                for record in records:
+                    loader.add_record(record)
+                loader.flush()
+    else:
+        def load_chunk(records):
+            for record in records:
+                import_record(self, record)
+
+    records = archive_records(self, csv_file_path, parser, workers, cache_dir)
+    state = checkpointed_load(csv_file_path, records, load_chunk, chunk_size, resume)
+
+    self.stdout.write(self.style.SUCCESS(f'Committed {state.rows_committed} rows from {csv_file_path}'))
+
+def delta_load_data_from_csv(self, csv_file_path, batch_size=BATCH_SIZE, parser='csv', workers=1, cache_dir=None):
+    loader = DeltaLoader(batch_size=batch_size, stats=self.stats)
+    with self.stats.stage('resolve'):
+        for record in iter_archive_records(csv_file_path, parser, workers, cache_dir, self.stats):
+            loader.add_record(record)
+        loader.apply()
 
-            self.stdout.write(self.style.SUCCESS(f'Successfully imported {row.get("pl_name", "Unknown")}'))
+    for label, counts in loader.counts.items():
+        self.stdout.write(f'{label}: ' + ', '.join(f'{count} {action}' for action, count in counts.items()))
+    self.stdout.write(self.style.SUCCESS(f'Successfully compared {loader.rows} rows'))
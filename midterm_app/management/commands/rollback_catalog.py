@@ -0,0 +1,16 @@
+from ...read_model import rebuild_read_models
+from ...shadow import rollback_catalog
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+class Command(BaseCommand):
+    help = 'Swap back the catalog tables replaced by the last load_data --shadow run'
+
+    def handle(self, *args, **kwargs):
+        try:
+            with transaction.atomic():
+                rollback_catalog()
+                rebuild_read_models()
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS('Restored the previous catalog; running rollback_catalog again undoes this'))
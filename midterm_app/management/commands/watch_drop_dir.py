@@ -0,0 +1,169 @@
+import os
+import signal
+import threading
+import traceback
+from itertools import chain
+from ...ingest import BATCH_SIZE, COMPRESSED_OPENERS, bulk_load_records, iter_archive_records, relaxed_gc
+from ...read_model import deferred, refresh_read_models
+from ...telemetry import IngestStats
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, transaction
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+ARCHIVE_EXTENSIONS = ('.csv',) + tuple(f'.csv{extension}' for extension in COMPRESSED_OPENERS)
+
+class Command(BaseCommand):
+    help = 'Watch a drop directory and bulk load the archive CSV files that appear in it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('drop_dir', type=str, help='The directory new csv files are dropped into')
+        parser.add_argument('--processed-dir', help='Where loaded files are moved (default DROP_DIR/processed)')
+        parser.add_argument('--failed-dir', help='Where files that failed to load are moved, with a .error file next to them (default DROP_DIR/failed)')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between scans of the directory; a file is picked up once its size and mtime held still for one interval')
+        parser.add_argument('--max-files', type=int, default=50, help='Most files loaded together in one transaction')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per bulk_create/bulk_update statement')
+        parser.add_argument('--polling', action='store_true', help='Only poll, even when watchdog is installed to wake up on file system events')
+        parser.add_argument('--once', action='store_true', help='Load the files already in the directory and exit, without waiting for them to settle')
+
+    def handle(self, *args, **kwargs):
+        drop_dir = kwargs['drop_dir']
+        if not os.path.isdir(drop_dir):
+            raise CommandError(f'{drop_dir} is not a directory')
+        self.processed_dir = kwargs['processed_dir'] or os.path.join(drop_dir, 'processed')
+        self.failed_dir = kwargs['failed_dir'] or os.path.join(drop_dir, 'failed')
+        self.batch_size = kwargs['batch_size']
+        os.makedirs(self.processed_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+        self.max_files = kwargs['max_files']
+        self.stopping = False
+        if kwargs['once']:
+            ingest_ready(self, archive_files(drop_dir))
+            return
+
+        # Set by file system events and on shutdown; otherwise the wait for
+        # it times out after one interval and the directory is polled.
+        wake = threading.Event()
+
+        def stop(*args):
+            self.stopping = True
+            wake.set()
+        previous_handler = signal.signal(signal.SIGTERM, stop)
+
+        observer = None
+        if Observer is not None and not kwargs['polling']:
+            observer = Observer()
+            observer.schedule(WakeHandler(wake), drop_dir)
+            observer.start()
+        self.stdout.write(f'Watching {drop_dir} ({"file system events" if observer else "polling"} every {kwargs["interval"]} s)')
+
+        seen = {}
+        try:
+            while not self.stopping:
+                ready, seen = settled_files(drop_dir, seen)
+                ingest_ready(self, ready)
+                wake.wait(kwargs['interval'])
+                wake.clear()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            if observer is not None:
+                observer.stop()
+                observer.join()
+        self.stdout.write('Stopped watching')
+
+if Observer is not None:
+    class WakeHandler(FileSystemEventHandler):
+        def __init__(self, wake):
+            self.wake = wake
+
+        def on_any_event(self, event):
+            self.wake.set()
+
+def archive_files(drop_dir):
+    """Archive files directly in drop_dir, oldest first; dotfiles are partial uploads."""
+    entries = [
+        entry for entry in os.scandir(drop_dir)
+        if entry.is_file() and not entry.name.startswith('.') and entry.name.lower().endswith(ARCHIVE_EXTENSIONS)
+    ]
+    return [entry.path for entry in sorted(entries, key=lambda entry: (entry.stat().st_mtime_ns, entry.name))]
+
+def settled_files(drop_dir, seen):
+    """The files of drop_dir unchanged since the previous scan (seen), and the state of this scan."""
+    current = {}
+    for path in archive_files(drop_dir):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        current[path] = (stat.st_size, stat.st_mtime_ns)
+    return [path for path, state in current.items() if seen.get(path) == state], current
+
+def ingest_ready(self, paths):
+    """Load paths in transactions of at most max_files files, a burst of drops at a time."""
+    while paths and not self.stopping:
+        ingest_files(self, paths[:self.max_files])
+        paths = paths[self.max_files:]
+
+def ingest_files(self, paths):
+    """Load paths in one transaction, or one by one if that fails, so only the files at fault are moved aside."""
+    if not paths:
+        return
+    refresh_connection()
+    try:
+        load_files(self, paths)
+    except Exception:
+        if len(paths) == 1:
+            fail_file(self, paths[0], traceback.format_exc())
+            return
+        for path in paths:
+            try:
+                load_files(self, [path])
+            except Exception:
+                fail_file(self, path, traceback.format_exc())
+    finally:
+        refresh_connection()
+
+def refresh_connection():
+    # Drop a connection the database closed or that outlived CONN_MAX_AGE
+    # while the daemon slept. Inside an atomic block (a caller's
+    # transaction) autocommit is off, which would look unusable, so leave it.
+    if not connection.in_atomic_block:
+        close_old_connections()
+
+def load_files(self, paths):
+    stats = IngestStats()
+    with relaxed_gc(), transaction.atomic(), deferred() as changes:
+        records = chain.from_iterable(iter_archive_records(path, stats=stats) for path in paths)
+        loader = bulk_load_records(records, batch_size=self.batch_size, stats=stats)
+        refresh_read_models(changes, stats)
+    for path in paths:
+        move_file(path, self.processed_dir)
+    created = ', '.join(f'{count} {label}' for label, count in loader.created.items() if count)
+    self.stdout.write(self.style.SUCCESS(
+        f'Loaded {len(paths)} file{"s" if len(paths) > 1 else ""}, {loader.rows} rows in {stats.elapsed:.2f} s'
+        f' (created {created or "nothing"}, {loader.updated["planetary_system"]} systems updated)'
+    ))
+
+def fail_file(self, path, error):
+    target = move_file(path, self.failed_dir)
+    with open(f'{target}.error', 'w') as file:
+        file.write(error)
+    self.stderr.write(f'Failed to load {os.path.basename(path)}, moved to {target}: {error.strip().splitlines()[-1]}')
+
+def move_file(path, directory):
+    """Move path into directory without overwriting an earlier file of the same name."""
+    name = os.path.basename(path)
+    target = os.path.join(directory, name)
+    number = 0
+    while os.path.exists(target):
+        number += 1
+        target = os.path.join(directory, f'{name}.{number}')
+    os.replace(path, target)
+    return target
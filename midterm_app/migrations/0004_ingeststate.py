@@ -0,0 +1,24 @@
+# Generated by Django 5.0.4 on 2026-10-18 09:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0003_alter_planet_discovery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=1024)),
+                ('file_hash', models.CharField(max_length=64, unique=True)),
+                ('rows_committed', models.PositiveIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0004_ingeststate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=64)),
+                ('key', models.CharField(max_length=40)),
+                ('object_id', models.BigIntegerField()),
+                ('digest', models.CharField(max_length=40)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ingestfingerprint',
+            constraint=models.UniqueConstraint(fields=('label', 'key'), name='unique_ingest_fingerprint'),
+        ),
+    ]
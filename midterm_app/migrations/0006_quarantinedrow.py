@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:10
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0005_ingestfingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuarantinedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=1024)),
+                ('row_number', models.PositiveIntegerField()),
+                ('reasons', models.CharField(max_length=255)),
+                ('record', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='quarantinedrow',
+            constraint=models.UniqueConstraint(fields=('source', 'row_number'), name='unique_quarantined_row'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0006_quarantinedrow'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discovery',
+            index=models.Index(fields=['method', 'year'], name='discovery_method_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discovery',
+            index=models.Index(fields=['year'], name='discovery_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='host',
+            index=models.Index(fields=['distance'], name='host_distance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planet',
+            index=models.Index(fields=['mass'], name='planet_mass_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planet',
+            index=models.Index(fields=['radius'], name='planet_radius_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planet',
+            index=models.Index(fields=['equilibrium_temperature'], name='planet_temperature_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planet',
+            index=models.Index(condition=models.Q(('controversial_flag', True)), fields=['host'], name='planet_controversial_idx'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:34
+
+from collections import defaultdict
+
+from django.db import migrations
+
+
+def duplicates(model, fields, key=tuple):
+    """{pk of every duplicate row: lowest pk with the same natural key}, NULLs comparing equal as in get_or_create."""
+    kept, merged = {}, {}
+    for pk, *values in model.objects.order_by('pk').values_list('pk', *fields):
+        values = key(values)
+        if values in kept:
+            merged[pk] = kept[values]
+        else:
+            kept[values] = pk
+    return merged
+
+def repoint(model, field, merged):
+    """Point the field of the rows of model referencing a duplicate at the row kept instead."""
+    by_kept = defaultdict(list)
+    for duplicate, kept in merged.items():
+        by_kept[kept].append(duplicate)
+    for kept, duplicates in by_kept.items():
+        model.objects.filter(**{f'{field}__in': duplicates}).update(**{field: kept})
+
+def remove(model, label, merged, IngestFingerprint):
+    # Delta loads adopt the remaining row by its natural key next time.
+    model.objects.filter(pk__in=list(merged)).delete()
+    IngestFingerprint.objects.filter(label=label, object_id__in=list(merged)).delete()
+
+def reference_key(values):
+    name, right_ascension, ra_degrees, declination, dec_degrees = values
+    # As in the unique_reference_without_degrees constraint.
+    if ra_degrees is None or dec_degrees is None:
+        return name, right_ascension, None, declination, None
+    return tuple(values)
+
+def merge_duplicates(apps, schema_editor):
+    Host = apps.get_model('midterm_app', 'Host')
+    SystemParameterReference = apps.get_model('midterm_app', 'SystemParameterReference')
+    Discovery = apps.get_model('midterm_app', 'Discovery')
+    PlanetarySystem = apps.get_model('midterm_app', 'PlanetarySystem')
+    Planet = apps.get_model('midterm_app', 'Planet')
+    IngestFingerprint = apps.get_model('midterm_app', 'IngestFingerprint')
+
+    merged = duplicates(Host, ('name', 'spectral_type'))
+    # A host has one system: the kept host keeps its own, or takes over one of its duplicates'.
+    systems = dict(PlanetarySystem.objects.filter(host_id__in=[*merged, *merged.values()]).values_list('host_id', 'pk'))
+    merged_systems = {}
+    for duplicate, kept in merged.items():
+        if duplicate not in systems:
+            continue
+        if kept in systems:
+            merged_systems[systems.pop(duplicate)] = systems[kept]
+        else:
+            systems[kept] = systems.pop(duplicate)
+            PlanetarySystem.objects.filter(pk=systems[kept]).update(host_id=kept)
+    remove(PlanetarySystem, 'planetary_system', merged_systems, IngestFingerprint)
+    repoint(Planet, 'host_id', merged)
+    remove(Host, 'host', merged, IngestFingerprint)
+
+    merged = duplicates(SystemParameterReference, ('name', 'right_ascension', 'ra_degrees', 'declination', 'dec_degrees'), reference_key)
+    repoint(PlanetarySystem, 'parameter_reference_id', merged)
+    remove(SystemParameterReference, 'system_parameter_reference', merged, IngestFingerprint)
+
+    merged = duplicates(Discovery, ('method', 'year', 'reference_name'))
+    repoint(Planet, 'discovery_id', merged)
+    remove(Discovery, 'discovery', merged, IngestFingerprint)
+
+    # Planets of merged hosts and discoveries may now collide as well.
+    remove(Planet, 'planet', duplicates(Planet, ('name', 'host_id', 'discovery_id')), IngestFingerprint)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0007_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
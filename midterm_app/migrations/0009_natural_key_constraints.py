@@ -0,0 +1,37 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0008_merge_duplicate_natural_keys'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='discovery',
+            constraint=models.UniqueConstraint(fields=('method', 'year', 'reference_name'), name='unique_discovery_natural_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='discovery',
+            constraint=models.UniqueConstraint(condition=models.Q(('year__isnull', True)), fields=('method', 'reference_name'), name='unique_discovery_without_year'),
+        ),
+        migrations.AddConstraint(
+            model_name='host',
+            constraint=models.UniqueConstraint(fields=('name', 'spectral_type'), name='unique_host_natural_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='planet',
+            constraint=models.UniqueConstraint(fields=('name', 'host', 'discovery'), name='unique_planet_natural_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='systemparameterreference',
+            constraint=models.UniqueConstraint(fields=('name', 'right_ascension', 'ra_degrees', 'declination', 'dec_degrees'), name='unique_reference_natural_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='systemparameterreference',
+            constraint=models.UniqueConstraint(condition=models.Q(('ra_degrees__isnull', True), ('dec_degrees__isnull', True), _connector='OR'), fields=('name', 'right_ascension', 'declination'), name='unique_reference_without_degrees'),
+        ),
+    ]
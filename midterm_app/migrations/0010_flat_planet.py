@@ -0,0 +1,141 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def source_lookup(column):
+    """The Planet lookup a FlatPlanet column is copied from."""
+    if column == 'planet_id':
+        return 'id'
+    if column in ('host_id', 'discovery_id'):
+        return column
+    if column.startswith('reference_'):
+        return 'host__system__parameter_reference__' + column[len('reference_'):]
+    for prefix in ('host_', 'discovery_'):
+        if column.startswith(prefix):
+            return f'{prefix[:-1]}__{column[len(prefix):]}'
+    return column
+
+def populate_flat_planets(apps, schema_editor):
+    Planet = apps.get_model('midterm_app', 'Planet')
+    FlatPlanet = apps.get_model('midterm_app', 'FlatPlanet')
+    qn = schema_editor.connection.ops.quote_name
+    columns = [field.column for field in FlatPlanet._meta.concrete_fields]
+    sql, params = Planet.objects.order_by().values_list(*map(source_lookup, columns)).query.sql_with_params()
+    schema_editor.execute(f'INSERT INTO {qn(FlatPlanet._meta.db_table)} ({", ".join(map(qn, columns))}) {sql}', params)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0009_natural_key_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlatPlanet',
+            fields=[
+                ('planet', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='flat', serialize=False, to='midterm_app.planet')),
+                ('name', models.CharField(max_length=255)),
+                ('default_flag', models.BooleanField(default=False)),
+                ('controversial_flag', models.BooleanField(default=False)),
+                ('parameter_reference', models.CharField(blank=True, max_length=255, null=True)),
+                ('orbital_period', models.FloatField(blank=True, null=True)),
+                ('semi_major_axis', models.FloatField(blank=True, null=True)),
+                ('radius', models.FloatField(blank=True, null=True)),
+                ('mass', models.FloatField(blank=True, null=True)),
+                ('mass_sin_i_earth', models.FloatField(blank=True, null=True)),
+                ('mass_sin_i_jupiter', models.FloatField(blank=True, null=True)),
+                ('mass_provenance', models.CharField(blank=True, max_length=255, null=True)),
+                ('eccentricity', models.FloatField(blank=True, null=True)),
+                ('insolation_flux', models.FloatField(blank=True, null=True)),
+                ('equilibrium_temperature', models.FloatField(blank=True, null=True)),
+                ('inclination', models.FloatField(blank=True, null=True)),
+                ('ttv_flag', models.BooleanField(default=False)),
+                ('transit_duration', models.FloatField(blank=True, null=True)),
+                ('host_id', models.BigIntegerField()),
+                ('host_name', models.CharField(max_length=255)),
+                ('host_spectral_type', models.CharField(max_length=255)),
+                ('host_effective_temperature', models.FloatField(blank=True, null=True)),
+                ('host_radius', models.FloatField(blank=True, null=True)),
+                ('host_mass', models.FloatField(blank=True, null=True)),
+                ('host_metallicity', models.FloatField(blank=True, null=True)),
+                ('host_metallicity_ratio', models.CharField(blank=True, max_length=255, null=True)),
+                ('host_surface_gravity', models.FloatField(blank=True, null=True)),
+                ('host_distance', models.FloatField(blank=True, null=True)),
+                ('host_v_magnitude', models.FloatField(blank=True, null=True)),
+                ('host_k_magnitude', models.FloatField(blank=True, null=True)),
+                ('host_gaia_magnitude', models.FloatField(blank=True, null=True)),
+                ('discovery_id', models.BigIntegerField()),
+                ('discovery_method', models.CharField(max_length=255)),
+                ('discovery_year', models.IntegerField(blank=True, null=True)),
+                ('discovery_reference_name', models.CharField(max_length=255)),
+                ('discovery_facility', models.CharField(max_length=255)),
+                ('discovery_telescope', models.CharField(max_length=255)),
+                ('reference_id', models.BigIntegerField(blank=True, null=True)),
+                ('reference_name', models.CharField(blank=True, max_length=255, null=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='discovery',
+            name='discovery_method_year_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='discovery',
+            name='discovery_year_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='planet',
+            name='planet_mass_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='planet',
+            name='planet_radius_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='planet',
+            name='planet_temperature_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='planet',
+            name='planet_controversial_idx',
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['host_distance'], name='flat_planet_distance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['discovery_method', 'discovery_year'], name='flat_planet_method_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['discovery_year'], name='flat_planet_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['mass'], name='flat_planet_mass_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['radius'], name='flat_planet_radius_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['equilibrium_temperature'], name='flat_planet_temperature_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(condition=models.Q(('controversial_flag', True)), fields=['planet'], name='flat_planet_controversial_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['host_id'], name='flat_planet_host_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['reference_id'], name='flat_planet_reference_idx'),
+        ),
+        migrations.RunPython(populate_flat_planets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:48
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_planets(apps, schema_editor):
+    Host = apps.get_model('midterm_app', 'Host')
+    Planet = apps.get_model('midterm_app', 'Planet')
+    FlatPlanet = apps.get_model('midterm_app', 'FlatPlanet')
+    counts = Planet.objects.filter(host=OuterRef('pk')).order_by().values('host').annotate(count=Count('pk')).values('count')
+    Host.objects.update(planet_count=Coalesce(Subquery(counts), 0))
+    FlatPlanet.objects.update(host_planet_count=Subquery(Host.objects.filter(pk=OuterRef('host_id')).values('planet_count')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0010_flat_planet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flatplanet',
+            name='host_planet_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='host',
+            name='planet_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='host',
+            index=models.Index(fields=['planet_count'], name='host_planet_count_idx'),
+        ),
+        migrations.RunPython(count_planets, migrations.RunPython.noop),
+    ]
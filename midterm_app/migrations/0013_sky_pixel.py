@@ -0,0 +1,53 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:54
+
+import numpy as np
+from django.db import migrations, models
+
+# A frozen copy of midterm_app.sky.sky_pixels at the time of this migration.
+ORDER = 15
+CELLS = 1 << ORDER
+
+
+def spread_bits(values):
+    values = values.astype(np.int64)
+    values = (values | (values << 8)) & 0x00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F
+    values = (values | (values << 2)) & 0x33333333
+    values = (values | (values << 1)) & 0x55555555
+    return values
+
+
+def sky_pixels(ra, dec):
+    ra, dec = np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)
+    i = np.clip(np.floor(np.mod(ra, 360) / 360 * CELLS), 0, CELLS - 1).astype(np.int64)
+    j = np.clip(np.floor((np.sin(np.radians(dec)) + 1) / 2 * CELLS), 0, CELLS - 1).astype(np.int64)
+    return spread_bits(i) | (spread_bits(j) << 1)
+
+
+def assign_pixels(apps, schema_editor):
+    SystemParameterReference = apps.get_model('midterm_app', 'SystemParameterReference')
+    rows = list(SystemParameterReference.objects.filter(ra_degrees__isnull=False, dec_degrees__isnull=False).values_list('pk', 'ra_degrees', 'dec_degrees'))
+    if rows:
+        pks, ra, dec = zip(*rows)
+        objs = [SystemParameterReference(pk=pk, sky_pixel=pixel) for pk, pixel in zip(pks, sky_pixels(ra, dec).tolist())]
+        SystemParameterReference.objects.bulk_update(objs, ['sky_pixel'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0012_catalog_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemparameterreference',
+            name='sky_pixel',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='systemparameterreference',
+            index=models.Index(fields=['sky_pixel'], name='reference_sky_pixel_idx'),
+        ),
+        migrations.RunPython(assign_pixels, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:02
+
+from django.db import OperationalError, migrations
+
+COLUMNS = 'name, host_name, discovery_facility, discovery_telescope, discovery_reference_name, parameter_reference, reference_name'
+NEW = 'new.name, new.host_name, new.discovery_facility, new.discovery_telescope, new.discovery_reference_name, new.parameter_reference, new.reference_name'
+OLD = 'old.name, old.host_name, old.discovery_facility, old.discovery_telescope, old.discovery_reference_name, old.parameter_reference, old.reference_name'
+INSERT = f'INSERT INTO midterm_app_search (rowid, {COLUMNS}) VALUES (new.planet_id, {NEW});'
+DELETE = f"INSERT INTO midterm_app_search (midterm_app_search, rowid, {COLUMNS}) VALUES ('delete', old.planet_id, {OLD});"
+
+CREATE_SQL = [
+    f"CREATE VIRTUAL TABLE midterm_app_search USING fts5({COLUMNS}, content='midterm_app_flatplanet', content_rowid='planet_id', tokenize='unicode61 remove_diacritics 2')",
+    f'CREATE TRIGGER midterm_app_search_insert AFTER INSERT ON midterm_app_flatplanet BEGIN {INSERT} END',
+    f'CREATE TRIGGER midterm_app_search_delete AFTER DELETE ON midterm_app_flatplanet BEGIN {DELETE} END',
+    f'CREATE TRIGGER midterm_app_search_update AFTER UPDATE ON midterm_app_flatplanet BEGIN {DELETE} {INSERT} END',
+    "INSERT INTO midterm_app_search (midterm_app_search) VALUES ('rebuild')",
+]
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS midterm_app_search_insert',
+    'DROP TRIGGER IF EXISTS midterm_app_search_delete',
+    'DROP TRIGGER IF EXISTS midterm_app_search_update',
+    'DROP TABLE IF EXISTS midterm_app_search',
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite's; other backends, and builds without it, search without an index.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE midterm_app_fts5_probe USING fts5(probe)")
+        except OperationalError:
+            return
+        cursor.execute('DROP TABLE midterm_app_fts5_probe')
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0013_sky_pixel'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
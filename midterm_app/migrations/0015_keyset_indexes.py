@@ -0,0 +1,45 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='flatplanet',
+            name='flat_planet_method_year_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='flatplanet',
+            name='flat_planet_year_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='flatplanet',
+            name='flat_planet_mass_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='host',
+            name='host_planet_count_idx',
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['discovery_method', 'discovery_year', 'planet'], name='flat_planet_method_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['discovery_year', 'planet'], name='flat_planet_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatplanet',
+            index=models.Index(fields=['mass', 'planet'], name='flat_planet_mass_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='host',
+            index=models.Index(fields=['planet_count', 'id'], name='host_planet_count_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('midterm_app', '0015_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DroppedIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('sql', models.TextField()),
+            ],
+        ),
+    ]
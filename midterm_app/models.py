@@ -1,7 +1,17 @@
+import uuid
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils.html import strip_tags
 from bs4 import BeautifulSoup
 
+# The fields identifying a catalog row, which the loaders look rows up by
+# and upserts resolve conflicts on.
+HOST_KEY = ('name', 'spectral_type')
+SYSTEM_PARAMETER_REFERENCE_KEY = ('name', 'right_ascension', 'ra_degrees', 'declination', 'dec_degrees')
+DISCOVERY_KEY = ('method', 'year', 'reference_name')
+PLANETARY_SYSTEM_KEY = ('host',)
+PLANET_KEY = ('name', 'host', 'discovery')
+
 class Host(models.Model):
     name = models.CharField(max_length=255)  # Host Name
     spectral_type = models.CharField(max_length=255)  # Spectral Type
@@ -15,6 +25,19 @@ class Host(models.Model):
     v_magnitude = models.FloatField(null=True, blank=True)  # V (Johnson) Magnitude
     k_magnitude = models.FloatField(null=True, blank=True)  # Ks (2MASS) Magnitude
     gaia_magnitude = models.FloatField(null=True, blank=True)  # Gaia Magnitude
+    # Number of planets of the host, i.e. the multiplicity of its system; kept up to date by read_model.py.
+    planet_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=HOST_KEY, name='unique_host_natural_key'),
+        ]
+        indexes = [
+            # planets_near_earth and the systems max-distance filter start from the nearby hosts.
+            models.Index(fields=['distance'], name='host_distance_idx'),
+            # Ends with the key so the multi-planet host pages are read in index order (see pagination.py).
+            models.Index(fields=['planet_count', 'id'], name='host_planet_count_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -28,6 +51,25 @@ class SystemParameterReference(models.Model):
     row_update = models.DateField(null=True, blank=True)  # Date of Last Update
     planet_publication_date = models.DateField(null=True, blank=True)  # Planetary Parameter Reference Publication Date
     release_date = models.DateField(null=True, blank=True)  # Release Date
+    # Pixel of ra_degrees and dec_degrees (see sky.py), set by read_model.py; null without them.
+    sky_pixel = models.IntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=SYSTEM_PARAMETER_REFERENCE_KEY, name='unique_reference_natural_key'),
+            # NULLs never compare equal in a unique index. The degrees are
+            # parsed from the sexagesimal columns, so those identify the
+            # reference when either is missing.
+            models.UniqueConstraint(
+                fields=['name', 'right_ascension', 'declination'],
+                condition=models.Q(ra_degrees__isnull=True) | models.Q(dec_degrees__isnull=True),
+                name='unique_reference_without_degrees',
+            ),
+        ]
+        indexes = [
+            # Cone searches read the references of a few ranges of pixels.
+            models.Index(fields=['sky_pixel'], name='reference_sky_pixel_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -46,6 +88,12 @@ class Discovery(models.Model):
     facility = models.CharField(max_length=255)  # Discovery Facility
     telescope = models.CharField(max_length=255)  # Discovery Telescope
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=DISCOVERY_KEY, name='unique_discovery_natural_key'),
+            models.UniqueConstraint(fields=['method', 'reference_name'], condition=models.Q(year__isnull=True), name='unique_discovery_without_year'),
+        ]
+
     def __str__(self):
         return f"{self.method} ({self.year})"
 
@@ -77,5 +125,133 @@ class Planet(models.Model):
     ttv_flag = models.BooleanField(default=False)  # Data show Transit Timing Variations
     transit_duration = models.FloatField(null=True, blank=True)  # Transit Duration [hours]
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=PLANET_KEY, name='unique_planet_natural_key'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class FlatPlanet(models.Model):
+    """Read model of Planet with its host, discovery and reference columns, see read_model.py."""
+    # No foreign key constraints, so shadow reloads can swap the catalog tables under it.
+    planet = models.OneToOneField(Planet, on_delete=models.CASCADE, primary_key=True, db_constraint=False, related_name='flat')
+    name = models.CharField(max_length=255)
+    default_flag = models.BooleanField(default=False)
+    controversial_flag = models.BooleanField(default=False)
+    parameter_reference = models.CharField(max_length=255, null=True, blank=True)
+    orbital_period = models.FloatField(null=True, blank=True)
+    semi_major_axis = models.FloatField(null=True, blank=True)
+    radius = models.FloatField(null=True, blank=True)
+    mass = models.FloatField(null=True, blank=True)
+    mass_sin_i_earth = models.FloatField(null=True, blank=True)
+    mass_sin_i_jupiter = models.FloatField(null=True, blank=True)
+    mass_provenance = models.CharField(max_length=255, null=True, blank=True)
+    eccentricity = models.FloatField(null=True, blank=True)
+    insolation_flux = models.FloatField(null=True, blank=True)
+    equilibrium_temperature = models.FloatField(null=True, blank=True)
+    inclination = models.FloatField(null=True, blank=True)
+    ttv_flag = models.BooleanField(default=False)
+    transit_duration = models.FloatField(null=True, blank=True)
+
+    host_id = models.BigIntegerField()
+    host_name = models.CharField(max_length=255)
+    host_spectral_type = models.CharField(max_length=255)
+    host_effective_temperature = models.FloatField(null=True, blank=True)
+    host_radius = models.FloatField(null=True, blank=True)
+    host_mass = models.FloatField(null=True, blank=True)
+    host_metallicity = models.FloatField(null=True, blank=True)
+    host_metallicity_ratio = models.CharField(max_length=255, null=True, blank=True)
+    host_surface_gravity = models.FloatField(null=True, blank=True)
+    host_distance = models.FloatField(null=True, blank=True)
+    host_v_magnitude = models.FloatField(null=True, blank=True)
+    host_k_magnitude = models.FloatField(null=True, blank=True)
+    host_gaia_magnitude = models.FloatField(null=True, blank=True)
+    host_planet_count = models.PositiveIntegerField(default=0)
+
+    discovery_id = models.BigIntegerField()
+    discovery_method = models.CharField(max_length=255)
+    discovery_year = models.IntegerField(null=True, blank=True)
+    discovery_reference_name = models.CharField(max_length=255)
+    discovery_facility = models.CharField(max_length=255)
+    discovery_telescope = models.CharField(max_length=255)
+
+    reference_id = models.BigIntegerField(null=True, blank=True)  # Parameter reference of the host's system
+    reference_name = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The filter endpoints' access paths, moved here from Planet and Discovery.
+            models.Index(fields=['host_distance'], name='flat_planet_distance_idx'),
+            # Serves filtering on the method alone as well as method and year
+            # together. The indexes the API lists are paged along end with the
+            # key, so a page is read in index order (see pagination.py).
+            models.Index(fields=['discovery_method', 'discovery_year', 'planet'], name='flat_planet_method_year_idx'),
+            models.Index(fields=['discovery_year', 'planet'], name='flat_planet_year_idx'),
+            models.Index(fields=['mass', 'planet'], name='flat_planet_mass_idx'),
+            models.Index(fields=['radius'], name='flat_planet_radius_idx'),
+            models.Index(fields=['equilibrium_temperature'], name='flat_planet_temperature_idx'),
+            # Few planets are controversial, so only those are indexed; the
+            # flag being false matches nearly every row, where a scan is cheaper.
+            models.Index(fields=['planet'], condition=models.Q(controversial_flag=True), name='flat_planet_controversial_idx'),
+            models.Index(fields=['host_id'], name='flat_planet_host_idx'),
+            models.Index(fields=['reference_id'], name='flat_planet_reference_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class CatalogVersion(models.Model):
+    """A single row whose version changes on every catalog write, see read_model.py."""
+    # Random rather than a counter, which would repeat the versions of rolled back writes.
+    version = models.UUIDField(default=uuid.uuid4)
+
+    def __str__(self):
+        return f"Catalog version {self.version}"
+
+class IngestState(models.Model):
+    source = models.CharField(max_length=1024)  # Path of the ingested file
+    file_hash = models.CharField(max_length=64, unique=True)  # SHA-256 of the file contents
+    rows_committed = models.PositiveIntegerField(default=0)  # Rows committed so far
+    completed = models.BooleanField(default=False)  # Whole file committed
+    updated_at = models.DateTimeField(auto_now=True)  # Time of the last checkpoint
+
+    def __str__(self):
+        return f"{self.source} ({self.rows_committed} rows)"
+
+class IngestFingerprint(models.Model):
+    label = models.CharField(max_length=64)  # Loaded model, e.g. 'host'
+    key = models.CharField(max_length=40)  # SHA-1 of the natural key
+    object_id = models.BigIntegerField()  # Primary key of the loaded row
+    digest = models.CharField(max_length=40)  # SHA-1 of the mapped field values
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['label', 'key'], name='unique_ingest_fingerprint'),
+        ]
+
+    def __str__(self):
+        return f"{self.label} {self.object_id}"
+
+class QuarantinedRow(models.Model):
+    source = models.CharField(max_length=1024)  # Path of the ingested file
+    row_number = models.PositiveIntegerField()  # Data row of the file, counted from 1
+    reasons = models.CharField(max_length=255)  # Comma-separated codes of the failed validation rules
+    record = models.JSONField(encoder=DjangoJSONEncoder)  # Mapped field values of the row, per model
+    created_at = models.DateTimeField(auto_now_add=True)  # Time the row was quarantined
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'row_number'], name='unique_quarantined_row'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} row {self.row_number}: {self.reasons}"
+
+class DroppedIndex(models.Model):
+    name = models.CharField(max_length=255, unique=True)  # Name of an index fast_sqlite dropped
+    sql = models.TextField()  # CREATE INDEX statement that rebuilds it
+
     def __str__(self):
         return self.name
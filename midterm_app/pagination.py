@@ -0,0 +1,110 @@
+"""Keyset pagination of the API lists."""
+import json
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+from django.db import connection
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+MAX_PAGE_SIZE = 1000
+
+
+class KeysetPagination(CursorPagination):
+    """CursorPagination on the whole key of the view's ordering followed by the pk, without offsets for ties."""
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+    count_query_param = 'count'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'ordering', None) or self.ordering
+        ordering = (ordering,) if isinstance(ordering, str) else tuple(ordering)
+        if ordering[-1].lstrip('-') != 'pk':
+            ordering += ('pk',)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.count = queryset.count()
+
+        self.cursor = self.decode_cursor(request)
+        reverse, position = (False, None) if self.cursor is None else (self.cursor.reverse, self.cursor.position)
+        nullable = {field.name for field in queryset.model._meta.concrete_fields if field.null}
+        fields = [(order.lstrip('-'), order.startswith('-') != reverse) for order in self.ordering]
+        queryset = queryset.order_by(*(F(name).desc() if descending else F(name).asc() for name, descending in fields))
+        if position is not None:
+            queryset = queryset.filter(rows_after(fields, self.decode_position(position), nullable))
+
+        # One row more tells whether a page follows.
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = self._get_position_from_instance(results[-1], self.ordering) if len(results) > self.page_size else None
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None, position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def decode_position(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [getattr(instance, order.lstrip('-')) for order in ordering]
+        return json.dumps(values, separators=(',', ':'))
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = OrderedDict([('count', self.count), *response.data.items()])
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties'] = {
+            'count': {'type': 'integer', 'example': 123, 'description': f'Only with {self.count_query_param}=true.'},
+            **response_schema['properties'],
+        }
+        return response_schema
+
+
+def rows_after(fields, values, nullable=()):
+    """Q of the rows following the key values in the order of fields, (name, descending) pairs."""
+    # NULLs sort where the backend puts them by default, the order of its indexes.
+    alternatives, equal, bound = [], Q(), Q()
+    for index, ((name, descending), value) in enumerate(zip(fields, values)):
+        # Whether NULLs come after every value in this direction.
+        nulls_after = connection.features.nulls_order_largest != descending
+        if value is None:
+            after = None if nulls_after else Q(**{f'{name}__isnull': False})
+        else:
+            after = Q(**{f'{name}__lt' if descending else f'{name}__gt': value})
+            if nulls_after and name in nullable:
+                after |= Q(**{f'{name}__isnull': True})
+            elif index == 0:
+                # The same rows, but a bound the index range can start from.
+                bound = Q(**{f'{name}__lte' if descending else f'{name}__gte': value})
+        if after is not None:
+            alternatives.append(equal & after)
+        equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+    return bound & reduce(or_, alternatives)
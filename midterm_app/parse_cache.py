@@ -0,0 +1,88 @@
+"""Columnar cache of parsed archive files, as NumPy .npz files named after the SHA-256 of the CSV."""
+import os
+
+import numpy as np
+import pandas as pd
+
+from .dataframes import iter_csv_chunks, typed_column
+from .ingest import RECORD_COLUMNS, file_sha256, parse_float, parse_int, parse_flag, parse_date, parse_month, records_from_columns
+
+# Bump when the mapping or the encoding below changes, so stale caches are
+# ignored instead of misread.
+CACHE_VERSION = 1
+
+
+def cache_path(cache_dir, csv_file_path):
+    return os.path.join(cache_dir, f'{file_sha256(csv_file_path)}-v{CACHE_VERSION}.npz')
+
+def _array_name(column, converter):
+    return f'{column}:{converter.__name__ if converter else "text"}'
+
+def _encode(values, converter):
+    if converter is parse_float:
+        return {'values': values.to_numpy(dtype='float64', na_value=np.nan)}
+    if converter is parse_int:
+        return {'values': values.fillna(0).to_numpy(dtype='int64'), 'missing': values.isna().to_numpy()}
+    if converter is parse_flag:
+        return {'values': values.to_numpy(dtype=bool)}
+    if converter in (parse_date, parse_month):
+        return {'values': np.array([None if pd.isna(value) else value for value in values], dtype='datetime64[D]')}
+    # Text repeats heavily, so it is stored dictionary-encoded rather than pickled.
+    codes, distinct = pd.factorize(values)
+    return {'codes': codes.astype('int32'), 'distinct': np.array(distinct, dtype=str)}
+
+def _decode(arrays, name, converter):
+    if converter is parse_float:
+        values = arrays[f'{name}.values']
+        missing = np.isnan(values)
+    elif converter is parse_int:
+        values = arrays[f'{name}.values']
+        missing = arrays[f'{name}.missing']
+    elif converter is parse_flag:
+        return arrays[f'{name}.values'].tolist()
+    elif converter in (parse_date, parse_month):
+        values = arrays[f'{name}.values']
+        missing = np.isnat(values)
+    else:
+        # Code -1 marks a missing cell and picks the trailing None.
+        distinct = np.append(arrays[f'{name}.distinct'].astype(object), None)
+        return distinct[arrays[f'{name}.codes']].tolist()
+    values = values.astype(object)
+    values[missing] = None
+    return values.tolist()
+
+def write_cache(csv_file_path, path):
+    """Parse csv_file_path with pandas and store its typed columns at path."""
+    chunks = {key: [] for key in RECORD_COLUMNS}
+    for chunk in iter_csv_chunks(csv_file_path):
+        for column, converter in RECORD_COLUMNS:
+            chunks[column, converter].append(typed_column(chunk, column, converter))
+
+    arrays = {}
+    for (column, converter), parts in chunks.items():
+        values = pd.concat(parts, ignore_index=True) if parts else pd.Series([], dtype=object)
+        name = _array_name(column, converter)
+        for part, array in _encode(values, converter).items():
+            arrays[f'{name}.{part}'] = array
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Write under a temporary name first so a concurrent reader never sees a
+    # half-written cache.
+    temporary = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(temporary, **arrays)
+    os.replace(temporary, path)
+
+def read_cache(path):
+    """The records stored in the cache file at path."""
+    with np.load(path) as arrays:
+        return records_from_columns({
+            (column, converter): _decode(arrays, _array_name(column, converter), converter)
+            for column, converter in RECORD_COLUMNS
+        })
+
+def cached_records(csv_file_path, cache_dir):
+    """The records of csv_file_path, from cache_dir if it holds this exact file, else parsed and cached."""
+    path = cache_path(cache_dir, csv_file_path)
+    if not os.path.exists(path):
+        write_cache(csv_file_path, path)
+    return read_cache(path)
@@ -0,0 +1,58 @@
+"""Bulk-load mode for the PostgreSQL backend: COPY into a staging table, then one upsert per table."""
+import io
+
+from django.db import connection, transaction
+
+from .ingest import UPDATED_ON_CONFLICT, BulkLoader, set_upserted_pks, upsert, upsert_sql
+
+
+def copy_text(value):
+    """Format a database value as a field of COPY's text format."""
+    if value is None:
+        return '\\N'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+def copy_rows(rows):
+    """A COPY text stream of rows of database values."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(map(copy_text, row)))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+class PostgresCopyLoader(BulkLoader):
+    """BulkLoader writing through COPY into staging tables merged with INSERT ... ON CONFLICT on the natural key."""
+
+    def flush(self):
+        # The staging tables are dropped when the transaction commits.
+        with transaction.atomic():
+            super().flush()
+
+    def _stage(self, cursor, model, objs):
+        """COPY the non-pk columns of objs into the staging table of model and return (staging table, quoted columns)."""
+        table = model._meta.db_table
+        staging = f'staging_{table}'
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        columns = ', '.join(f'"{field.column}"' for field in fields)
+        cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS "{staging}" ON COMMIT DROP AS SELECT {columns} FROM "{table}" WITH NO DATA')
+        cursor.execute(f'TRUNCATE "{staging}"')
+        rows = ([field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] for obj in objs)
+        # copy_expert streams on the raw psycopg2 cursor.
+        cursor.cursor.copy_expert(f'COPY "{staging}" ({columns}) FROM STDIN', copy_rows(rows))
+        return staging, columns
+
+    def merge(self, model, objs, update_fields):
+        with connection.cursor() as cursor:
+            staging, columns = self._stage(cursor, model, objs)
+            cursor.execute(upsert_sql(model, f'SELECT {columns} FROM "{staging}"', update_fields))
+            set_upserted_pks(model, objs, cursor.fetchall())
+
+    def insert(self, model, objs):
+        upsert(model, objs, UPDATED_ON_CONFLICT.get(model, ()), write=self.merge)
+
+    def update(self, model, objs, fields):
+        upsert(model, objs, fields, write=self.merge)
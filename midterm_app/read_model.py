@@ -0,0 +1,240 @@
+"""The read models derived from the catalog: FlatPlanet, Host.planet_count, sky pixels and the catalog version."""
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Host, Discovery, Planet, SystemParameterReference, PlanetarySystem, FlatPlanet, CatalogVersion
+from .search import rebuilding_search_index
+from .signals import catalog_upserted
+from .sky import assign_sky_pixels
+from .telemetry import IngestStats
+
+def own_fields(model):
+    return tuple(field.name for field in model._meta.concrete_fields if not field.primary_key and not field.is_relation)
+
+PLANET_FIELDS = own_fields(Planet)
+HOST_FIELDS = own_fields(Host)
+DISCOVERY_FIELDS = own_fields(Discovery)
+
+# FlatPlanet column and the Planet lookup it is copied from.
+FLAT_PLANET_SOURCES = (
+    ('planet_id', 'id'),
+    *((name, name) for name in PLANET_FIELDS),
+    ('host_id', 'host_id'),
+    *((f'host_{name}', f'host__{name}') for name in HOST_FIELDS),
+    ('discovery_id', 'discovery_id'),
+    *((f'discovery_{name}', f'discovery__{name}') for name in DISCOVERY_FIELDS),
+    ('reference_id', 'host__system__parameter_reference_id'),
+    ('reference_name', 'host__system__parameter_reference__name'),
+)
+
+# Past this many written rows a load rebuilds the read models rather than refresh the rows it wrote.
+INCREMENTAL_LIMIT = 5000
+# Planets whose flat rows are rewritten per statement.
+REFRESH_BATCH_SIZE = 500
+
+_state = threading.local()
+
+
+def insert_flat_planets(planets):
+    """Insert the FlatPlanet rows of a Planet queryset in one INSERT ... SELECT."""
+    columns = ', '.join(connection.ops.quote_name(column) for column, _ in FLAT_PLANET_SOURCES)
+    try:
+        sql, params = planets.order_by().values_list(*(lookup for _, lookup in FLAT_PLANET_SOURCES)).query.sql_with_params()
+    except EmptyResultSet:
+        # e.g. pk__in=[]
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(FlatPlanet._meta.db_table)} ({columns}) {sql}', params)
+
+def refresh_flat_planets(planets):
+    """Rewrite the FlatPlanet rows of a Planet queryset."""
+    with transaction.atomic():
+        FlatPlanet.objects.filter(pk__in=planets.values('pk')).delete()
+        insert_flat_planets(planets)
+
+def rebuild_flat_planets(stats=None):
+    """Rebuild the whole FlatPlanet table from the catalog, atomically."""
+    stats = stats if stats is not None else IngestStats()
+    with stats.stage('rebuild flat_planet'), transaction.atomic(), rebuilding_search_index(), connection.cursor() as cursor:
+        # A plain DELETE: the catalog's post_delete receivers keep
+        # QuerySet.delete() from deleting in one statement.
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(FlatPlanet._meta.db_table)}')
+        insert_flat_planets(Planet.objects.all())
+
+def planet_counts():
+    """The number of planets of the host of the outer query."""
+    planets = Planet.objects.filter(host=OuterRef('pk')).order_by().values('host').annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(planets), 0)
+
+def count_planets(hosts):
+    """Recount the planets of a Host queryset in one UPDATE."""
+    hosts.update(planet_count=planet_counts())
+
+def stale_planet_counts():
+    """The hosts whose planet_count is not the number of their planets."""
+    # QuerySet.update() fires no signals, so moving planets with it leaves counts behind.
+    return Host.objects.annotate(num_planets=Count('planets')).exclude(planet_count=F('num_planets'))
+
+def catalog_version():
+    return CatalogVersion.objects.values_list('version', flat=True).first()
+
+def bump_catalog_version():
+    if not CatalogVersion.objects.update(version=uuid.uuid4()):
+        CatalogVersion.objects.create()
+
+def rebuild_read_models(stats=None):
+    """Recount the planets of every host, assign missing sky pixels, then rebuild FlatPlanet, which copies the counts."""
+    stats = stats if stats is not None else IngestStats()
+    with transaction.atomic():
+        with stats.stage('count planets'):
+            count_planets(Host.objects.all())
+        with stats.stage('assign sky pixels'):
+            # A reference's degrees are part of its natural key, so stored pixels stay right.
+            assign_sky_pixels(SystemParameterReference.objects.filter(sky_pixel__isnull=True))
+        rebuild_flat_planets(stats)
+        bump_catalog_version()
+
+def refresh_read_models(changes, stats=None):
+    """Bring the read models up to date with the writes deferred() recorded in changes."""
+    stats = stats if stats is not None else IngestStats()
+    if changes.overflowed:
+        rebuild_read_models(stats)
+        return
+    with transaction.atomic():
+        with stats.stage('count planets'):
+            count_planets(Host.objects.filter(pk__in=changes.moved_hosts))
+        with stats.stage('assign sky pixels'):
+            assign_sky_pixels(SystemParameterReference.objects.filter(pk__in=changes.pks[SystemParameterReference]))
+        with stats.stage('refresh flat_planet'):
+            # Listed first: the flat rows of deleted references find their planets.
+            planets = list(changes.planets().values_list('pk', flat=True))
+            for start in range(0, len(planets), REFRESH_BATCH_SIZE):
+                refresh_flat_planets(Planet.objects.filter(pk__in=planets[start:start + REFRESH_BATCH_SIZE]))
+        bump_catalog_version()
+
+
+class CatalogChanges:
+    """The pks of the catalog rows written in a deferred() block, by model, and of the hosts whose planets moved."""
+
+    def __init__(self):
+        self.pks = {model: set() for model in AFFECTED_PLANETS}
+        self.moved_hosts = set()
+        # Set once more than INCREMENTAL_LIMIT rows were written; nothing more is recorded.
+        self.overflowed = False
+
+    def record(self, model, pks, moved=False):
+        if self.overflowed:
+            return
+        self.pks[model].update(pks)
+        if moved:
+            self.moved_hosts.update(pks)
+        if sum(map(len, self.pks.values())) > INCREMENTAL_LIMIT:
+            self.overflowed = True
+            self.pks = {model: set() for model in AFFECTED_PLANETS}
+            self.moved_hosts = set()
+
+    def planets(self):
+        """The planets whose flat rows the recorded writes change."""
+        condition = Q(pk__in=FlatPlanet.objects.filter(reference_id__in=self.pks[SystemParameterReference]).values('planet_id'))
+        for model, pks in self.pks.items():
+            if pks:
+                condition |= Q(pk__in=AFFECTED_PLANETS[model](pks).values('pk'))
+        return Planet.objects.filter(condition)
+
+@contextmanager
+def deferred():
+    """Record the writes of the block rather than update the read models on each; yields the CatalogChanges for refresh_read_models()."""
+    previous = getattr(_state, 'deferred', None)
+    _state.deferred = CatalogChanges()
+    try:
+        yield _state.deferred
+    finally:
+        _state.deferred = previous
+
+
+# The planets whose flat rows a write to an instance of each model changes.
+AFFECTED_PLANETS = {
+    Planet: lambda pks: Planet.objects.filter(pk__in=pks),
+    Host: lambda pks: Planet.objects.filter(host_id__in=pks),
+    Discovery: lambda pks: Planet.objects.filter(discovery_id__in=pks),
+    PlanetarySystem: lambda pks: Planet.objects.filter(host__system__in=pks),
+    SystemParameterReference: lambda pks: Planet.objects.filter(host__system__parameter_reference_id__in=pks),
+}
+
+def is_deferred():
+    return getattr(_state, 'deferred', None) is not None
+
+def refresh_affected(model, pks):
+    if is_deferred():
+        _state.deferred.record(model, pks)
+    else:
+        if model is SystemParameterReference:
+            assign_sky_pixels(SystemParameterReference.objects.filter(pk__in=pks))
+        refresh_flat_planets(AFFECTED_PLANETS[model](pks))
+        bump_catalog_version()
+
+def planets_moved(hosts):
+    """Recount the planets of the hosts given by pk, and rewrite the flat rows of all their planets."""
+    if is_deferred():
+        _state.deferred.record(Host, hosts, moved=True)
+    else:
+        count_planets(Host.objects.filter(pk__in=hosts))
+        refresh_affected(Host, hosts)
+
+@receiver(pre_save, sender=Planet)
+def planet_saving(sender, instance, **kwargs):
+    # The host a saved planet leaves loses it from its count.
+    if instance.pk is not None:
+        instance._previous_host_id = Planet.objects.filter(pk=instance.pk).values_list('host_id', flat=True).first()
+
+@receiver(post_save)
+def catalog_saved(sender, instance, **kwargs):
+    if sender is Planet:
+        planets_moved({instance.host_id, getattr(instance, '_previous_host_id', None)} - {None})
+    elif sender in AFFECTED_PLANETS:
+        refresh_affected(sender, [instance.pk])
+
+@receiver(catalog_upserted)
+def catalog_upserted_receiver(sender, objs, **kwargs):
+    # Planets are upserted on a key holding their host, so never move.
+    if sender is Planet:
+        planets_moved({obj.host_id for obj in objs})
+    else:
+        refresh_affected(sender, [obj.pk for obj in objs])
+
+# Deleting a planet, host or discovery cascades to the flat rows of its
+# planets through the FlatPlanet.planet relation; the host, if it is not
+# being deleted as well, counts the planets it has left.
+@receiver(post_delete, sender=Planet)
+def planet_deleted(sender, instance, **kwargs):
+    planets_moved([instance.host_id])
+
+# The rows of planets that lose their system reference are updated in place rather than rewritten,
+# as a cascade may delete the planets themselves right after.
+@receiver(post_delete)
+def catalog_deleted(sender, **kwargs):
+    if sender in AFFECTED_PLANETS and not is_deferred():
+        bump_catalog_version()
+
+@receiver(post_delete, sender=PlanetarySystem)
+def system_deleted(sender, instance, **kwargs):
+    if is_deferred():
+        _state.deferred.record(Host, [instance.host_id])
+    else:
+        FlatPlanet.objects.filter(host_id=instance.host_id).update(reference_id=None, reference_name=None)
+
+@receiver(post_delete, sender=SystemParameterReference)
+def reference_deleted(sender, instance, **kwargs):
+    # The systems pointing at it were set to NULL without signals.
+    if is_deferred():
+        _state.deferred.record(SystemParameterReference, [instance.pk])
+    else:
+        FlatPlanet.objects.filter(reference_id=instance.pk).update(reference_id=None, reference_name=None)
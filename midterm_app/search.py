@@ -0,0 +1,73 @@
+"""Full-text search over the planets: FTS5 on SQLite, substring matching elsewhere."""
+import re
+from contextlib import contextmanager
+from functools import reduce
+from operator import and_, or_
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import FlatPlanet
+
+SEARCH_TABLE = 'midterm_app_search'
+# FlatPlanet column searched and its BM25 weight.
+SEARCH_COLUMNS = (
+    ('name', 10.0),
+    ('host_name', 5.0),
+    ('discovery_facility', 1.0),
+    ('discovery_telescope', 1.0),
+    ('discovery_reference_name', 1.0),
+    ('parameter_reference', 1.0),
+    ('reference_name', 1.0),
+)
+SEARCH_LIMIT = 20
+MAX_TERMS = 8
+
+
+def _search_triggers(cursor):
+    """(name, sql) of the triggers the migrations put on FlatPlanet to keep the index in step."""
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [FlatPlanet._meta.db_table])
+    return [(name, sql) for name, sql in cursor.fetchall() if name.startswith(f'{SEARCH_TABLE}_')]
+
+REBUILD_SQL = f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')"
+
+def has_search_index():
+    return connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names()
+
+@contextmanager
+def rebuilding_search_index():
+    """Suspend the triggers while the block rewrites FlatPlanet, then rebuild the index in one pass; run it in a transaction."""
+    if not has_search_index():
+        yield
+        return
+    # SQLite cannot disable a trigger, so the block runs without them and
+    # they are recreated from their own DDL, which stays the migrations'.
+    with connection.cursor() as cursor:
+        triggers = _search_triggers(cursor)
+        for name, _ in triggers:
+            cursor.execute(f'DROP TRIGGER {connection.ops.quote_name(name)}')
+    yield
+    with connection.cursor() as cursor:
+        for _, sql in triggers:
+            cursor.execute(sql)
+        cursor.execute(REBUILD_SQL)
+
+def search_terms(query):
+    """The words of a user's query; punctuation and FTS5 operators are dropped."""
+    return re.findall(r'\w+', query)[:MAX_TERMS]
+
+def search_planets(query, limit=SEARCH_LIMIT):
+    """FlatPlanet rows matching every word of query, as a prefix, best first."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if has_search_index():
+        qn = connection.ops.quote_name
+        weights = ', '.join(str(weight) for _, weight in SEARCH_COLUMNS)
+        return list(FlatPlanet.objects.raw(
+            f'SELECT flat.* FROM {SEARCH_TABLE} JOIN {qn(FlatPlanet._meta.db_table)} flat ON flat.planet_id = {SEARCH_TABLE}.rowid'
+            f' WHERE {SEARCH_TABLE} MATCH %s ORDER BY bm25({SEARCH_TABLE}, {weights}), flat.planet_id LIMIT %s',
+            [' '.join(f'"{term}"*' for term in terms), limit],
+        ))
+    matches = [reduce(or_, (Q(**{f'{column}__icontains': term}) for column, _ in SEARCH_COLUMNS)) for term in terms]
+    return list(FlatPlanet.objects.filter(reduce(and_, matches)).order_by('name', 'pk')[:limit])
@@ -1,17 +1,31 @@
 from rest_framework import serializers
+from .ingest import NATURAL_KEYS, upsert
 from .models import Host, Discovery, Planet, SystemParameterReference, PlanetarySystem
+from .read_model import DISCOVERY_FIELDS, HOST_FIELDS, PLANET_FIELDS
 
-class HostSerializer(serializers.ModelSerializer):
+class UpsertModelSerializer(serializers.ModelSerializer):
+    """ModelSerializer whose create() upserts on the model's natural key, so only updates check it is free."""
+
+    def get_validators(self):
+        return [] if self.instance is None else super().get_validators()
+
+    def create(self, validated_data):
+        model = self.Meta.model
+        instance = model(**validated_data)
+        upsert(model, [instance], [name for name in validated_data if name not in NATURAL_KEYS[model]])
+        return instance
+
+class HostSerializer(UpsertModelSerializer):
     class Meta:
         model = Host
         fields = '__all__'
 
-class DiscoverySerializer(serializers.ModelSerializer):
+class DiscoverySerializer(UpsertModelSerializer):
     class Meta:
         model = Discovery
         fields = '__all__'
 
-class SystemParameterReferenceSerializer(serializers.ModelSerializer):
+class SystemParameterReferenceSerializer(UpsertModelSerializer):
     class Meta:
         model = SystemParameterReference
         fields = '__all__'
@@ -30,4 +44,15 @@ class PlanetSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Planet
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class FlatPlanetSerializer(serializers.BaseSerializer):
+    """Read-only PlanetSerializer representation of a FlatPlanet row, built without queries."""
+
+    def to_representation(self, flat):
+        return {
+            'id': flat.pk,
+            'host': {'id': flat.host_id, **{name: getattr(flat, f'host_{name}') for name in HOST_FIELDS}},
+            'discovery': {'id': flat.discovery_id, **{name: getattr(flat, f'discovery_{name}') for name in DISCOVERY_FIELDS}},
+            **{name: getattr(flat, name) for name in PLANET_FIELDS},
+        }
@@ -0,0 +1,232 @@
+"""Zero-downtime catalog reloads into shadow copies of the catalog tables, swapped in by renaming."""
+import re
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from .ingest import CATALOG_MODELS
+from .telemetry import IngestStats
+
+SHADOW_SUFFIX = '__shadow'
+OLD_SUFFIX = '__old'
+# Index names are global, so shadow indexes take the live names with this suffix toggled.
+SHADOW_INDEX_SUFFIX = '__s'
+
+INDEX_SQL = re.compile(r'(CREATE (?:UNIQUE )?INDEX )(\S+)( ON )(\S+)(.*)', re.DOTALL | re.IGNORECASE)
+
+
+def _tables(suffix='', models=CATALOG_MODELS):
+    return [model._meta.db_table + suffix for model in models]
+
+def _existing_tables(cursor):
+    return set(connection.introspection.table_names(cursor))
+
+def _drop_tables(cursor, tables):
+    # Children first, so no foreign key points at a table being dropped.
+    existing = _existing_tables(cursor)
+    for table in reversed(tables):
+        if table in existing:
+            cursor.execute(f'DROP TABLE {connection.ops.quote_name(table)}')
+
+def _rename_tables(cursor, renames):
+    qn = connection.ops.quote_name
+    for old, new in renames:
+        cursor.execute(f'ALTER TABLE {qn(old)} RENAME TO {qn(new)}')
+
+def _set_db_table(model, table):
+    model._meta.db_table = table
+    # Field.cached_col holds on to the table name it was first built with.
+    for field in model._meta.concrete_fields:
+        field.__dict__.pop('cached_col', None)
+
+def toggle_index_name(name):
+    if name.endswith(SHADOW_INDEX_SUFFIX):
+        return name[:-len(SHADOW_INDEX_SUFFIX)]
+    max_length = connection.ops.max_name_length() or 200
+    return name[:max_length - len(SHADOW_INDEX_SUFFIX)] + SHADOW_INDEX_SUFFIX
+
+def shadow_constraints(cursor, model, live):
+    """The constraints of model named after those of the live table with SHADOW_INDEX_SUFFIX toggled."""
+    if connection.vendor == 'sqlite':
+        # Constraint names in SQLite table SQL are local to the table; those
+        # that become indexes are rebuilt by build_indexes().
+        return model._meta.constraints
+    existing = connection.introspection.get_constraints(cursor, live)
+    constraints = []
+    for constraint in model._meta.constraints:
+        name = next((name for name in (constraint.name, toggle_index_name(constraint.name)) if name in existing), None)
+        constraint = constraint.clone()
+        if name is not None:
+            constraint.name = toggle_index_name(name)
+        constraints.append(constraint)
+    return constraints
+
+def secondary_index_sql(cursor, table):
+    """(name, CREATE INDEX statement) of the indexes of table not created with the table itself."""
+    if connection.vendor == 'sqlite':
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL", [table])
+    elif connection.vendor == 'postgresql':
+        cursor.execute(
+            'SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s '
+            'AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)',
+            [table, table],
+        )
+    else:
+        raise NotImplementedError(f'shadow reloads are not supported on {connection.vendor}')
+    return cursor.fetchall()
+
+
+def _index_names(cursor, table):
+    if connection.vendor == 'sqlite':
+        # Constraints declared in the table's own SQL have no index SQL and keep their names.
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL", [table])
+        return {name for name, in cursor.fetchall()}
+    return set(connection.introspection.get_constraints(cursor, table))
+
+def _rename_index(cursor, table, old, new):
+    qn = connection.ops.quote_name
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s', [table, old])
+        if cursor.fetchone():
+            cursor.execute(f'ALTER TABLE {qn(table)} RENAME CONSTRAINT {qn(old)} TO {qn(new)}')
+        else:
+            cursor.execute(f'ALTER INDEX {qn(old)} RENAME TO {qn(new)}')
+        return
+    # SQLite cannot rename an index, so it is created again under the new name.
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = %s", [old])
+    match = INDEX_SQL.match(cursor.fetchone()[0])
+    cursor.execute(f'DROP INDEX {qn(old)}')
+    cursor.execute(f'{match[1]}{qn(new)}{match[3]}{match[4]}{match[5]}')
+
+def swap_index_names(cursor, models=CATALOG_MODELS):
+    """Give the live tables the canonical index names held by their __old tables, so migrations find them."""
+    pairs = []
+    for table in _tables(models=models):
+        live = _index_names(cursor, table)
+        for name in sorted(_index_names(cursor, table + OLD_SUFFIX)):
+            if not name.endswith(SHADOW_INDEX_SUFFIX) and toggle_index_name(name) in live:
+                pairs.append((table, name, toggle_index_name(name)))
+    # Index names are global, so the __old names move out of the way first.
+    for number, (table, canonical, _) in enumerate(pairs):
+        _rename_index(cursor, table + OLD_SUFFIX, canonical, f'{table}__swap{number}')
+    for table, canonical, toggled in pairs:
+        _rename_index(cursor, table, toggled, canonical)
+    for number, (table, _, toggled) in enumerate(pairs):
+        _rename_index(cursor, table + OLD_SUFFIX, f'{table}__swap{number}', toggled)
+
+
+class ShadowCatalog:
+    """Shadow copies of the catalog tables, swapped in atomically once loaded."""
+
+    def __init__(self, models=CATALOG_MODELS, stats=None):
+        self.models = models
+        self.stats = stats if stats is not None else IngestStats()
+        self.deferred_sql = []
+
+    @contextmanager
+    def patched(self):
+        """Point the catalog models at the shadow tables for the duration of the block."""
+        originals = [model._meta.db_table for model in self.models]
+        for model, table in zip(self.models, originals):
+            _set_db_table(model, table + SHADOW_SUFFIX)
+        try:
+            yield
+        finally:
+            for model, table in zip(self.models, originals):
+                _set_db_table(model, table)
+
+    def create(self):
+        """Create the shadow tables without secondary indexes and copy the live rows into them."""
+        qn = connection.ops.quote_name
+        with self.stats.stage('shadow copy'), transaction.atomic(), connection.cursor() as cursor:
+            # The previous generation is only kept until the next reload;
+            # dropping it frees the index names the shadow tables will use.
+            if connection.vendor == 'postgresql':
+                # PostgreSQL will not drop tables with foreign key checks
+                # still deferred in this transaction.
+                cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+                cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+            _drop_tables(cursor, _tables(OLD_SUFFIX, self.models))
+            _drop_tables(cursor, _tables(SHADOW_SUFFIX, self.models))
+
+            # Only table_sql() is used, which needs no schema editor context
+            # and so, unlike create_model(), works inside a transaction on SQLite.
+            editor = connection.schema_editor(collect_sql=True)
+            editor.deferred_sql = []
+            originals = {model: model._meta.constraints for model in self.models}
+            for model in self.models:
+                model._meta.constraints = shadow_constraints(cursor, model, model._meta.db_table)
+            try:
+                with self.patched():
+                    for model in self.models:
+                        sql, params = editor.table_sql(model)
+                        cursor.execute(sql, params)
+            finally:
+                for model, constraints in originals.items():
+                    model._meta.constraints = constraints
+            # Indexes are rebuilt from the live ones in build_indexes();
+            # what else the editor deferred (PostgreSQL foreign keys) is
+            # cheaper to add once the rows are in, too.
+            self.deferred_sql = [
+                str(statement) for statement in editor.deferred_sql
+                if not str(statement).startswith(('CREATE INDEX', 'CREATE UNIQUE INDEX'))
+            ]
+
+            for model in self.models:
+                live = model._meta.db_table
+                shadow = live + SHADOW_SUFFIX
+                columns = ', '.join(qn(field.column) for field in model._meta.concrete_fields)
+                cursor.execute(f'INSERT INTO {qn(shadow)} ({columns}) SELECT {columns} FROM {qn(live)}')
+                self._copy_sequence(cursor, model, live, shadow)
+
+    def _copy_sequence(self, cursor, model, live, shadow):
+        # Continue after the highest id the live table ever handed out, not
+        # just the highest one left in it.
+        if connection.vendor == 'sqlite':
+            cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [shadow])
+            cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, seq FROM sqlite_sequence WHERE name = %s', [shadow, live])
+        else:
+            column = model._meta.pk.column
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [live, column])
+            sequence = cursor.fetchone()[0]
+            cursor.execute(f'SELECT setval(pg_get_serial_sequence(%s, %s), last_value, is_called) FROM {sequence}', [shadow, column])
+
+    def build_indexes(self):
+        """Create the live tables' secondary indexes (and deferred constraints) on the loaded shadow tables."""
+        qn = connection.ops.quote_name
+        with self.stats.stage('shadow indexes'), transaction.atomic(), connection.cursor() as cursor:
+            for model in self.models:
+                live = model._meta.db_table
+                for name, sql in secondary_index_sql(cursor, live):
+                    match = INDEX_SQL.match(sql)
+                    cursor.execute(f'{match[1]}{qn(toggle_index_name(name))}{match[3]}{qn(live + SHADOW_SUFFIX)}{match[5]}')
+            for sql in self.deferred_sql:
+                cursor.execute(sql)
+            self.deferred_sql = []
+
+    def swap(self):
+        """Move the live tables to __old and the shadow tables into their place, atomically."""
+        # Foreign keys follow the renames: PostgreSQL tracks them by oid, and
+        # Django's SQLite connections rewrite them (legacy_alter_table=OFF).
+        with self.stats.stage('shadow swap'), transaction.atomic(), connection.cursor() as cursor:
+            live = _tables(models=self.models)
+            _rename_tables(cursor, [(table, table + OLD_SUFFIX) for table in live])
+            _rename_tables(cursor, [(table + SHADOW_SUFFIX, table) for table in live])
+            swap_index_names(cursor, self.models)
+
+    def discard(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            _drop_tables(cursor, _tables(SHADOW_SUFFIX, self.models))
+
+
+def rollback_catalog(models=CATALOG_MODELS):
+    """Swap the catalog replaced by the last shadow reload back in; the current one becomes __old."""
+    live = _tables(models=models)
+    with transaction.atomic(), connection.cursor() as cursor:
+        missing = set(_tables(OLD_SUFFIX, models)) - _existing_tables(cursor)
+        if missing:
+            raise ValueError(f'no previous catalog to roll back to, missing {", ".join(sorted(missing))}')
+        _rename_tables(cursor, [(table, table + SHADOW_SUFFIX) for table in live])
+        _rename_tables(cursor, [(table + OLD_SUFFIX, table) for table in live])
+        _rename_tables(cursor, [(table + SHADOW_SUFFIX, table + OLD_SUFFIX) for table in live])
+        swap_index_names(cursor, models)
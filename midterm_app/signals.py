@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent by ingest.upsert() and the bulk writes of the loaders with the model
+# as sender and the written objs as objs; they bypass save() and so post_save.
+catalog_upserted = Signal()
@@ -0,0 +1,108 @@
+"""Hierarchical equal-area pixels of the sky, for cone searches in SQL."""
+import math
+
+import numpy as np
+from django.db.models import Q
+
+# Cells of a 2**ORDER square grid over (RA, sin Dec), Lambert's equal-area
+# projection, numbered along a Z-order curve so a coarser cell is one range.
+ORDER = 15
+CELLS = 1 << ORDER
+# Most pixel ranges a cone search hands to the database.
+MAX_RANGES = 64
+
+
+def _spread_bits(values):
+    """Put bit k of each value at bit 2k."""
+    values = values.astype(np.int64)
+    values = (values | (values << 8)) & 0x00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F
+    values = (values | (values << 2)) & 0x33333333
+    values = (values | (values << 1)) & 0x55555555
+    return values
+
+def _columns(ra, dec):
+    """Grid column of each RA and row of each Dec, in degrees."""
+    i = np.floor(np.mod(ra, 360) / 360 * CELLS)
+    j = np.floor((np.sin(np.radians(dec)) + 1) / 2 * CELLS)
+    return np.clip(i, 0, CELLS - 1).astype(np.int64), np.clip(j, 0, CELLS - 1).astype(np.int64)
+
+def sky_pixels(ra, dec):
+    """The pixel of every RA and Dec in degrees, as an int64 array."""
+    i, j = _columns(np.asarray(ra, dtype=float), np.asarray(dec, dtype=float))
+    return _spread_bits(i) | (_spread_bits(j) << 1)
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """Great-circle distance in degrees between positions in degrees (haversine)."""
+    ra1, dec1, ra2, dec2 = map(np.radians, (ra1, dec1, np.asarray(ra2, dtype=float), np.asarray(dec2, dtype=float)))
+    a = np.sin((dec2 - dec1) / 2) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+def _bounding_cells(ra, dec, radius):
+    """Inclusive (column range, row range) rectangles of grid cells covering the cone."""
+    low, high = max(dec - radius, -90), min(dec + radius, 90)
+    rows = (int(_columns([0], [low])[1][0]), int(_columns([0], [high])[1][0]))
+    if low == -90 or high == 90 or radius >= 90:
+        return [((0, CELLS - 1), rows)]
+    # Widest RA offset of the cone, reached off its central Dec.
+    offset = math.degrees(math.asin(min(1, math.sin(math.radians(radius)) / math.cos(math.radians(dec)))))
+    if offset >= 180:
+        return [((0, CELLS - 1), rows)]
+    start, stop = (ra - offset) % 360, (ra + offset) % 360
+    first, last = int(_columns([start], [0])[0][0]), int(_columns([stop], [0])[0][0])
+    if start <= stop:
+        return [((first, last), rows)]
+    return [((first, CELLS - 1), rows), ((0, last), rows)]
+
+def _cell_range(i, j, shift):
+    """Inclusive pixel range of cell (i, j) of the grid shift orders coarser than the finest."""
+    first = int(_spread_bits(np.int64(i)) | (_spread_bits(np.int64(j)) << 1)) << (2 * shift)
+    return first, first + (1 << (2 * shift)) - 1
+
+def pixel_ranges(ra, dec, radius, budget=MAX_RANGES):
+    """Inclusive (first, last) pixel ranges holding every position within radius degrees of ra, dec, and a few more."""
+    # Refine the cells overlapping the cone's bounding box one order at a
+    # time while the cover fits in budget ranges, one index scan each.
+    rectangles = _bounding_cells(ra, dec, radius)
+    ranges, cells = [], [(0, 0)]
+    for level in range(ORDER + 1):
+        shift = ORDER - level
+        partial = []
+        for i, j in cells:
+            # The finest cells cell (i, j) of this order spans.
+            columns = (i << shift, ((i + 1) << shift) - 1)
+            rows = (j << shift, ((j + 1) << shift) - 1)
+            if any(columns[0] >= box[0][0] and columns[1] <= box[0][1] and rows[0] >= box[1][0] and rows[1] <= box[1][1] for box in rectangles):
+                ranges.append(_cell_range(i, j, shift))
+            elif any(columns[0] <= box[0][1] and box[0][0] <= columns[1] and rows[0] <= box[1][1] and box[1][0] <= rows[1] for box in rectangles):
+                partial.append((i, j))
+        if level == ORDER or len(ranges) + 4 * len(partial) > budget:
+            ranges.extend(_cell_range(i, j, shift) for i, j in partial)
+            break
+        cells = [(2 * i + di, 2 * j + dj) for i, j in partial for dj in (0, 1) for di in (0, 1)]
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for first, last in ranges[1:]:
+        if first == merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+def cone_filter(ra, dec, radius, field='sky_pixel'):
+    """Q narrowing field, a sky pixel column, to the pixel ranges of a cone."""
+    q = Q()
+    for first, last in pixel_ranges(ra, dec, radius):
+        q |= Q(**{f'{field}__range': (first, last)})
+    return q
+
+def assign_sky_pixels(references, batch_size=1000):
+    """Set the sky_pixel of a SystemParameterReference queryset from the degrees of its rows."""
+    rows = list(references.filter(ra_degrees__isnull=False, dec_degrees__isnull=False).values_list('pk', 'ra_degrees', 'dec_degrees'))
+    if rows:
+        pks, ra, dec = zip(*rows)
+        model = references.model
+        objs = [model(pk=pk, sky_pixel=pixel) for pk, pixel in zip(pks, sky_pixels(ra, dec).tolist())]
+        model.objects.bulk_update(objs, ['sky_pixel'], batch_size=batch_size)
+    references.filter(Q(ra_degrees__isnull=True) | Q(dec_degrees__isnull=True)).exclude(sky_pixel=None).update(sky_pixel=None)
@@ -0,0 +1,81 @@
+"""In-memory KD-tree of the heliocentric positions of the hosts, in parsecs."""
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .models import Host
+from .read_model import catalog_version
+
+RA = 'system__parameter_reference__ra_degrees'
+DEC = 'system__parameter_reference__dec_degrees'
+
+SPATIAL_LIMIT = 100
+MAX_SPATIAL_LIMIT = 1000
+
+
+def cartesian(ra, dec, distance):
+    """x, y, z (pc) of RA and Dec in degrees and distance in pc, one row per position."""
+    ra, dec, distance = np.radians(ra), np.radians(dec), np.asarray(distance, dtype=float)
+    return np.column_stack((
+        distance * np.cos(dec) * np.cos(ra),
+        distance * np.cos(dec) * np.sin(ra),
+        distance * np.sin(dec),
+    ))
+
+
+class HostIndex:
+    """KD-tree over the positions of the hosts at one catalog version."""
+
+    def __init__(self, version):
+        self.version = version
+        rows = (
+            Host.objects.filter(distance__isnull=False, **{f'{RA}__isnull': False, f'{DEC}__isnull': False})
+            .order_by('pk').values_list('pk', RA, DEC, 'distance')
+        )
+        values = np.array(list(rows), dtype=float).reshape(-1, 4)
+        self.pks = values[:, 0].astype(np.int64)
+        self.points = cartesian(values[:, 1], values[:, 2], values[:, 3])
+        self.rows = {pk: row for row, pk in enumerate(self.pks.tolist())}
+        self.tree = cKDTree(self.points)
+
+    def position(self, host):
+        """The x, y, z of the host with pk host, None if it has no position."""
+        row = self.rows.get(host)
+        return None if row is None else self.points[row]
+
+    def within(self, point, radius, limit=SPATIAL_LIMIT):
+        """(pk, distance) of the limit hosts nearest to point within radius pc of it, nearest first."""
+        if not len(self.pks):
+            return []
+        # The bound excludes hosts at exactly radius, so bound just above it.
+        distances, rows = self.tree.query(point, k=min(limit, len(self.pks)), distance_upper_bound=np.nextafter(radius, np.inf))
+        distances, rows = np.atleast_1d(distances), np.atleast_1d(rows)
+        keep = rows < len(self.pks)
+        distances, rows = distances[keep], rows[keep]
+        order = np.lexsort((rows, distances))
+        return list(zip(self.pks[rows[order]].tolist(), distances[order].tolist()))
+
+    def nearest(self, host, k):
+        """(pk, distance) of the k hosts nearest to the host with pk host, nearest first, itself left out."""
+        row = self.rows[host]
+        distances, rows = self.tree.query(self.points[row], k=min(k + 1, len(self.pks)))
+        distances, rows = np.atleast_1d(distances), np.atleast_1d(rows)
+        keep = rows != row
+        return list(zip(self.pks[rows[keep]].tolist()[:k], distances[keep].tolist()[:k]))
+
+
+_index = None
+_lock = threading.Lock()
+
+def host_index():
+    """The HostIndex of the current catalog version, built on first use after a change."""
+    global _index
+    version = catalog_version()
+    index = _index
+    if index is None or index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = HostIndex(version)
+            index = _index
+    return index
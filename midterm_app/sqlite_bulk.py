@@ -0,0 +1,105 @@
+"""Bulk-load mode for the SQLite backend, and its loader upserting each batch in one statement."""
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from .ingest import CATALOG_MODELS, UPDATED_ON_CONFLICT, BulkLoader, set_upserted_pks, upsert, upsert_sql
+from .models import DroppedIndex
+
+BULK_PRAGMAS = {
+    'cache_size': -256 * 1024,  # KiB
+}
+# These cannot change inside a transaction, so they are only switched when
+# the load runs in autocommit and opens its own.
+JOURNAL_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+}
+
+
+def _pragma(cursor, name):
+    cursor.execute(f'PRAGMA {name}')
+    return cursor.fetchone()[0]
+
+def secondary_indexes(cursor):
+    """(name, sql) of the non-unique indexes on the catalog tables."""
+    tables = [model._meta.db_table for model in CATALOG_MODELS]
+    cursor.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%%' "
+        f"AND tbl_name IN ({', '.join('%s' for _ in tables)})",
+        tables,
+    )
+    return cursor.fetchall()
+
+def restore_dropped_indexes():
+    """Recreate the indexes a fast_sqlite() block dropped and never rebuilt, as its process died."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name, sql in DroppedIndex.objects.values_list('name', 'sql'):
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = %s", [name])
+            if cursor.fetchone() is None:
+                cursor.execute(sql)
+        DroppedIndex.objects.all().delete()
+
+@contextmanager
+def fast_sqlite():
+    """Run the block with SQLite tuned for bulk loading, then restore it."""
+    if connection.vendor != 'sqlite':
+        raise ValueError(f'fast_sqlite needs the sqlite backend, not {connection.vendor}')
+
+    restore_dropped_indexes()
+    pragmas = dict(BULK_PRAGMAS)
+    if not connection.in_atomic_block:
+        pragmas.update(JOURNAL_PRAGMAS)
+    with connection.cursor() as cursor:
+        saved = {name: _pragma(cursor, name) for name in pragmas}
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    with transaction.atomic(), connection.cursor() as cursor:
+        indexes = secondary_indexes(cursor)
+        # Listed in the same transaction, for restore_dropped_indexes() should the block never finish.
+        DroppedIndex.objects.bulk_create([DroppedIndex(name=name, sql=sql) for name, sql in indexes])
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX "{name}"')
+
+    try:
+        yield
+    finally:
+        with transaction.atomic(), connection.cursor() as cursor:
+            for _, sql in indexes:
+                cursor.execute(sql)
+            DroppedIndex.objects.filter(name__in=[name for name, _ in indexes]).delete()
+        with connection.cursor() as cursor:
+            for name, value in saved.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+            cursor.execute('ANALYZE')
+
+
+class SqliteBulkLoader(BulkLoader):
+    """BulkLoader writing each batch in one multi-row INSERT ... ON CONFLICT ... RETURNING."""
+
+    def flush(self):
+        # One transaction for the statements of every table.
+        with transaction.atomic():
+            super().flush()
+
+    def merge(self, model, objs, update_fields):
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        placeholders = f'({", ".join("%s" for _ in fields)})'
+        # sqlite3's executemany drops RETURNING rows, so a batch is one
+        # statement of as many rows as SQLite takes parameters for.
+        batch_size = min(self.batch_size, connection.ops.bulk_batch_size(fields, objs))
+        rows = []
+        with connection.cursor() as cursor:
+            for start in range(0, len(objs), batch_size):
+                batch = objs[start:start + batch_size]
+                params = [field.get_db_prep_save(getattr(obj, field.attname), connection) for obj in batch for field in fields]
+                cursor.execute(upsert_sql(model, f'VALUES {", ".join(placeholders for _ in batch)}', update_fields), params)
+                rows.extend(cursor.fetchall())
+        set_upserted_pks(model, objs, rows)
+
+    def insert(self, model, objs):
+        upsert(model, objs, UPDATED_ON_CONFLICT.get(model, ()), self.batch_size, write=self.merge)
+
+    def update(self, model, objs, fields):
+        upsert(model, objs, fields, self.batch_size, write=self.merge)
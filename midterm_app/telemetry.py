@@ -0,0 +1,136 @@
+"""Ingest telemetry: wall time, queries and rows per load stage."""
+import json
+import resource
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from itertools import islice
+
+
+class IngestStats:
+
+    def __init__(self, progress=None, interval=5.0):
+        self.progress = progress  # called with a progress line every interval seconds
+        self.interval = interval
+        self.rows = 0
+        self.seconds = defaultdict(float)
+        self.queries = defaultdict(int)
+        self.started_at = datetime.now(timezone.utc)
+        self._stack = ['other']
+        self._start = self._mark = time.perf_counter()
+        self._next_progress = self._start + interval
+
+    def _switch(self):
+        now = time.perf_counter()
+        self.seconds[self._stack[-1]] += now - self._mark
+        self._mark = now
+
+    def _enter(self, name):
+        self._switch()
+        self._stack.append(name)
+
+    def _leave(self):
+        self._switch()
+        self._stack.pop()
+
+    def stage(self, name):
+        """Context manager charging the time spent in the block to stage name."""
+        return _Stage(self, name)
+
+    def timed(self, iterable, name, count=False):
+        """Iterate over iterable, charging the time spent producing items to stage name."""
+        # _enter/_leave inlined: this wraps every line and every row.
+        next_item = iter(iterable).__next__
+        seconds, stack, clock = self.seconds, self._stack, time.perf_counter
+        while True:
+            now = clock()
+            seconds[stack[-1]] += now - self._mark
+            stack.append(name)
+            self._mark = now
+            try:
+                item = next_item()
+            except StopIteration:
+                return
+            finally:
+                now = clock()
+                seconds[name] += now - self._mark
+                self._mark = now
+                stack.pop()
+            if count:
+                self.rows += 1
+                if self.progress is not None and now >= self._next_progress:
+                    self._next_progress = now + self.interval
+                    self.progress(self.progress_line())
+            yield item
+
+    def timed_batches(self, iterable, name, size=1024):
+        """Like timed, but pulls items size at a time; for items as cheap as lines of a file."""
+        iterator = iter(iterable)
+        for batch in self.timed(iter(lambda: list(islice(iterator, size)), []), name):
+            yield from batch
+
+    def count_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapper callback counting queries per stage."""
+        self.queries[self._stack[-1]] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    @property
+    def peak_rss_mib(self):
+        # ru_maxrss is in KiB on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def progress_line(self):
+        elapsed = self.elapsed
+        return f'{self.rows:>9} rows {elapsed:>8.1f} s {self.rows / elapsed:>10.0f} rows/s'
+
+    def summary_lines(self):
+        self._switch()
+        elapsed = self.elapsed
+        stages = sorted(set(self.seconds) | set(self.queries), key=lambda name: -self.seconds[name])
+        lines = [f'{"stage":<32} {"seconds":>8} {"share":>6} {"queries":>8}']
+        for name in stages:
+            lines.append(f'{name:<32} {self.seconds[name]:>8.3f} {self.seconds[name] / elapsed:>6.0%} {self.queries[name]:>8}')
+        lines.append(f'{"total":<32} {elapsed:>8.3f} {1:>6.0%} {sum(self.queries.values()):>8}')
+        lines.append(f'{self.rows} rows, {self.rows / elapsed:.0f} rows/s, peak RSS {self.peak_rss_mib:.0f} MiB')
+        return lines
+
+    def as_dict(self):
+        self._switch()
+        elapsed = self.elapsed
+        return {
+            'started_at': self.started_at.isoformat(),
+            'rows': self.rows,
+            'seconds': elapsed,
+            'rows_per_second': self.rows / elapsed,
+            'queries': sum(self.queries.values()),
+            'peak_rss_mib': self.peak_rss_mib,
+            'stages': {
+                name: {'seconds': self.seconds[name], 'queries': self.queries[name]}
+                for name in sorted(set(self.seconds) | set(self.queries))
+            },
+        }
+
+    def write_report(self, path, **extra):
+        with open(path, 'w') as file:
+            json.dump({**extra, **self.as_dict()}, file, indent=2)
+            file.write('\n')
+
+
+class _Stage:
+    # A class rather than a @contextmanager generator: stages are entered
+    # for every row, and this is several times cheaper.
+    __slots__ = ('stats', 'name')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.stats._enter(self.name)
+
+    def __exit__(self, *exc_info):
+        self.stats._leave()
@@ -0,0 +1,727 @@
+import bz2
+import csv
+import gzip
+import io
+import json
+import lzma
+import os
+import tempfile
+from unittest import mock, skipUnless
+
+from django.core.management import CommandError, call_command
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+
+import pandas as pd
+
+from .. import ingest_dataframe
+from ..dataframes import iter_csv_records
+from ..ingest import BulkLoader, MissingColumnsError, compile_mapping, iter_archive_records, map_row, text_blocks, upsert
+from ..parse_cache import cache_path
+from ..postgres_bulk import PostgresCopyLoader, copy_rows
+from ..read_model import FLAT_PLANET_SOURCES, stale_planet_counts
+from ..search import SEARCH_TABLE, has_search_index
+from ..shadow import OLD_SUFFIX, SHADOW_INDEX_SUFFIX, SHADOW_SUFFIX, _drop_tables, _tables
+from ..signals import catalog_upserted
+from ..sqlite_bulk import BULK_PRAGMAS, SqliteBulkLoader, _pragma, fast_sqlite, secondary_indexes
+from ..validation import validate_batch
+from ..management.commands.watch_drop_dir import settled_files
+from ..models import Host, Discovery, Planet, SystemParameterReference, PlanetarySystem, FlatPlanet, DroppedIndex, IngestFingerprint, IngestState, QuarantinedRow
+
+COLUMNS = [
+    'pl_name', 'hostname', 'default_flag', 'discoverymethod', 'disc_year', 'disc_facility',
+    'disc_refname', 'disc_telescope', 'pl_controv_flag', 'pl_refname', 'pl_orbper', 'pl_orbsmax',
+    'pl_rade', 'pl_masse', 'pl_bmasse', 'pl_bmassj', 'pl_bmassprov', 'pl_orbeccen', 'pl_insol',
+    'pl_eqt', 'pl_orbincl', 'ttv_flag', 'pl_trandur', 'st_refname', 'st_spectype', 'st_teff',
+    'st_rad', 'st_mass', 'st_met', 'st_metratio', 'st_logg', 'sy_refname', 'rastr', 'ra', 'decstr',
+    'dec', 'sy_dist', 'sy_vmag', 'sy_kmag', 'sy_gaiamag', 'rowupdate', 'pl_pubdate', 'releasedate',
+]
+
+def archive_row(**values):
+    row = {
+        'pl_name': 'Kepler-1 b', 'hostname': 'Kepler-1', 'default_flag': '1',
+        'discoverymethod': 'Transit', 'disc_year': '2009', 'disc_facility': 'Kepler',
+        'disc_refname': 'Ref A', 'disc_telescope': '0.95 m Kepler Telescope', 'pl_controv_flag': '0',
+        'pl_refname': 'Planet Ref', 'pl_orbper': '2.47', 'pl_orbsmax': '0.036', 'pl_rade': '14.3',
+        'pl_masse': '', 'pl_bmasse': '1.2', 'pl_bmassj': '0.004', 'pl_bmassprov': 'Mass',
+        'pl_orbeccen': '0.0', 'pl_insol': '', 'pl_eqt': '1344', 'pl_orbincl': '83.9', 'ttv_flag': '0',
+        'pl_trandur': '1.8', 'st_refname': 'Star Ref', 'st_spectype': 'G', 'st_teff': '5850',
+        'st_rad': '0.95', 'st_mass': '0.98', 'st_met': '-0.01', 'st_metratio': '[Fe/H]',
+        'st_logg': '4.4', 'sy_refname': 'System Ref', 'rastr': '19h07m14.03s', 'ra': '286.808',
+        'decstr': '+49d18m59.07s', 'dec': '49.316', 'sy_dist': '213.2', 'sy_vmag': '11.3',
+        'sy_kmag': '9.8', 'sy_gaiamag': '11.2', 'rowupdate': '2014-05-14', 'pl_pubdate': '2011-08',
+        'releasedate': '2014-05-14',
+    }
+    row.update(values)
+    return row
+
+SAMPLE_ROWS = [
+    archive_row(),
+    # Same planet from a second parameter set: reuses host, discovery and planet
+    # but moves the system to a new reference.
+    archive_row(default_flag='0', sy_refname='System Ref 2', pl_orbper='2.48', rowupdate='bad-date'),
+    archive_row(pl_name='Kepler-1 c', pl_orbper='', pl_bmasse='not-a-number'),
+    archive_row(pl_name='HD 1 b', hostname='HD 1', st_spectype='', discoverymethod='Radial Velocity',
+                disc_year='', disc_refname='Ref B', sy_refname='HD Ref', ra='', dec='',
+                pl_controv_flag='1', ttv_flag=''),
+    archive_row(pl_name='HD 1 c', hostname='HD 1', st_spectype='', discoverymethod='Radial Velocity',
+                disc_year='', disc_refname='Ref B', sy_refname='HD Ref', ra='', dec='', st_teff='9999'),
+]
+
+def write_csv(directory, rows, name='catalog.csv'):
+    path = os.path.join(directory, name)
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+CATALOG_MODELS = (Host, SystemParameterReference, Discovery, PlanetarySystem, Planet)
+
+def dump_catalog():
+    """Catalog rows in pk order, pks renumbered from 1 since upserts use up sequence values."""
+    catalog, numbers = {}, {}
+    for model in CATALOG_MODELS:
+        rows = list(model.objects.order_by('pk').values())
+        numbers[model] = {row['id']: number for number, row in enumerate(rows, 1)}
+        for row in rows:
+            row['id'] = numbers[model][row['id']]
+            for field in model._meta.concrete_fields:
+                if field.is_relation and row[field.attname] is not None:
+                    row[field.attname] = numbers[field.related_model][row[field.attname]]
+        catalog[model.__name__] = rows
+    return catalog
+
+def reset_sequences():
+    """Continue the primary keys after the current rows; PostgreSQL sequences survive rollbacks."""
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), CATALOG_MODELS):
+            cursor.execute(sql)
+
+def dump_catalog_contents():
+    """Catalog rows without primary keys, foreign keys replaced by names."""
+    return {
+        'hosts': sorted(Host.objects.values_list(
+            'name', 'spectral_type', 'effective_temperature', 'distance', 'metallicity_ratio')),
+        'references': sorted(SystemParameterReference.objects.values_list(
+            'name', 'ra_degrees', 'row_update', 'planet_publication_date'), key=repr),
+        'discoveries': sorted(Discovery.objects.values_list(
+            'method', 'year', 'reference_name', 'facility'), key=repr),
+        'systems': sorted(PlanetarySystem.objects.values_list('host__name', 'parameter_reference__name')),
+        'planets': sorted(Planet.objects.values_list(
+            'name', 'host__name', 'discovery__reference_name', 'default_flag', 'orbital_period', 'mass_sin_i_earth'), key=repr),
+    }
+
+def flat_planets():
+    """The FlatPlanet rows, and the rows the joins of the catalog give for them."""
+    stored = list(FlatPlanet.objects.order_by('pk').values_list(*(column for column, _ in FLAT_PLANET_SOURCES)))
+    joined = list(Planet.objects.order_by('pk').values_list(*(lookup for _, lookup in FLAT_PLANET_SOURCES)))
+    return stored, joined
+
+def clear_catalog():
+    for model in (Planet, PlanetarySystem, Discovery, SystemParameterReference, Host):
+        model.objects.all().delete()
+
+
+class LoadDataTestCase(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        # Pre-existing rows the loaders must match rather than duplicate.
+        host = Host.objects.create(name='Kepler-1', spectral_type='G', distance=1.0)
+        reference = SystemParameterReference.objects.create(name='Old Ref', right_ascension='', declination='')
+        PlanetarySystem.objects.create(host=host, parameter_reference=reference)
+        Discovery.objects.create(method='Radial Velocity', year=None, reference_name='Ref B', facility='Old', telescope='Old')
+
+    def load(self, *args, rows=SAMPLE_ROWS):
+        path = write_csv(self.tmp.name, rows)
+        call_command('load_data', path, *args, stdout=io.StringIO())
+
+    def assert_read_models_current(self):
+        stored, joined = flat_planets()
+        self.assertTrue(joined)
+        self.assertEqual(stored, joined)
+        self.assertFalse(stale_planet_counts().exists())
+        if has_search_index():
+            with connection.cursor() as cursor:
+                # Raises if the index and FlatPlanet differ.
+                cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('integrity-check', 1)")
+
+    def assert_matches_row_wise(self, *args, rows=SAMPLE_ROWS):
+        reset_sequences()
+        with transaction.atomic():
+            self.load(rows=rows)
+            expected = dump_catalog()
+            transaction.set_rollback(True)
+        reset_sequences()
+        self.load(*args, rows=rows)
+        self.assertEqual(dump_catalog(), expected)
+        self.assert_read_models_current()
+
+    def test_row_wise_load(self):
+        self.load()
+        self.assertEqual(Host.objects.count(), 2)
+        self.assertEqual(Planet.objects.count(), 4)
+        self.assertEqual(Discovery.objects.count(), 2)
+        system = PlanetarySystem.objects.get(host__name='Kepler-1')
+        self.assertEqual(system.parameter_reference.name, 'System Ref')
+        self.assertEqual(Host.objects.get(name='HD 1').effective_temperature, 5850)
+
+    def test_bulk_matches_row_wise(self):
+        self.assert_matches_row_wise('--bulk')
+
+    def test_bulk_small_batches_match_row_wise(self):
+        self.assert_matches_row_wise('--bulk', '--batch-size', '1')
+
+    def test_bulk_reload_is_idempotent(self):
+        self.load('--bulk')
+        before = dump_catalog()
+        self.load('--bulk')
+        self.assertEqual(dump_catalog(), before)
+
+    def test_chunked_matches_row_wise(self):
+        self.assert_matches_row_wise('--chunk-size', '2')
+
+    def test_chunked_bulk_matches_row_wise(self):
+        self.assert_matches_row_wise('--bulk', '--chunk-size', '2')
+
+    def test_resume_after_failed_chunk(self):
+        reset_sequences()
+        with transaction.atomic():
+            self.load()
+            expected = dump_catalog()
+            transaction.set_rollback(True)
+        reset_sequences()
+
+        flush = BulkLoader.flush
+        calls = []
+
+        def failing_flush(loader):
+            calls.append(loader)
+            if len(calls) == 2:
+                raise RuntimeError('simulated crash')
+            flush(loader)
+
+        with mock.patch.object(BulkLoader, 'flush', failing_flush):
+            with self.assertRaises(RuntimeError):
+                self.load('--bulk', '--chunk-size', '2')
+        state = IngestState.objects.get()
+        self.assertEqual(state.rows_committed, 2)
+        self.assertFalse(state.completed)
+
+        # The rolled-back chunk leaves a gap in PostgreSQL sequences.
+        reset_sequences()
+        self.load('--bulk', '--chunk-size', '2', '--resume')
+        state.refresh_from_db()
+        self.assertEqual(state.rows_committed, len(SAMPLE_ROWS))
+        self.assertTrue(state.completed)
+        self.assertEqual(dump_catalog(), expected)
+
+    def test_delta_reload_of_same_file_writes_nothing(self):
+        self.load('--delta')
+        out = io.StringIO()
+        call_command('load_data', os.path.join(self.tmp.name, 'catalog.csv'), '--delta', stdout=out)
+        self.assertIn('planet: 0 created, 0 updated, 0 deleted, 4 unchanged', out.getvalue())
+        self.assertIn('host: 0 created, 0 updated, 0 deleted, 2 unchanged', out.getvalue())
+
+    def test_delta_adopts_rows_loaded_before(self):
+        self.load('--bulk')
+        planets = set(Planet.objects.values_list('pk', flat=True))
+        self.load('--delta')
+        self.assertEqual(set(Planet.objects.values_list('pk', flat=True)), planets)
+        self.assertEqual(Host.objects.get(name='Kepler-1').distance, 213.2)
+
+    def test_delta_applies_changes(self):
+        clear_catalog()
+        self.load('--delta')
+        changed = [
+            archive_row(pl_orbper='2.5'),
+            SAMPLE_ROWS[1],
+            SAMPLE_ROWS[2],
+            SAMPLE_ROWS[3],
+            archive_row(pl_name='Kepler-1 d', sy_refname='System Ref 3'),
+        ]
+        out = io.StringIO()
+        call_command('load_data', write_csv(self.tmp.name, changed), '--delta', stdout=out)
+        self.assertIn('planet: 1 created, 1 updated, 1 deleted, 2 unchanged', out.getvalue())
+        self.assertIn('planetary_system: 0 created, 1 updated, 0 deleted, 1 unchanged', out.getvalue())
+        self.assert_read_models_current()
+
+        with transaction.atomic():
+            clear_catalog()
+            self.load(rows=changed)
+            expected = dump_catalog_contents()
+            transaction.set_rollback(True)
+        self.assertEqual(dump_catalog_contents(), expected)
+
+    def test_pandas_records_match_csv_records(self):
+        rows = SAMPLE_ROWS + [archive_row(pl_name='Kepler-1 e', disc_year='2009.0', pl_pubdate='2011-8', ra=' 286.5 ')]
+        path = write_csv(self.tmp.name, rows)
+        expected = list(iter_archive_records(path))
+        # Chunks of two rows put the malformed pl_bmasse of the third row in
+        # the second chunk, after the first one was already yielded.
+        self.assertEqual(list(iter_csv_records(path, chunksize=2)), expected)
+        self.assertEqual(list(iter_archive_records(write_csv(self.tmp.name, SAMPLE_ROWS[:2]), 'pandas')), expected[:2])
+
+    def test_bulk_with_pandas_parser_matches_row_wise(self):
+        self.assert_matches_row_wise('--bulk', '--parser', 'pandas')
+
+    def test_parallel_records_match_serial(self):
+        # Kepler-1 and HD 1 share no discovery here, so add rows that share one
+        # across hosts to make sure the merge keeps file order.
+        rows = SAMPLE_ROWS + [
+            archive_row(pl_name=f'TOI-{number} b', hostname=f'TOI-{number}', disc_refname='Shared Ref')
+            for number in range(8)
+        ]
+        path = write_csv(self.tmp.name, rows)
+        for parser in ('csv', 'pandas'):
+            self.assertEqual(list(iter_archive_records(path, parser, workers=3)), list(iter_archive_records(path)))
+
+    def test_parallel_blocks_stream_in_file_order(self):
+        # A quoted newline must not split its row across two blocks.
+        rows = [archive_row(pl_name=f'TOI-{number} b', hostname=f'TOI-{number}', disc_refname='Line\nbreak') for number in range(40)]
+        path = write_csv(self.tmp.name, rows)
+        blocks = []
+
+        def counted_blocks(path, block_rows):
+            for block in text_blocks(path, block_rows):
+                blocks.append(block)
+                yield block
+
+        with mock.patch('midterm_app.ingest.PARALLEL_BLOCK_ROWS', 3), mock.patch('midterm_app.ingest.text_blocks', counted_blocks):
+            for parser in ('csv', 'pandas'):
+                blocks.clear()
+                records = iter_archive_records(path, parser, workers=2)
+                first = next(records)
+                # The header and at most 2 * workers + 1 blocks were read for the first record.
+                self.assertLessEqual(len(blocks), 6)
+                self.assertEqual([first, *records], list(iter_archive_records(path)))
+
+    def test_bulk_with_workers_matches_row_wise(self):
+        self.assert_matches_row_wise('--bulk', '--workers', '2')
+
+    def test_compressed_inputs_match_plain(self):
+        path = write_csv(self.tmp.name, SAMPLE_ROWS)
+        expected = list(iter_archive_records(path))
+        for extension, opener in (('.gz', gzip.open), ('.bz2', bz2.open), ('.xz', lzma.open)):
+            compressed = path + extension
+            with open(path, 'rb') as source, opener(compressed, 'wb') as target:
+                target.write(source.read())
+            for parser in ('csv', 'pandas'):
+                self.assertEqual(list(iter_archive_records(compressed, parser)), expected)
+
+    def test_empty_file(self):
+        path = os.path.join(self.tmp.name, 'empty.csv')
+        open(path, 'w').close()
+        self.assertEqual(list(iter_archive_records(path)), [])
+
+    def test_compiled_mapping_matches_map_row(self):
+        # Shuffled and duplicated columns, and a short row, as csv.DictReader sees them.
+        header = ['extra'] + COLUMNS[::-1] + ['pl_name']
+        rows = SAMPLE_ROWS + [archive_row(pl_name='Kepler-1 e', disc_year='2009.0', pl_pubdate='2011-8', ra=' 286.5 ')]
+        map_values = compile_mapping(header)
+        for row in rows:
+            values = ['x'] + [row[column] for column in header[1:-1]] + [row['pl_name']]
+            self.assertEqual(map_values(values), map_row(dict(zip(header, values))))
+        short = ['x', *[row[column] for column in header[1:10]]] + [None] * (len(header) - 10)
+        self.assertEqual(map_values(short), map_row(dict(zip(header, short))))
+
+    def test_natural_keys_are_unique(self):
+        for create in (
+            lambda: Host.objects.create(name='Kepler-1', spectral_type='G'),
+            # Keys with a NULL part are covered by the partial constraints.
+            lambda: Discovery.objects.create(method='Radial Velocity', year=None, reference_name='Ref B'),
+            lambda: SystemParameterReference.objects.create(name='Old Ref', right_ascension='', declination=''),
+        ):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                create()
+
+    def test_upsert_matches_stored_rows(self):
+        host = Host.objects.get()
+        new, stored = upsert(Host, [Host(name='Kepler-2', spectral_type='K'), Host(name='Kepler-1', spectral_type='G', distance=2.0)])
+        self.assertEqual(stored.pk, host.pk)
+        self.assertEqual(Host.objects.get(pk=host.pk).distance, 1.0)
+        self.assertEqual(Host.objects.get(pk=new.pk).name, 'Kepler-2')
+
+        upsert(Host, [Host(name='Kepler-1', spectral_type='G', distance=2.0)], ['distance'])
+        self.assertEqual(Host.objects.get(pk=host.pk).distance, 2.0)
+
+        discovery = Discovery.objects.get()
+        stored, = upsert(Discovery, [Discovery(method='Radial Velocity', year=None, reference_name='Ref B', facility='New')], ['facility'])
+        self.assertEqual(stored.pk, discovery.pk)
+        self.assertEqual(Discovery.objects.get().facility, 'New')
+
+    def test_missing_columns_fail_fast(self):
+        rows = [{column: value for column, value in row.items() if column not in ('st_teff', 'pl_eqt')} for row in SAMPLE_ROWS]
+        path = os.path.join(self.tmp.name, 'partial.csv')
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=[column for column in COLUMNS if column not in ('st_teff', 'pl_eqt')])
+            writer.writeheader()
+            writer.writerows(rows)
+        for parser in ('csv', 'pandas'):
+            with self.assertRaisesMessage(MissingColumnsError, 'pl_eqt, st_teff'):
+                list(iter_archive_records(path, parser))
+        with self.assertRaisesMessage(CommandError, 'missing columns'):
+            call_command('load_data', path, '--bulk', stdout=io.StringIO())
+        self.assertFalse(Planet.objects.exists())
+
+    def test_parse_cache_round_trip(self):
+        path = write_csv(self.tmp.name, SAMPLE_ROWS)
+        cache_dir = os.path.join(self.tmp.name, 'cache')
+        expected = list(iter_archive_records(path))
+        self.assertEqual(list(iter_archive_records(path, cache_dir=cache_dir)), expected)
+        self.assertTrue(os.path.exists(cache_path(cache_dir, path)))
+
+        # A warm cache is read without parsing the CSV at all.
+        with mock.patch('midterm_app.parse_cache.iter_csv_chunks', side_effect=AssertionError('parsed again')):
+            self.assertEqual(list(iter_archive_records(path, cache_dir=cache_dir)), expected)
+
+    def test_bulk_from_parse_cache_matches_row_wise(self):
+        cache_dir = os.path.join(self.tmp.name, 'cache')
+        self.assert_matches_row_wise('--bulk', '--cache-dir', cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_fast_sqlite_matches_row_wise(self):
+        self.assert_matches_row_wise('--fast-sqlite')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_fast_sqlite_chunked_matches_row_wise(self):
+        self.assert_matches_row_wise('--fast-sqlite', '--chunk-size', '2')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_fast_sqlite_restores_settings_and_indexes(self):
+        with connection.cursor() as cursor:
+            before = [_pragma(cursor, name) for name in BULK_PRAGMAS], secondary_indexes(cursor)
+        self.load('--fast-sqlite')
+        with connection.cursor() as cursor:
+            after = [_pragma(cursor, name) for name in BULK_PRAGMAS], secondary_indexes(cursor)
+        self.assertEqual(after, before)
+        self.assertTrue(before[1])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_indexes_dropped_by_a_killed_fast_sqlite_load_are_restored(self):
+        with connection.cursor() as cursor:
+            indexes = secondary_indexes(cursor)
+        with fast_sqlite():
+            self.assertEqual(sorted(DroppedIndex.objects.values_list('name', 'sql')), sorted(indexes))
+            # As if the process died here: the indexes stay dropped and listed.
+            killed = list(DroppedIndex.objects.values_list('name', 'sql'))
+        with connection.cursor() as cursor:
+            for name, _ in killed:
+                cursor.execute(f'DROP INDEX "{name}"')
+        DroppedIndex.objects.bulk_create([DroppedIndex(name=name, sql=sql) for name, sql in killed])
+
+        self.load()
+        with connection.cursor() as cursor:
+            self.assertEqual(sorted(secondary_indexes(cursor)), sorted(indexes))
+        self.assertFalse(DroppedIndex.objects.exists())
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    def test_copy_matches_row_wise(self):
+        self.assert_matches_row_wise('--copy')
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    def test_copy_chunked_matches_row_wise(self):
+        self.assert_matches_row_wise('--copy', '--chunk-size', '2')
+
+    def test_backend_loader_merges_rows_stored_meanwhile(self):
+        loader = (SqliteBulkLoader if connection.vendor == 'sqlite' else PostgresCopyLoader)(batch_size=2)
+        # Stored by a concurrent load after the loader read the keys.
+        host = Host.objects.create(name='Kepler-9', spectral_type='G', distance=5.0)
+        upserted = []
+        receiver = lambda sender, objs, **kwargs: upserted.extend((sender, obj.pk) for obj in objs)
+        catalog_upserted.connect(receiver)
+        self.addCleanup(catalog_upserted.disconnect, receiver)
+        for row in SAMPLE_ROWS + [archive_row(pl_name='Kepler-9 b', hostname='Kepler-9')]:
+            loader.add_row(row)
+        loader.flush()
+
+        self.assertEqual(Host.objects.filter(name='Kepler-9').count(), 1)
+        self.assertEqual(Host.objects.get(name='Kepler-9').distance, 5.0)
+        planet = Planet.objects.get(name='Kepler-9 b')
+        self.assertEqual(planet.host_id, host.pk)
+        self.assertEqual(PlanetarySystem.objects.get(host=host).parameter_reference.name, 'System Ref')
+        self.assertIn((Host, host.pk), upserted)
+        self.assertIn((Planet, planet.pk), upserted)
+        self.assertEqual({pk for model, pk in upserted if model is Planet}, set(Planet.objects.values_list('pk', flat=True)))
+
+    def test_copy_rows_escapes_text_format(self):
+        stream = copy_rows([[1, None, 'tab\there', 'line\nbreak', 'back\\slash', '']])
+        self.assertEqual(stream.read(), '1\t\\N\ttab\\there\tline\\nbreak\tback\\\\slash\t\n')
+
+    def test_report_counts_rows_stages_and_queries(self):
+        report = os.path.join(self.tmp.name, 'report.json')
+        out = io.StringIO()
+        call_command('load_data', write_csv(self.tmp.name, SAMPLE_ROWS), '--bulk', '--report', report, stdout=out)
+        with open(report) as file:
+            data = json.load(file)
+        self.assertEqual(data['mode'], 'bulk')
+        self.assertEqual(data['rows'], len(SAMPLE_ROWS))
+        self.assertGreater(data['stages']['write planet']['queries'], 0)
+        self.assertEqual(data['queries'], sum(stage['queries'] for stage in data['stages'].values()))
+        self.assertIn('read', data['stages'])
+        self.assertIn(f'{len(SAMPLE_ROWS)} rows, ', out.getvalue())
+
+    def test_row_wise_lines_need_verbosity_2(self):
+        out = io.StringIO()
+        call_command('load_data', write_csv(self.tmp.name, SAMPLE_ROWS), stdout=out)
+        self.assertNotIn('Successfully imported', out.getvalue())
+        call_command('load_data', write_csv(self.tmp.name, SAMPLE_ROWS), verbosity=2, stdout=out)
+        self.assertIn('Successfully imported Kepler-1 b', out.getvalue())
+
+    def test_shadow_load_matches_row_wise(self):
+        self.assert_matches_row_wise('--shadow')
+        self.assert_matches_row_wise('--bulk', '--shadow')
+
+    def test_consecutive_shadow_loads_keep_natural_keys(self):
+        self.load('--bulk', '--shadow')
+        self.load('--bulk', '--shadow', rows=SAMPLE_ROWS + [archive_row(pl_name='Kepler-1 d')])
+        self.assertEqual(Planet.objects.count(), 5)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Host.objects.create(name='Kepler-1', spectral_type='G')
+
+    def test_loads_refresh_only_the_read_models_they_change(self):
+        host = Host.objects.create(name='Untouched', spectral_type='K')
+        discovery = Discovery.objects.create(method='Imaging', year=2001, reference_name='Untouched Ref')
+        planet = Planet.objects.create(name='Untouched b', host=host, discovery=discovery)
+        for args in ((), ('--bulk',), ('--delta',)):
+            FlatPlanet.objects.filter(planet=planet).update(host_name='stale')
+            self.load(*args)
+            self.assertEqual(FlatPlanet.objects.get(planet=planet).host_name, 'stale')
+            FlatPlanet.objects.filter(planet=planet).update(host_name='Untouched')
+            self.assert_read_models_current()
+
+        FlatPlanet.objects.filter(planet=planet).update(host_name='stale')
+        with mock.patch('midterm_app.read_model.INCREMENTAL_LIMIT', 0):
+            self.load('--bulk', rows=[archive_row(pl_name='Kepler-1 d')])
+        self.assert_read_models_current()
+
+    def test_rollback_catalog_swaps_previous_catalog_back(self):
+        self.load()
+        before = dump_catalog()
+        self.load('--bulk', '--shadow', rows=SAMPLE_ROWS + [archive_row(pl_name='Kepler-1 d')])
+        after = dump_catalog()
+        self.assertNotEqual(after, before)
+
+        call_command('rollback_catalog', stdout=io.StringIO())
+        self.assertEqual(dump_catalog(), before)
+        self.assert_read_models_current()
+        call_command('rollback_catalog', stdout=io.StringIO())
+        self.assertEqual(dump_catalog(), after)
+        self.assert_read_models_current()
+
+    def test_failed_shadow_load_leaves_live_catalog(self):
+        before = dump_catalog()
+        with mock.patch.object(BulkLoader, 'flush', side_effect=RuntimeError('simulated crash')):
+            with self.assertRaises(RuntimeError):
+                self.load('--bulk', '--shadow')
+        self.assertEqual(dump_catalog(), before)
+        self.assertFalse([table for table in connection.introspection.table_names() if table.endswith(SHADOW_SUFFIX)])
+
+    def test_validate_quarantines_failing_rows(self):
+        invalid = [
+            archive_row(pl_name='Kepler-1 x', pl_orbeccen='1.5', dec='-91'),
+            archive_row(pl_name='Kepler-1 y', hostname=''),
+            archive_row(pl_name='Kepler-1 z', pl_masse='1.0', pl_bmasse='300'),
+        ]
+        rows = SAMPLE_ROWS + invalid
+        # SAMPLE_ROWS[1] has a malformed rowupdate.
+        valid = [row for row in SAMPLE_ROWS if row['rowupdate'] != 'bad-date']
+        for args in ((), ('--bulk',), ('--bulk', '--chunk-size', '2')):
+            reset_sequences()
+            with transaction.atomic():
+                self.load(rows=valid)
+                expected = dump_catalog()
+                transaction.set_rollback(True)
+            reset_sequences()
+            with transaction.atomic():
+                self.load('--validate', *args, rows=rows)
+                self.assertEqual(dump_catalog(), expected)
+                quarantined = {row.row_number: row.reasons for row in QuarantinedRow.objects.all()}
+                transaction.set_rollback(True)
+            self.assertEqual(quarantined, {
+                2: 'row_update_invalid',
+                6: 'dec_out_of_range,eccentricity_out_of_range',
+                7: 'host_name_missing',
+                8: 'mass_below_mass_sin_i,mass_units_inconsistent',
+            })
+
+    def test_validate_replaces_quarantine_of_earlier_load(self):
+        rows = SAMPLE_ROWS + [archive_row(pl_name='Kepler-1 x', pl_orbeccen='-0.1')]
+        self.load('--validate', '--bulk', rows=rows)
+        self.load('--validate', '--bulk', rows=rows)
+        self.assertEqual(QuarantinedRow.objects.count(), 2)
+        row = QuarantinedRow.objects.get(row_number=6)
+        self.assertEqual(row.record['planet']['name'], 'Kepler-1 x')
+        self.assertEqual(row.record['system_parameter_reference']['row_update'], '2014-05-14')
+
+    def test_validate_batch_leaves_missing_optional_values_alone(self):
+        records = list(iter_archive_records(write_csv(self.tmp.name, [archive_row(pl_orbeccen='', pl_masse='', st_teff='x')])))
+        valid, reasons = validate_batch(records)
+        self.assertEqual(valid.tolist(), [True])
+        self.assertEqual(reasons, {})
+
+    def assert_dataframe_matches_load_data(self, data, mode='bulk', *args):
+        reset_sequences()
+        with transaction.atomic():
+            self.load(*args)
+            expected = dump_catalog()
+            transaction.set_rollback(True)
+        reset_sequences()
+        with transaction.atomic():
+            ingest_dataframe(data, mode=mode)
+            self.assertEqual(dump_catalog(), expected)
+            self.assert_read_models_current()
+            transaction.set_rollback(True)
+
+    def test_ingest_dataframe_matches_load_data(self):
+        backend_mode = 'fast_sqlite' if connection.vendor == 'sqlite' else 'copy'
+        for mode in ('bulk', backend_mode):
+            self.assert_dataframe_matches_load_data(pd.DataFrame(SAMPLE_ROWS, columns=COLUMNS), mode)
+        # Delta adopts and updates the rows loaded before, unlike the other modes.
+        self.assert_dataframe_matches_load_data(pd.DataFrame(SAMPLE_ROWS, columns=COLUMNS), 'delta', '--delta')
+
+    def test_ingest_typed_dataframe_matches_row_wise(self):
+        # What an analysis job holding the catalog in pandas would pass:
+        # NaN for gaps, float years, boolean flags and parsed dates.
+        frame = pd.read_csv(write_csv(self.tmp.name, SAMPLE_ROWS))
+        self.assertEqual(frame['disc_year'].dtype, float)
+        frame['default_flag'] = frame['default_flag'].astype(bool)
+        frame['rowupdate'] = pd.to_datetime(frame['rowupdate'], errors='coerce')
+        frame['pl_pubdate'] = pd.to_datetime(frame['pl_pubdate'], format='%Y-%m').dt.date
+        self.assert_dataframe_matches_load_data(frame)
+        self.assert_dataframe_matches_load_data({column: frame[column].to_numpy() for column in frame})
+
+    def test_ingest_dataframe_rejects_bad_input(self):
+        with self.assertRaisesMessage(MissingColumnsError, 'hostname'):
+            ingest_dataframe(pd.DataFrame(SAMPLE_ROWS).drop(columns=['hostname']))
+        with self.assertRaisesMessage(ValueError, 'mode must be one of'):
+            ingest_dataframe(pd.DataFrame(SAMPLE_ROWS), mode='fast')
+        self.assertFalse(Planet.objects.exists())
+
+    def test_ingest_dataframe_quarantines_with_validate(self):
+        ingest_dataframe(pd.DataFrame(SAMPLE_ROWS), validate=True, source='notebook')
+        self.assertEqual(list(QuarantinedRow.objects.values_list('source', 'row_number', 'reasons')), [('notebook', 2, 'row_update_invalid')])
+
+
+class WatchDropDirTestCase(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.drop = self.tmp.name
+
+    def watch(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('watch_drop_dir', self.drop, '--once', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_burst_of_files_loads_in_one_transaction(self):
+        write_csv(self.drop, SAMPLE_ROWS[:3], 'a.csv')
+        write_csv(self.drop, SAMPLE_ROWS[3:], 'b.csv')
+        out, err = self.watch()
+        self.assertIn('Loaded 2 files, 5 rows', out)
+        self.assertEqual(err, '')
+        self.assertEqual(sorted(os.listdir(os.path.join(self.drop, 'processed'))), ['a.csv', 'b.csv'])
+        self.assertEqual(Planet.objects.count(), 4)
+        stored, joined = flat_planets()
+        self.assertEqual(stored, joined)
+
+        loaded = dump_catalog_contents()
+        for model in reversed(CATALOG_MODELS):
+            model.objects.all().delete()
+        call_command('load_data', write_csv(self.tmp.name, SAMPLE_ROWS, 'all.csv'), stdout=io.StringIO())
+        self.assertEqual(dump_catalog_contents(), loaded)
+
+    def test_bad_file_is_failed_alone(self):
+        write_csv(self.drop, SAMPLE_ROWS, 'good.csv')
+        with open(os.path.join(self.drop, 'bad.csv'), 'w') as file:
+            file.write('pl_name,hostname\nKepler-1 b,Kepler-1\n')
+        out, err = self.watch('--max-files', '5')
+        self.assertIn('Loaded 1 file, 5 rows', out)
+        self.assertIn('Failed to load bad.csv', err)
+        self.assertEqual(os.listdir(os.path.join(self.drop, 'processed')), ['good.csv'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.drop, 'failed'))), ['bad.csv', 'bad.csv.error'])
+        with open(os.path.join(self.drop, 'failed', 'bad.csv.error')) as file:
+            self.assertIn('MissingColumnsError', file.read())
+        self.assertEqual(Planet.objects.count(), 4)
+
+    def test_files_are_picked_up_once_they_settle(self):
+        path = write_csv(self.drop, SAMPLE_ROWS[:1], 'a.csv')
+        open(os.path.join(self.drop, '.b.csv'), 'w').close()
+        ready, seen = settled_files(self.drop, {})
+        self.assertEqual(ready, [])
+        with open(path, 'a') as file:
+            file.write(','.join(SAMPLE_ROWS[1][column] for column in COLUMNS) + '\n')
+        ready, seen = settled_files(self.drop, seen)
+        self.assertEqual(ready, [])
+        ready, seen = settled_files(self.drop, seen)
+        self.assertEqual(ready, [path])
+
+
+class MergeDuplicateNaturalKeysTestCase(TransactionTestCase):
+    before = [('midterm_app', '0007_filter_indexes')]
+    after = [('midterm_app', '0009_natural_key_constraints')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        # Leave the schema the later tests expect.
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicates_are_merged_into_the_lowest_pk(self):
+        apps = self.migrate(self.before)
+        Host = apps.get_model('midterm_app', 'Host')
+        Discovery = apps.get_model('midterm_app', 'Discovery')
+        PlanetarySystem = apps.get_model('midterm_app', 'PlanetarySystem')
+        Planet = apps.get_model('midterm_app', 'Planet')
+        hosts = [Host.objects.create(name='Kepler-1', spectral_type='G') for _ in range(3)]
+        discoveries = [Discovery.objects.create(method='Transit', year=None, reference_name='Ref A') for _ in range(2)]
+        PlanetarySystem.objects.create(host=hosts[1])
+        Planet.objects.create(name='Kepler-1 b', host=hosts[0], discovery=discoveries[0])
+        Planet.objects.create(name='Kepler-1 b', host=hosts[2], discovery=discoveries[1])
+        Planet.objects.create(name='Kepler-1 c', host=hosts[2], discovery=discoveries[1])
+        IngestFingerprint.objects.create(label='host', key='k', object_id=hosts[2].pk, digest='d')
+
+        self.migrate(self.after)
+        self.assertEqual(list(Host.objects.values_list('pk', flat=True)), [hosts[0].pk])
+        self.assertEqual(list(Discovery.objects.values_list('pk', flat=True)), [discoveries[0].pk])
+        self.assertEqual(list(PlanetarySystem.objects.values_list('host_id', flat=True)), [hosts[0].pk])
+        self.assertEqual(
+            sorted(Planet.objects.values_list('name', 'host_id', 'discovery_id')),
+            [('Kepler-1 b', hosts[0].pk, discoveries[0].pk), ('Kepler-1 c', hosts[0].pk, discoveries[0].pk)],
+        )
+        self.assertFalse(IngestFingerprint.objects.exists())
+
+
+class ShadowSwapMigrationTestCase(TransactionTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            _drop_tables(cursor, _tables(OLD_SUFFIX))
+
+    def index_names(self, table):
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(cursor, table))
+
+    def test_migrations_find_the_live_indexes_after_a_swap(self):
+        call_command('load_data', write_csv(self.tmp.name, SAMPLE_ROWS), '--bulk', '--shadow', stdout=io.StringIO())
+        table = Host._meta.db_table
+        self.assertFalse([name for name in self.index_names(table) if name.endswith(SHADOW_INDEX_SUFFIX)])
+        self.assertIn('host_planet_count_idx' + SHADOW_INDEX_SUFFIX, self.index_names(table + OLD_SUFFIX))
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('midterm_app', '0014_search_index')])
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        self.assertIn('host_planet_count_idx', self.index_names(table))
+        self.assertIn('host_planet_count_idx' + SHADOW_INDEX_SUFFIX, self.index_names(table + OLD_SUFFIX))
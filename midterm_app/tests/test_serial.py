@@ -24,7 +24,7 @@ class HostSerializerTest(TestCase):
 
     def test_contains_expected_fields(self):
         data = self.serializer.data
-        self.assertEqual(set(data.keys()), set(['id', 'name', 'spectral_type', 'effective_temperature', 'radius', 'mass', 'metallicity', 'metallicity_ratio', 'surface_gravity', 'distance', 'v_magnitude', 'k_magnitude', 'gaia_magnitude']))
+        self.assertEqual(set(data.keys()), set(['id', 'name', 'spectral_type', 'effective_temperature', 'radius', 'mass', 'metallicity', 'metallicity_ratio', 'surface_gravity', 'distance', 'v_magnitude', 'k_magnitude', 'gaia_magnitude', 'planet_count']))
 
     def test_name_field_content(self):
         data = self.serializer.data
@@ -1,7 +1,20 @@
+import json
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from ..models import Host, Discovery, Planet, PlanetarySystem, SystemParameterReference
+from rest_framework.renderers import JSONRenderer
+from ..models import Host, Discovery, Planet, PlanetarySystem, SystemParameterReference, FlatPlanet
 from ..forms import HostForm, DiscoveryForm, PlanetarySystemForm, PlanetForm
+from ..serializers import PlanetSerializer
+from ..autocomplete import normalize
+from ..read_model import rebuild_flat_planets, stale_planet_counts
+from ..search import has_search_index
+from ..sky import angular_separation, sky_pixels
+from ..spatial import host_index
+from .test_load_data import flat_planets
 
 class ViewsTestCase(TestCase):
     def setUp(self):
@@ -135,12 +148,41 @@ class ViewsTestCase(TestCase):
         self.assertIn('form', response.context)
 
     def test_report_planetary_system_post(self):
+        # The host already has a system, which the report repoints.
+        reference = SystemParameterReference.objects.create(name="New Reference", right_ascension="", declination="")
         response = self.client.post(reverse('report-planetary-system'), {
             'host': self.host.id, 
-            'parameter_reference': self.system_parameter_reference.id
+            'parameter_reference': reference.id
         })
-        self.assertEqual(response.status_code, 200) 
-        self.assertTrue(PlanetarySystem.objects.filter(host=self.host).exists())
+        self.assertEqual(response.status_code, 302) 
+        self.assertEqual(list(PlanetarySystem.objects.filter(host=self.host).values_list('pk', 'parameter_reference')), [(self.planetary_system.pk, reference.pk)])
+
+    def test_report_existing_host_updates_it(self):
+        for distance in (120, 130):
+            response = self.client.post(reverse('report-host'), {'name': 'Test Host', 'spectral_type': 'G', 'distance': distance})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Host.objects.filter(name='Test Host', spectral_type='G').values_list('distance', flat=True)), [130])
+
+    def test_api_create_upserts_on_natural_key(self):
+        data = {'method': 'Test Method', 'year': 2020, 'reference_name': 'Test Reference', 'facility': 'Other Facility', 'telescope': 'Test Telescope'}
+        response = self.client.post(reverse('discovery-list-create'), data, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['id'], self.discovery.pk)
+        self.assertEqual(list(Discovery.objects.values_list('pk', 'facility')), [(self.discovery.pk, 'Other Facility')])
+        response = self.client.post(reverse('discovery-list-create'), {**data, 'year': None, 'facility': 'No Year'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Discovery.objects.count(), 2)
+
+    def test_api_update_onto_another_natural_key_is_rejected(self):
+        other = Discovery.objects.create(method='Transit', year=2021, reference_name='Other Reference')
+        data = {'method': 'Test Method', 'year': 2020, 'reference_name': 'Test Reference'}
+        response = self.client.put(reverse('discovery-detail', args=[other.pk]), data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(reverse('discovery-detail', args=[other.pk]), data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(reverse('discovery-detail', args=[self.discovery.pk]), {'facility': 'Patched'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Discovery.objects.order_by('pk').values_list('reference_name', flat=True)), ['Test Reference', 'Other Reference'])
 
     def test_report_planet_get(self):
         response = self.client.get(reverse('report-planet'))
@@ -163,3 +205,577 @@ class ViewsTestCase(TestCase):
         response = self.client.get(reverse('report_index'))
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'midterm_app/report_index.html')
+
+
+class FlatPlanetTestCase(TestCase):
+    """The planet pages and endpoints read FlatPlanet, which the writes keep in step with the catalog."""
+
+    def setUp(self):
+        self.reference = SystemParameterReference.objects.create(name='Ref', right_ascension='', declination='')
+        self.host = Host.objects.create(name='Host', spectral_type='G', distance=10)
+        PlanetarySystem.objects.create(host=self.host, parameter_reference=self.reference)
+        self.discovery = Discovery.objects.create(method='Transit', year=2010, reference_name='Disc Ref', facility='Kepler', telescope='Kepler')
+        self.planet = Planet.objects.create(name='Host b', host=self.host, discovery=self.discovery, mass=2.5, controversial_flag=True)
+        Planet.objects.create(name='Host c', host=self.host, discovery=self.discovery)
+
+    def assertFlatPlanetsCurrent(self):
+        stored, joined = flat_planets()
+        self.assertEqual(stored, joined)
+
+    def test_api_list_matches_planet_serializer(self):
+        response = self.client.get(reverse('planet-list-create'))
+        self.assertEqual(response.status_code, 200)
+        expected = json.loads(JSONRenderer().render(PlanetSerializer(Planet.objects.order_by('pk'), many=True).data))
+        self.assertEqual(response.json()['results'], expected)
+
+    def test_planet_reads_join_nothing(self):
+        for url, params in [
+            (reverse('planet-list-create'), {}),
+            (reverse('planets-by-discovery-method'), {'discovery_method': 'Transit'}),
+            (reverse('planets-by-discovery-year'), {'discovery_year': 2010}),
+            (reverse('planets-by-min-mass'), {'min_mass': 1}),
+            (reverse('planets-by-controversial-flag'), {'controversial_flag': 'true'}),
+            (reverse('planet_list'), {}),
+            (reverse('planet_detail', args=[self.planet.pk]), {}),
+            (reverse('planets_near_earth'), {'min_mass': 1}),
+        ]:
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'Host b')
+                self.assertEqual(len(queries), 1)
+                self.assertNotIn('JOIN', queries[0]['sql'])
+
+    def test_writes_refresh_flat_planets(self):
+        self.assertFlatPlanetsCurrent()
+        self.client.post(reverse('report-host'), {'name': 'Host', 'spectral_type': 'G', 'distance': 20})
+        self.assertEqual(FlatPlanet.objects.get(pk=self.planet.pk).host_distance, 20)
+        self.client.post(reverse('discovery-list-create'), {
+            'method': 'Transit', 'year': 2010, 'reference_name': 'Disc Ref', 'facility': 'TESS', 'telescope': 'Kepler',
+        }, content_type='application/json')
+        self.assertEqual(FlatPlanet.objects.get(pk=self.planet.pk).discovery_facility, 'TESS')
+        self.client.post(reverse('report-planet'), {'name': 'Host d', 'host': self.host.pk, 'discovery': self.discovery.pk})
+        self.assertTrue(FlatPlanet.objects.filter(name='Host d').exists())
+        self.assertFlatPlanetsCurrent()
+
+        self.reference.delete()
+        self.assertIsNone(FlatPlanet.objects.get(pk=self.planet.pk).reference_name)
+        self.planet.delete()
+        self.assertFalse(FlatPlanet.objects.filter(pk=self.planet.pk).exists())
+        self.host.delete()
+        self.assertFalse(FlatPlanet.objects.exists())
+
+
+class PlanetCountTestCase(TestCase):
+    """Host.planet_count follows the planets written through every path."""
+
+    def setUp(self):
+        self.discovery = Discovery.objects.create(method='Transit', year=2010, reference_name='Ref', facility='Kepler', telescope='Kepler')
+        self.hosts = [Host.objects.create(name=f'Host {index}', spectral_type='G') for index in range(3)]
+        for host, planets in zip(self.hosts, (1, 2, 3)):
+            for index in range(planets):
+                Planet.objects.create(name=f'{host.name} {index}', host=host, discovery=self.discovery)
+
+    def counts(self):
+        self.assertFalse(stale_planet_counts().exists())
+        return list(Host.objects.order_by('pk').values_list('planet_count', flat=True))
+
+    def test_writes_keep_counts(self):
+        self.assertEqual(self.counts(), [1, 2, 3])
+        planet = Planet.objects.filter(host=self.hosts[2]).first()
+        planet.host = self.hosts[0]
+        planet.save()
+        self.assertEqual(self.counts(), [2, 2, 2])
+        self.client.post(reverse('report-planet'), {'name': 'Host 1 9', 'host': self.hosts[1].pk, 'discovery': self.discovery.pk})
+        self.client.post(reverse('report-planet'), {'name': 'Host 1 9', 'host': self.hosts[1].pk, 'discovery': self.discovery.pk})
+        self.assertEqual(self.counts(), [2, 3, 2])
+        planet.delete()
+        self.assertEqual(self.counts(), [1, 3, 2])
+        self.discovery.delete()
+        self.assertEqual(self.counts(), [0, 0, 0])
+        self.assertEqual(FlatPlanet.objects.count(), 0)
+
+    def test_counts_reach_flat_planets(self):
+        Planet.objects.create(name='Host 0 9', host=self.hosts[0], discovery=self.discovery)
+        self.assertEqual(list(FlatPlanet.objects.filter(host_id=self.hosts[0].pk).values_list('host_planet_count', flat=True)), [2, 2])
+        stored, joined = flat_planets()
+        self.assertEqual(stored, joined)
+
+    def test_hosts_by_min_planets(self):
+        url = reverse('hosts-by-min-planets')
+        self.assertEqual([host['name'] for host in self.client.get(url, {'min_planets': 2}).json()['results']], ['Host 2'])
+        # The filter of one request does not stick to the view for the next.
+        self.assertEqual([host['name'] for host in self.client.get(url).json()['results']], ['Host 1', 'Host 2'])
+        for min_planets in ('abc', '-1'):
+            self.assertEqual(self.client.get(url, {'min_planets': min_planets}).status_code, 400)
+
+
+class SpatialTestCase(TestCase):
+    """Radius and nearest neighbour searches over the host positions."""
+
+    def setUp(self):
+        self.hosts = {}
+        for name, ra, dec, distance in [('A', 0, 0, 10), ('B', 90, 0, 10), ('C', 0, 0, 12), ('D', 0, 0, None), ('E', None, 0, 5)]:
+            host = Host.objects.create(name=name, spectral_type='G', distance=distance)
+            reference = SystemParameterReference.objects.create(name=f'{name} Ref', right_ascension='', ra_degrees=ra, declination='', dec_degrees=dec)
+            PlanetarySystem.objects.create(host=host, parameter_reference=reference)
+            self.hosts[name] = host
+
+    def search(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return [(host['name'], round(host['separation'], 6)) for host in response.json()]
+
+    def test_hosts_within_radius_of_host(self):
+        url = reverse('hosts-within-radius')
+        self.assertEqual(self.search(url, {'host': self.hosts['A'].pk, 'radius': 3}), [('A', 0), ('C', 2)])
+        self.assertEqual(self.search(url, {'host': self.hosts['B'].pk, 'radius': 1}), [('B', 0)])
+
+    def test_hosts_within_radius_of_point(self):
+        url = reverse('hosts-within-radius')
+        self.assertEqual(self.search(url, {'ra': 0, 'dec': 0, 'distance': 11, 'radius': 1.5}), [('A', 1), ('C', 1)])
+        self.assertEqual(self.search(url, {'ra': 45, 'dec': 0, 'distance': 0, 'radius': 10}), [('A', 10), ('B', 10)])
+
+    def test_radius_results_are_limited(self):
+        url = reverse('hosts-within-radius')
+        self.assertEqual(self.search(url, {'host': self.hosts['A'].pk, 'radius': 1e300, 'limit': 2}), [('A', 0), ('C', 2)])
+        with mock.patch('midterm_app.views.MAX_SPATIAL_LIMIT', 1):
+            self.assertEqual(self.search(url, {'host': self.hosts['A'].pk, 'radius': 1e300}), [('A', 0)])
+            self.assertEqual(self.search(reverse('host-nearest-neighbors', args=[self.hosts['A'].pk]), {'k': 5}), [('C', 2)])
+
+    def test_nearest_neighbors(self):
+        self.assertEqual(self.search(reverse('host-nearest-neighbors', args=[self.hosts['A'].pk]), {'k': 1}), [('C', 2)])
+        self.assertEqual(self.search(reverse('host-nearest-neighbors', args=[self.hosts['A'].pk])), [('C', 2), ('B', round(200 ** 0.5, 6))])
+
+    def test_bad_requests(self):
+        for name in ('D', 'E'):
+            self.assertEqual(self.client.get(reverse('host-nearest-neighbors', args=[self.hosts[name].pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('hosts-within-radius'), {'host': self.hosts['A'].pk}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('hosts-within-radius'), {'ra': 0, 'dec': 0, 'radius': 'far'}).status_code, 400)
+        for radius in ('nan', 'inf'):
+            self.assertEqual(self.client.get(reverse('hosts-within-radius'), {'host': self.hosts['A'].pk, 'radius': radius}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('hosts-within-radius'), {'host': self.hosts['A'].pk, 'radius': 1, 'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('host-nearest-neighbors', args=[self.hosts['A'].pk]), {'k': 0}).status_code, 400)
+
+    def test_index_follows_catalog_writes(self):
+        index = host_index()
+        self.assertIs(host_index(), index)
+        self.client.post(reverse('report-host'), {'name': 'C', 'spectral_type': 'G', 'distance': 100})
+        self.assertIsNot(host_index(), index)
+        self.assertEqual(self.search(reverse('hosts-within-radius'), {'host': self.hosts['A'].pk, 'radius': 3}), [('A', 0)])
+        self.hosts['B'].delete()
+        self.assertEqual(self.search(reverse('host-nearest-neighbors', args=[self.hosts['A'].pk])), [('C', 90)])
+
+    def test_searches_query_only_the_version_and_results(self):
+        host_index()
+        with CaptureQueriesContext(connection) as queries:
+            self.search(reverse('hosts-within-radius'), {'host': self.hosts['A'].pk, 'radius': 3})
+        self.assertEqual(len(queries), 2)
+
+
+class ConeSearchTestCase(TestCase):
+    """Cone searches narrow on the sky pixels and match the exact great-circle check."""
+
+    POSITIONS = [(0.1, 0), (359.9, 0.5), (180, 0), (10, 45), (10.5, 44), (200, 89.5), (20, 89.8), (300, -60), (None, 10)]
+
+    def setUp(self):
+        for index, (ra, dec) in enumerate(self.POSITIONS):
+            host = Host.objects.create(name=f'Host {index}', spectral_type='G')
+            reference = SystemParameterReference.objects.create(name=f'Ref {index}', right_ascension='', ra_degrees=ra, declination='', dec_degrees=dec)
+            PlanetarySystem.objects.create(host=host, parameter_reference=reference)
+
+    def cone(self, ra, dec, radius):
+        response = self.client.get(reverse('hosts-in-cone'), {'ra': ra, 'dec': dec, 'radius_deg': radius})
+        self.assertEqual(response.status_code, 200)
+        return [host['name'] for host in response.json()]
+
+    def test_references_get_their_pixel(self):
+        reference = SystemParameterReference.objects.get(name='Ref 3')
+        self.assertEqual(reference.sky_pixel, sky_pixels(10, 45))
+        self.assertIsNone(SystemParameterReference.objects.get(name='Ref 8').sky_pixel)
+        reference.ra_degrees = 11
+        reference.save()
+        reference.refresh_from_db()
+        self.assertEqual(reference.sky_pixel, sky_pixels(11, 45))
+
+    def test_cone_matches_exact_check(self):
+        for ra, dec, radius in [(0, 0, 1), (359.5, 0, 1), (10, 45, 1.5), (10, 45, 0.5), (0, 90, 1), (100, 89, 2), (300, -60, 0), (0, 0, 180)]:
+            with self.subTest(ra=ra, dec=dec, radius=radius):
+                expected = sorted(
+                    (angular_separation(ra, dec, position_ra, position_dec), f'Host {index}')
+                    for index, (position_ra, position_dec) in enumerate(self.POSITIONS)
+                    if position_ra is not None and angular_separation(ra, dec, position_ra, position_dec) <= radius
+                )
+                self.assertEqual(self.cone(ra, dec, radius), [name for _, name in expected])
+
+    def test_cone_results_are_limited(self):
+        response = self.client.get(reverse('hosts-in-cone'), {'ra': 10, 'dec': 45, 'radius_deg': 180, 'limit': 2})
+        self.assertEqual([host['name'] for host in response.json()], ['Host 3', 'Host 4'])
+        with mock.patch('midterm_app.views.MAX_SPATIAL_LIMIT', 1):
+            self.assertEqual(self.cone(10, 45, 180), ['Host 3'])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(reverse('hosts-in-cone'), {'ra': 0, 'dec': 95, 'radius_deg': 1}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('hosts-in-cone'), {'ra': 0, 'dec': 0}).status_code, 400)
+        for params in [{'radius_deg': 'nan'}, {'radius_deg': 'inf'}, {'radius_deg': 181}, {'ra': 'nan'}, {'dec': '-inf'}]:
+            with self.subTest(**params):
+                response = self.client.get(reverse('hosts-in-cone'), {'ra': 0, 'dec': 0, 'radius_deg': 1, **params})
+                self.assertEqual(response.status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite only')
+    def test_cone_searches_pixel_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.cone(10, 45, 2)
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {queries[0]["sql"]}')
+            plan = [detail for _, _, _, detail in cursor.fetchall()]
+        self.assertFalse([detail for detail in plan if detail.startswith('SCAN')], plan)
+        self.assertTrue(any('reference_sky_pixel_idx' in detail for detail in plan), plan)
+
+
+class SearchTestCase(TestCase):
+    """Planet search ranks name matches first and follows the writes to FlatPlanet."""
+
+    def setUp(self):
+        self.host = Host.objects.create(name='Kepler-442', spectral_type='K')
+        reference = SystemParameterReference.objects.create(name='<a href="x">Torres et al. 2015</a>', right_ascension='', declination='')
+        PlanetarySystem.objects.create(host=self.host, parameter_reference=reference)
+        self.discovery = Discovery.objects.create(method='Transit', year=2015, reference_name='Torres', facility='Kepler', telescope='Kepler')
+        self.planet = Planet.objects.create(name='Kepler-442 b', host=self.host, discovery=self.discovery)
+        other = Host.objects.create(name='TOI-700', spectral_type='M')
+        tess = Discovery.objects.create(method='Transit', year=2020, reference_name='Gilbert', facility='Transiting Exoplanet Survey Satellite (TESS)', telescope='Kepler')
+        Planet.objects.create(name='TOI-700 d', host=other, discovery=tess)
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('search-planets'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [planet['name'] for planet in response.json()]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search('kepler'), ['Kepler-442 b', 'TOI-700 d'])
+        self.assertEqual(self.search('torres'), ['Kepler-442 b'])
+
+    def test_words_match_as_prefixes(self):
+        self.assertEqual(self.search('kep 442'), ['Kepler-442 b'])
+        self.assertEqual(self.search('transiting surv'), ['TOI-700 d'])
+        self.assertEqual(self.search('"kepler" OR toi*'), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_limit(self):
+        self.assertEqual(self.search('kepler', limit=1), ['Kepler-442 b'])
+        self.assertEqual(self.client.get(reverse('search-planets'), {'q': 'kepler', 'limit': 0}).status_code, 400)
+
+    def test_writes_reach_the_index(self):
+        Planet.objects.create(name='Kepler-442 c', host=self.host, discovery=self.discovery)
+        self.assertEqual(self.search('442'), ['Kepler-442 b', 'Kepler-442 c'])
+        self.client.post(reverse('report-host'), {'name': 'Kepler-442', 'spectral_type': 'K', 'distance': 20})
+        self.host.name = 'KOI-4742'
+        self.host.save()
+        self.assertEqual(self.search('koi'), ['Kepler-442 b', 'Kepler-442 c'])
+        SystemParameterReference.objects.all().delete()
+        self.assertEqual(self.search('torres'), ['Kepler-442 b', 'Kepler-442 c'])
+        self.discovery.delete()
+        self.assertEqual(self.search('442'), [])
+        rebuild_flat_planets()
+        self.assertEqual(self.search('toi'), ['TOI-700 d'])
+
+    def test_fallback_without_index(self):
+        with mock.patch('midterm_app.search.has_search_index', return_value=False):
+            self.assertEqual(self.search('kep 442'), ['Kepler-442 b'])
+            self.assertEqual(self.search('kepler'), ['Kepler-442 b', 'TOI-700 d'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 is SQLite only')
+    def test_sqlite_uses_index(self):
+        self.assertTrue(has_search_index())
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 is SQLite only')
+    def test_rebuild_keeps_the_migrated_triggers(self):
+        triggers = "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name"
+        with connection.cursor() as cursor:
+            cursor.execute(triggers)
+            before = cursor.fetchall()
+            rebuild_flat_planets()
+            cursor.execute(triggers)
+            self.assertEqual(cursor.fetchall(), before)
+        self.assertEqual(len(before), 3)
+        Planet.objects.create(name='TOI-700 e', host=self.host, discovery=self.discovery)
+        self.assertEqual(self.search('700'), ['TOI-700 d', 'TOI-700 e'])
+
+    def test_search_page(self):
+        response = self.client.get(reverse('search'), {'q': 'toi'})
+        self.assertContains(response, 'TOI-700 d')
+        self.assertNotContains(response, 'Kepler-442 b')
+        self.assertContains(response, 'name="q"')
+        self.assertContains(self.client.get(reverse('search'), {'q': 'nothing'}), 'No planets match')
+
+
+class AutocompleteTestCase(TestCase):
+    """Name suggestions come from the in-memory index, which follows the catalog version."""
+
+    def setUp(self):
+        discovery = Discovery.objects.create(method='Transit', year=2020, reference_name='Ref', facility='TESS', telescope='TESS')
+        for host_name, planets in [('TOI-700', 'bcd'), ('TOI-70', 'b'), ('Kepler-22', 'b'), ('HD 209458', 'b'), ('Gliese 581', '')]:
+            host = Host.objects.create(name=host_name, spectral_type='G')
+            for letter in planets:
+                Planet.objects.create(name=f'{host_name} {letter}', host=host, discovery=discovery)
+        # Rebuild the index of every test on first use.
+        patcher = mock.patch('midterm_app.autocomplete.RECHECK_SECONDS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def complete(self, query, **params):
+        response = self.client.get(reverse('autocomplete-names'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [name['name'] for name in response.json()]
+
+    def test_normalize(self):
+        self.assertEqual(normalize('  TOI-700  d'), 'toi 700 d')
+        self.assertEqual(normalize('Kepler-'), 'kepler ')
+        self.assertEqual(normalize('Gliése_581'), 'gliese 581')
+
+    def test_prefixes(self):
+        self.assertEqual(self.complete('TOI-'), ['TOI-70', 'TOI-70 b', 'TOI-700', 'TOI-700 b', 'TOI-700 c', 'TOI-700 d'])
+        self.assertEqual(self.complete('toi 700'), ['TOI-700', 'TOI-700 b', 'TOI-700 c', 'TOI-700 d'])
+        self.assertEqual(self.complete('HD 2'), ['HD 209458', 'HD 209458 b'])
+        self.assertEqual(self.complete('kepler-22 b'), ['Kepler-22 b'])
+        self.assertEqual(self.complete('gliese'), ['Gliese 581'])
+        self.assertEqual(self.complete('55 Cnc'), [])
+        self.assertEqual(self.complete(' - '), [])
+
+    def test_limit_and_fields(self):
+        response = self.client.get(reverse('autocomplete-names'), {'q': 'toi', 'limit': 2})
+        host = Host.objects.get(name='TOI-70')
+        planet = Planet.objects.get(name='TOI-70 b')
+        self.assertEqual(response.json(), [
+            {'name': 'TOI-70', 'type': 'host', 'id': host.pk},
+            {'name': 'TOI-70 b', 'type': 'planet', 'id': planet.pk},
+        ])
+        self.assertEqual(self.client.get(reverse('autocomplete-names'), {'q': 'toi', 'limit': 0}).status_code, 400)
+
+    def test_index_follows_catalog_version(self):
+        self.assertEqual(self.complete('kepler'), ['Kepler-22', 'Kepler-22 b'])
+        Planet.objects.filter(name='Kepler-22 b').delete()
+        self.client.post(reverse('report-host'), {'name': 'Kepler-16', 'spectral_type': 'K'})
+        self.assertEqual(self.complete('kepler'), ['Kepler-16', 'Kepler-22'])
+
+    def test_completes_without_queries_between_rechecks(self):
+        self.complete('toi')
+        with mock.patch('midterm_app.autocomplete.RECHECK_SECONDS', 60):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.complete('kep'), ['Kepler-22', 'Kepler-22 b'])
+            Host.objects.filter(name='Kepler-22').delete()
+            self.assertEqual(self.complete('kep'), ['Kepler-22', 'Kepler-22 b'])
+        self.assertEqual(self.complete('kep'), [])
+
+
+class PaginationTestCase(TestCase):
+    """The API lists are paged by keyset cursors, which walk every row once in both directions."""
+
+    def setUp(self):
+        discovery = Discovery.objects.create(method='Transit', year=2010, reference_name='Ref', facility='Kepler', telescope='Kepler')
+        for index in range(7):
+            host = Host.objects.create(name=f'Host {index}', spectral_type='G')
+            # Ties and NULLs in the orderings on mass and planet_count.
+            for letter in 'bc'[:1 + index % 2]:
+                Planet.objects.create(name=f'Host {index} {letter}', host=host, discovery=discovery, mass=[None, 1, 2][index % 3])
+
+    def walk(self, url, params=None, page_size=2):
+        """The names of every page following next links, then of every page following previous links back."""
+        forward, backward = [], []
+        response = self.client.get(url, {**(params or {}), 'page_size': page_size})
+        while True:
+            page = response.json()
+            self.assertLessEqual(len(page['results']), page_size)
+            forward.append([row['name'] for row in page['results']])
+            if page['next'] is None:
+                break
+            response = self.client.get(page['next'])
+        while page['previous'] is not None:
+            page = self.client.get(page['previous']).json()
+            backward.insert(0, [row['name'] for row in page['results']])
+        self.assertEqual(backward, forward[:-1])
+        return [name for names in forward for name in names]
+
+    def test_pages_cover_every_row_once(self):
+        planets = list(Planet.objects.order_by('pk').values_list('name', flat=True))
+        self.assertEqual(self.walk(reverse('planet-list-create')), planets)
+        self.assertEqual(self.walk(reverse('host-list-create'), page_size=3), list(Host.objects.order_by('pk').values_list('name', flat=True)))
+        self.assertEqual(sorted(self.walk(reverse('planets-by-min-mass'))), sorted(planets))
+        self.assertEqual(self.walk(reverse('planets-by-min-mass'), {'min_mass': 0}), list(
+            Planet.objects.filter(mass__gt=0).order_by('mass', 'pk').values_list('name', flat=True)
+        ))
+        self.assertEqual(self.walk(reverse('hosts-by-min-planets'), page_size=1), list(
+            Host.objects.filter(planet_count__gt=1).order_by('pk').values_list('name', flat=True)
+        ))
+
+    def test_page_size_and_count(self):
+        url = reverse('planet-list-create')
+        page = self.client.get(url).json()
+        self.assertNotIn('count', page)
+        self.assertEqual(len(page['results']), Planet.objects.count())
+        page = self.client.get(url, {'page_size': 3, 'count': 'true'}).json()
+        self.assertEqual(page['count'], Planet.objects.count())
+        self.assertEqual(len(page['results']), 3)
+        self.assertEqual(self.client.get(url, {'cursor': 'cD1ub3Bl'}).status_code, 404)
+
+    def test_writes_between_pages(self):
+        url = reverse('planet-list-create')
+        page = self.client.get(url, {'page_size': 3}).json()
+        Planet.objects.get(name='Host 0 b').delete()
+        names = [row['name'] for row in self.client.get(page['next']).json()['results']]
+        self.assertEqual(names, list(Planet.objects.order_by('pk').values_list('name', flat=True)[2:5]))
+
+
+class QueryCountTestCase(TestCase):
+    """Every page and endpoint runs the same queries however many rows it returns."""
+
+    maxDiff = None
+
+    # Queries per request; the spatial ones after the index is built.
+    EXPECTED = {
+        'host_list': 1, 'host_detail': 2, 'planet_list': 1, 'planet_detail': 1, 'planets_near_earth': 1,
+        'systems_visualization': 1, 'search': 2 if connection.vendor == 'sqlite' else 1,
+        'host-list-create': 1, 'host-detail': 1, 'discovery-list-create': 1, 'discovery-detail': 1,
+        'system-parameter-list-create': 1, 'system-parameter-detail': 1, 'system-list-create': 1, 'system-detail': 1,
+        'planet-list-create': 1, 'planet-detail': 1, 'planets-by-discovery-method': 1, 'planets-by-discovery-year': 1,
+        'planets-by-min-mass': 1, 'hosts-by-min-planets': 1, 'planets-by-controversial-flag': 1, 'systems-by-max-distance': 1,
+        'hosts-within-radius': 2, 'host-nearest-neighbors': 2, 'hosts-in-cone': 2, 'search-planets': 2 if connection.vendor == 'sqlite' else 1,
+    }
+
+    def setUp(self):
+        self.discovery = Discovery.objects.create(method='Transit', year=2010, reference_name='Ref', facility='Kepler', telescope='Kepler')
+        self.hosts = 0
+
+    def add_hosts(self, count):
+        for _ in range(count):
+            index = self.hosts = self.hosts + 1
+            host = Host.objects.create(name=f'Host {index}', spectral_type='G', distance=index)
+            reference = SystemParameterReference.objects.create(name=f'Ref {index}', right_ascension='', ra_degrees=index, declination='', dec_degrees=0)
+            PlanetarySystem.objects.create(host=host, parameter_reference=reference)
+            for letter in 'bc':
+                Planet.objects.create(name=f'Host {index} {letter}', host=host, discovery=self.discovery, mass=index, controversial_flag=True)
+
+    def requests(self):
+        host, planet = Host.objects.first(), Planet.objects.first()
+        system, reference = PlanetarySystem.objects.first(), SystemParameterReference.objects.first()
+        return {
+            'host_list': (reverse('host_list'), {}),
+            'host_detail': (reverse('host_detail', args=[host.pk]), {}),
+            'planet_list': (reverse('planet_list'), {}),
+            'planet_detail': (reverse('planet_detail', args=[planet.pk]), {}),
+            'planets_near_earth': (reverse('planets_near_earth'), {'distance': 1000}),
+            'systems_visualization': (reverse('systems_visualization'), {}),
+            'search': (reverse('search'), {'q': 'host'}),
+            'host-list-create': (reverse('host-list-create'), {}),
+            'host-detail': (reverse('host-detail', args=[host.pk]), {}),
+            'discovery-list-create': (reverse('discovery-list-create'), {}),
+            'discovery-detail': (reverse('discovery-detail', args=[self.discovery.pk]), {}),
+            'system-parameter-list-create': (reverse('system-parameter-list-create'), {}),
+            'system-parameter-detail': (reverse('system-parameter-detail', args=[reference.pk]), {}),
+            'system-list-create': (reverse('system-list-create'), {}),
+            'system-detail': (reverse('system-detail', args=[system.pk]), {}),
+            'planet-list-create': (reverse('planet-list-create'), {}),
+            'planet-detail': (reverse('planet-detail', args=[planet.pk]), {}),
+            'planets-by-discovery-method': (reverse('planets-by-discovery-method'), {'discovery_method': 'Transit'}),
+            'planets-by-discovery-year': (reverse('planets-by-discovery-year'), {'discovery_year': 2010}),
+            'planets-by-min-mass': (reverse('planets-by-min-mass'), {'min_mass': 0}),
+            'hosts-by-min-planets': (reverse('hosts-by-min-planets'), {}),
+            'planets-by-controversial-flag': (reverse('planets-by-controversial-flag'), {'controversial_flag': 'true'}),
+            'systems-by-max-distance': (reverse('systems-by-max-distance'), {'max_distance': 1000}),
+            'hosts-within-radius': (reverse('hosts-within-radius'), {'host': host.pk, 'radius': 1000}),
+            'host-nearest-neighbors': (reverse('host-nearest-neighbors', args=[host.pk]), {}),
+            'hosts-in-cone': (reverse('hosts-in-cone'), {'ra': 0, 'dec': 0, 'radius_deg': 180}),
+            'search-planets': (reverse('search-planets'), {'q': 'host'}),
+        }
+
+    def query_counts(self):
+        host_index()
+        counts = {}
+        for name, (url, params) in self.requests().items():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200, name)
+            counts[name] = len(queries)
+        return counts
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        self.add_hosts(2)
+        self.assertEqual(self.query_counts(), self.EXPECTED)
+        self.add_hosts(8)
+        self.assertEqual(self.query_counts(), self.EXPECTED)
+
+    def test_admin_lists(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        for model in ('planet', 'planetarysystem'):
+            url = reverse(f'admin:midterm_app_{model}_changelist')
+            self.add_hosts(2)
+            with CaptureQueriesContext(connection) as few:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.add_hosts(8)
+            with CaptureQueriesContext(connection) as many:
+                self.assertContains(self.client.get(url), f'Host {self.hosts}')
+            self.assertEqual(len(many), len(few), model)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite only')
+class QueryPlanTestCase(TestCase):
+    """The filter endpoints search the catalog through an index rather than scanning a table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(20):
+            host = Host.objects.create(name=f'Host {index}', distance=10 * index)
+            discovery = Discovery.objects.create(method='Transit' if index % 2 else 'Radial Velocity', year=2000 + index)
+            Planet.objects.create(
+                name=f'Planet {index}', host=host, discovery=discovery, mass=index, radius=index / 2,
+                equilibrium_temperature=100 * index, controversial_flag=index == 7,
+            )
+            PlanetarySystem.objects.create(host=host)
+
+    def query_plans(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    cursor.execute(f'EXPLAIN QUERY PLAN {query["sql"]}')
+                    plans.append([detail for _, _, _, detail in cursor.fetchall()])
+        return plans
+
+    def assertNoTableScans(self, url, params, index=None):
+        plans = self.query_plans(url, params)
+        details = [detail for plan in plans for detail in plan]
+        # Scanning a partial index only reads the rows it holds.
+        self.assertFalse([detail for detail in details if detail.startswith('SCAN') and not (index and detail.endswith(index))], plans)
+        if index:
+            self.assertTrue(any(index in detail for detail in details), plans)
+
+    def test_discovery_method_uses_index(self):
+        self.assertNoTableScans(reverse('planets-by-discovery-method'), {'discovery_method': 'Transit'}, 'flat_planet_method_year_idx')
+
+    def test_discovery_year_uses_index(self):
+        self.assertNoTableScans(reverse('planets-by-discovery-year'), {'discovery_year': 2007}, 'flat_planet_year_idx')
+
+    def test_min_mass_uses_index(self):
+        self.assertNoTableScans(reverse('planets-by-min-mass'), {'min_mass': 15}, 'flat_planet_mass_idx')
+
+    def test_controversial_flag_uses_partial_index(self):
+        self.assertNoTableScans(reverse('planets-by-controversial-flag'), {'controversial_flag': 'true'}, 'flat_planet_controversial_idx')
+
+    def test_hosts_min_planets_uses_index(self):
+        self.assertNoTableScans(reverse('hosts-by-min-planets'), {'min_planets': 3}, 'host_planet_count_idx')
+
+    def test_systems_max_distance_uses_index(self):
+        self.assertNoTableScans(reverse('systems-by-max-distance'), {'max_distance': 50}, 'host_distance_idx')
+
+    def test_planets_near_earth_uses_indexes(self):
+        self.assertNoTableScans(reverse('planets_near_earth'), {'distance': 50}, 'flat_planet_distance_idx')
+        for params, index in [
+            ({'min_mass': 15}, 'flat_planet_mass_idx'),
+            ({'max_radius': 1}, 'flat_planet_radius_idx'),
+            ({'min_temp': 1500}, 'flat_planet_temperature_idx'),
+        ]:
+            with self.subTest(params=params):
+                self.assertNoTableScans(reverse('planets_near_earth'), {'distance': 1000, **params})
@@ -6,7 +6,7 @@ from .views import (
     PlanetListCreate, PlanetDetail, 
     SystemParameterReferenceListCreate, SystemParameterReferenceDetail,
     PlanetsByDiscoveryMethod, PlanetsByDiscoveryYear, PlanetsByMinMass,
-    HostsByMinPlanets, PlanetsByControversialFlag, PlanetarySystemsByMaxDistance, report_discovery, report_host, report_index, report_planet, report_planetary_system
+    HostsByMinPlanets, PlanetsByControversialFlag, PlanetarySystemsByMaxDistance, HostsWithinRadius, HostNearestNeighbors, HostsInCone, SearchPlanets, AutocompleteNames, report_discovery, report_host, report_index, report_planet, report_planetary_system
 )
 
 from . import views
@@ -21,6 +21,7 @@ urlpatterns = [
     path('planets/<int:pk>/', planet_detail, name='planet_detail'),
     path('planets/near-earth/', views.planets_near_earth, name='planets_near_earth'),
     path('systems/visualization/', views.systems_visualization, name='systems_visualization'),
+    path('search/', views.search, name='search'),
     path('api', views.api_endpoints, name='api_endpoints'),
     path('api/hosts/', HostListCreate.as_view(), name='host-list-create'),
     path('api/hosts/<int:pk>/', HostDetail.as_view(), name='host-detail'),
@@ -38,6 +39,11 @@ urlpatterns = [
     path('api/hosts/min-planets/', HostsByMinPlanets.as_view(), name='hosts-by-min-planets'),
     path('api/planets/controversial-flag/', PlanetsByControversialFlag.as_view(), name='planets-by-controversial-flag'),
     path('api/systems/max-distance/', PlanetarySystemsByMaxDistance.as_view(), name='systems-by-max-distance'),
+    path('api/hosts/within/', HostsWithinRadius.as_view(), name='hosts-within-radius'),
+    path('api/hosts/<int:pk>/nearest/', HostNearestNeighbors.as_view(), name='host-nearest-neighbors'),
+    path('api/hosts/cone/', HostsInCone.as_view(), name='hosts-in-cone'),
+    path('api/search/', SearchPlanets.as_view(), name='search-planets'),
+    path('api/autocomplete/', AutocompleteNames.as_view(), name='autocomplete-names'),
     path('report_index/', report_index, name='report_index'),
     path('report/host/', report_host, name='report-host'),
     path('report/discovery/', report_discovery, name='report-discovery'),
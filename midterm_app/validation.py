@@ -0,0 +1,149 @@
+"""Vectorized batch validation of archive records, quarantining the rows that fail."""
+from collections import Counter
+from datetime import date
+from itertools import chain, compress
+
+import numpy as np
+
+from .ingest import iter_chunks
+from .models import QuarantinedRow
+from .telemetry import IngestStats
+
+VALIDATION_BATCH = 256
+
+# Where a field lives in a record: (model, lookup or defaults, field name).
+HOST, REFERENCE, DISCOVERY, PLANET = range(4)
+LOOKUP, DEFAULTS = range(2)
+RECORD_LABELS = ('host', 'system_parameter_reference', 'discovery', 'planet')
+
+# Reason code and field of the values every row needs.
+REQUIRED_FIELDS = (
+    ('host_name_missing', (HOST, LOOKUP, 'name')),
+    ('planet_name_missing', (PLANET, LOOKUP, 'name')),
+    ('discovery_method_missing', (DISCOVERY, LOOKUP, 'method')),
+    ('row_update_invalid', (REFERENCE, DEFAULTS, 'row_update')),
+)
+
+# Reason code, field and inclusive bounds of the numeric values.
+RANGE_RULES = (
+    ('host_temperature_out_of_range', (HOST, DEFAULTS, 'effective_temperature'), 0, 1e6),
+    ('host_radius_out_of_range', (HOST, DEFAULTS, 'radius'), 0, np.inf),
+    ('host_mass_out_of_range', (HOST, DEFAULTS, 'mass'), 0, np.inf),
+    ('distance_out_of_range', (HOST, DEFAULTS, 'distance'), 0, np.inf),
+    ('ra_out_of_range', (REFERENCE, LOOKUP, 'ra_degrees'), 0, 360),
+    ('dec_out_of_range', (REFERENCE, LOOKUP, 'dec_degrees'), -90, 90),
+    ('orbital_period_out_of_range', (PLANET, DEFAULTS, 'orbital_period'), 0, np.inf),
+    ('semi_major_axis_out_of_range', (PLANET, DEFAULTS, 'semi_major_axis'), 0, np.inf),
+    ('radius_out_of_range', (PLANET, DEFAULTS, 'radius'), 0, np.inf),
+    ('mass_out_of_range', (PLANET, DEFAULTS, 'mass'), 0, np.inf),
+    ('mass_sin_i_out_of_range', (PLANET, DEFAULTS, 'mass_sin_i_earth'), 0, np.inf),
+    ('eccentricity_out_of_range', (PLANET, DEFAULTS, 'eccentricity'), 0, 1),
+    ('insolation_flux_out_of_range', (PLANET, DEFAULTS, 'insolation_flux'), 0, np.inf),
+    ('equilibrium_temperature_out_of_range', (PLANET, DEFAULTS, 'equilibrium_temperature'), 0, np.inf),
+    ('inclination_out_of_range', (PLANET, DEFAULTS, 'inclination'), 0, 180),
+    ('transit_duration_out_of_range', (PLANET, DEFAULTS, 'transit_duration'), 0, np.inf),
+)
+
+FIRST_DISCOVERY_YEAR = 1900
+EARTH_MASSES_PER_JUPITER_MASS = 317.83
+# Relative slack for values the archive rounds independently.
+MASS_TOLERANCE = 0.1
+
+DISCOVERY_YEAR = (DISCOVERY, LOOKUP, 'year')
+MASS = (PLANET, DEFAULTS, 'mass')
+MASS_SIN_I_EARTH = (PLANET, DEFAULTS, 'mass_sin_i_earth')
+MASS_SIN_I_JUPITER = (PLANET, DEFAULTS, 'mass_sin_i_jupiter')
+NUMERIC_FIELDS = tuple(dict.fromkeys(
+    [field for _, field, _, _ in RANGE_RULES] + [DISCOVERY_YEAR, MASS, MASS_SIN_I_EARTH, MASS_SIN_I_JUPITER]
+))
+
+
+def compile_extractor(required, numeric):
+    """A function turning records into rows of 1.0 per missing required field, then the numeric fields (NaN for None)."""
+    cells = [f'not record[{model}][{part}][{name!r}]' for model, part, name in required]
+    cells += [f'(nan if (value := record[{model}][{part}][{name!r}]) is None else value)' for model, part, name in numeric]
+    namespace = {'nan': np.nan}
+    exec(f'def extract(batch):\n    return [({", ".join(cells)},) for record in batch]\n', namespace)
+    width = len(cells)
+
+    def extract_array(batch):
+        rows = namespace['extract'](batch)
+        return np.fromiter(chain.from_iterable(rows), dtype=float, count=len(rows) * width).reshape(len(rows), width)
+    return extract_array
+
+def consistency_masks(numbers):
+    """(reason code, mask) of the rules relating several fields, from the float arrays of a batch."""
+    year = numbers[DISCOVERY_YEAR]
+    mass, earth, jupiter = numbers[MASS], numbers[MASS_SIN_I_EARTH], numbers[MASS_SIN_I_JUPITER]
+    return (
+        ('discovery_year_out_of_range', (year < FIRST_DISCOVERY_YEAR) | (year > date.today().year + 1)),
+        # The true mass is never below the mass * sin(i) lower bound.
+        ('mass_below_mass_sin_i', mass < earth * (1 - MASS_TOLERANCE)),
+        ('mass_units_inconsistent', np.abs(earth - jupiter * EARTH_MASSES_PER_JUPITER_MASS) > earth * MASS_TOLERANCE),
+    )
+
+extract_values = compile_extractor([field for _, field in REQUIRED_FIELDS], NUMERIC_FIELDS)
+
+def validate_batch(batch):
+    """The mask of the valid records and the reason codes of each invalid one, by index."""
+    values = extract_values(batch)
+    masks = [(code, values[:, index] != 0) for index, (code, _) in enumerate(REQUIRED_FIELDS)]
+    # Missing values are NaN, which fails no comparison.
+    numbers = dict(zip(NUMERIC_FIELDS, values[:, len(REQUIRED_FIELDS):].T))
+    for code, field, low, high in RANGE_RULES:
+        values = numbers[field]
+        masks.append((code, (values < low) | (values > high)))
+    masks.extend(consistency_masks(numbers))
+
+    invalid = np.zeros(len(batch), dtype=bool)
+    for _, mask in masks:
+        invalid |= mask
+    reasons = {}
+    if invalid.any():
+        for code, mask in masks:
+            for index in np.flatnonzero(mask):
+                reasons.setdefault(int(index), []).append(code)
+    return ~invalid, reasons
+
+def record_fields(record):
+    """A record as JSON-friendly field values per model."""
+    return {label: {**lookup, **defaults} for label, (lookup, defaults) in zip(RECORD_LABELS, record)}
+
+
+class Quarantine:
+    """The rows of one source rejected by validation, written to QuarantinedRow."""
+
+    def __init__(self, source, resume=False, stats=None):
+        self.source = source
+        self.stats = stats if stats is not None else IngestStats()
+        self.counts = Counter()
+        self.rows = 0
+        if not resume:
+            # A new load of the source replaces what earlier loads rejected;
+            # a resumed one runs over its first rows again and keeps them.
+            QuarantinedRow.objects.filter(source=source).delete()
+
+    def add(self, rows):
+        """Quarantine (row number, record, reason codes) triples."""
+        objs = [
+            QuarantinedRow(source=self.source, row_number=row_number, reasons=','.join(reasons), record=record_fields(record))
+            for row_number, record, reasons in rows
+        ]
+        with self.stats.stage('write quarantine'):
+            QuarantinedRow.objects.bulk_create(objs, ignore_conflicts=True)
+        for _, _, reasons in rows:
+            self.counts.update(reasons)
+        self.rows += len(rows)
+
+
+def validate_records(records, quarantine, batch_size=VALIDATION_BATCH):
+    """Yield the records passing validation, quarantining the others."""
+    stats = quarantine.stats
+    row_number = 1
+    for batch in iter_chunks(records, batch_size):
+        with stats.stage('validate'):
+            valid, reasons = validate_batch(batch)
+            if reasons:
+                quarantine.add([(row_number + index, batch[index], codes) for index, codes in sorted(reasons.items())])
+        row_number += len(batch)
+        yield from compress(batch, valid)
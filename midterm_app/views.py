@@ -1,11 +1,19 @@
 import json
+import math
 from .forms import HostForm, DiscoveryForm, PlanetarySystemForm, PlanetForm
 from django.shortcuts import get_object_or_404, redirect, render
 from rest_framework import generics
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
 from django_filters import rest_framework as filters
 
-from .models import Host, Discovery, Planet, SystemParameterReference, PlanetarySystem
-from .serializers import HostSerializer, DiscoverySerializer, PlanetSerializer, SystemParameterReferenceSerializer, PlanetarySystemSerializer
+from .models import Host, Discovery, Planet, SystemParameterReference, PlanetarySystem, FlatPlanet
+from .serializers import HostSerializer, DiscoverySerializer, PlanetSerializer, SystemParameterReferenceSerializer, PlanetarySystemSerializer, FlatPlanetSerializer
+from .autocomplete import AUTOCOMPLETE_LIMIT, name_index
+from .search import SEARCH_LIMIT, search_planets
+from .sky import angular_separation, cone_filter
+from .spatial import MAX_SPATIAL_LIMIT, RA, DEC, SPATIAL_LIMIT, cartesian, host_index
 
 def landing_page(request):
     return render(request, 'midterm_app/landing.html')
@@ -20,17 +28,21 @@ def host_list(request):
     return render(request, 'midterm_app/host_list.html', {'hosts': hosts})
 
 def host_detail(request, pk):
-    host = get_object_or_404(Host, pk=pk)
+    host = get_object_or_404(Host.objects.select_related('system__parameter_reference'), pk=pk)
     return render(request, 'midterm_app/host_detail.html', {'host': host})
 
 def planet_list(request):
-    planets = Planet.objects.all()
+    planets = FlatPlanet.objects.only('name')
     return render(request, 'midterm_app/planet_list.html', {'planets': planets})
 
 def planet_detail(request, pk):
-    planet = get_object_or_404(Planet, pk=pk)
+    planet = get_object_or_404(FlatPlanet, pk=pk)
     return render(request, 'midterm_app/planet_detail.html', {'planet': planet})
 
+def search(request):
+    query = request.GET.get('q', '')
+    return render(request, 'midterm_app/search.html', {'query': query, 'planets': search_planets(query)})
+
 def api_endpoints(request):
     return render(request, 'midterm_app/api.html')
 
@@ -43,7 +55,7 @@ def planets_near_earth(request):
     min_temp = request.GET.get('min_temp', None)
     max_temp = request.GET.get('max_temp', None)
 
-    planets = Planet.objects.filter(host__distance__lte=distance)
+    planets = FlatPlanet.objects.filter(host_distance__lte=distance)
 
     if min_mass:
         planets = planets.filter(mass__gte=min_mass)
@@ -72,7 +84,7 @@ def planets_near_earth(request):
 
 def systems_visualization(request):
     #hosts = Host.objects.filter(distance__lte=600)
-    hosts = Host.objects.all()
+    hosts = Host.objects.select_related('system__parameter_reference')
     hosts_data = []
 
     for host in hosts:
@@ -112,13 +124,25 @@ class SystemParameterReferenceListCreate(generics.ListCreateAPIView):
     serializer_class = SystemParameterReferenceSerializer
 
 class PlanetarySystemListCreate(generics.ListCreateAPIView):
-    queryset = PlanetarySystem.objects.all()
+    # Joins what PlanetarySystemSerializer nests, rather than a query per system.
+    queryset = PlanetarySystem.objects.select_related('host', 'parameter_reference')
     serializer_class = PlanetarySystemSerializer
 
 class PlanetListCreate(generics.ListCreateAPIView):
-    queryset = Planet.objects.all()
+    queryset = Planet.objects.select_related('host', 'discovery')
     serializer_class = PlanetSerializer
 
+    # Lists read the FlatPlanet read model, creates write Planet.
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return FlatPlanet.objects.all()
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.request.method in SAFE_METHODS:
+            return FlatPlanetSerializer
+        return super().get_serializer_class()
+
 class HostDetail(generics.RetrieveUpdateDestroyAPIView):
     queryset = Host.objects.all()
     serializer_class = HostSerializer
@@ -132,36 +156,38 @@ class SystemParameterReferenceDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = SystemParameterReferenceSerializer
 
 class PlanetarySystemDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = PlanetarySystem.objects.all()
+    queryset = PlanetarySystem.objects.select_related('host', 'parameter_reference')
     serializer_class = PlanetarySystemSerializer
 
 class PlanetDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Planet.objects.all()
+    queryset = Planet.objects.select_related('host', 'discovery')
     serializer_class = PlanetSerializer
 
 class PlanetFilter(filters.FilterSet):
-    discovery_method = filters.CharFilter(field_name='discovery__method')
+    discovery_method = filters.CharFilter(field_name='discovery_method')
 
     class Meta:
-        model = Planet
+        model = FlatPlanet
         fields = ['discovery_method']
 
 class PlanetsByDiscoveryMethod(generics.ListAPIView):
-    queryset = Planet.objects.all()
-    serializer_class = PlanetSerializer
+    queryset = FlatPlanet.objects.all()
+    # Pages follow flat_planet_method_year_idx.
+    ordering = ('discovery_year', 'pk')
+    serializer_class = FlatPlanetSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = PlanetFilter
 
 class PlanetFilterByYear(filters.FilterSet):
-    discovery_year = filters.NumberFilter(field_name='discovery__year')
+    discovery_year = filters.NumberFilter(field_name='discovery_year')
 
     class Meta:
-        model = Planet
+        model = FlatPlanet
         fields = ['discovery_year']
 
 class PlanetsByDiscoveryYear(generics.ListAPIView):
-    queryset = Planet.objects.all()
-    serializer_class = PlanetSerializer
+    queryset = FlatPlanet.objects.all()
+    serializer_class = FlatPlanetSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = PlanetFilterByYear
 
@@ -169,12 +195,13 @@ class PlanetFilterByMass(filters.FilterSet):
     min_mass = filters.NumberFilter(field_name='mass', lookup_expr='gt')
 
     class Meta:
-        model = Planet
+        model = FlatPlanet
         fields = ['min_mass']
 
 class PlanetsByMinMass(generics.ListAPIView):
-    queryset = Planet.objects.all()
-    serializer_class = PlanetSerializer
+    queryset = FlatPlanet.objects.all()
+    ordering = ('mass', 'pk')
+    serializer_class = FlatPlanetSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = PlanetFilterByMass
 
@@ -182,37 +209,38 @@ class PlanetFilterByMass(filters.FilterSet):
     min_mass = filters.NumberFilter(field_name='mass', lookup_expr='gt')
 
     class Meta:
-        model = Planet
+        model = FlatPlanet
         fields = ['min_mass']
 
 class PlanetsByMinMass(generics.ListAPIView):
-    queryset = Planet.objects.all()
-    serializer_class = PlanetSerializer
+    queryset = FlatPlanet.objects.all()
+    ordering = ('mass', 'pk')
+    serializer_class = FlatPlanetSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = PlanetFilterByMass
 
-from django.db.models import Count
-
 class HostsByMinPlanets(generics.ListAPIView):
-    queryset = Host.objects.annotate(num_planets=Count('planets')).filter(num_planets__gt=1)
+    # Hosts of multi-planet systems, by the planet_count the writes keep up to date.
+    queryset = Host.objects.filter(planet_count__gt=1)
     serializer_class = HostSerializer
+    ordering = ('planet_count', 'pk')
 
     def get_queryset(self):
-        min_planets = self.request.query_params.get('min_planets', None)
-        if min_planets is not None:
-            self.queryset = self.queryset.filter(num_planets__gt=min_planets)
-        return self.queryset
+        queryset = super().get_queryset()
+        if 'min_planets' in self.request.query_params:
+            queryset = queryset.filter(planet_count__gt=query_number(self.request, 'min_planets', int, minimum=0))
+        return queryset
 
 class PlanetFilterByControversialFlag(filters.FilterSet):
     controversial_flag = filters.BooleanFilter(field_name='controversial_flag')
 
     class Meta:
-        model = Planet
+        model = FlatPlanet
         fields = ['controversial_flag']
 
 class PlanetsByControversialFlag(generics.ListAPIView):
-    queryset = Planet.objects.all()
-    serializer_class = PlanetSerializer
+    queryset = FlatPlanet.objects.all()
+    serializer_class = FlatPlanetSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = PlanetFilterByControversialFlag
 
@@ -220,12 +248,12 @@ class PlanetFilterByControversialFlag(filters.FilterSet):
     controversial_flag = filters.BooleanFilter(field_name='controversial_flag')
 
     class Meta:
-        model = Planet
+        model = FlatPlanet
         fields = ['controversial_flag']
 
 class PlanetsByControversialFlag(generics.ListAPIView):
-    queryset = Planet.objects.all()
-    serializer_class = PlanetSerializer
+    queryset = FlatPlanet.objects.all()
+    serializer_class = FlatPlanetSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = PlanetFilterByControversialFlag
 
@@ -237,12 +265,102 @@ class PlanetarySystemFilterByDistance(filters.FilterSet):
         fields = ['max_distance']
 
 class PlanetarySystemsByMaxDistance(generics.ListAPIView):
-    queryset = PlanetarySystem.objects.all()
+    queryset = PlanetarySystem.objects.select_related('host', 'parameter_reference')
     serializer_class = PlanetarySystemSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = PlanetarySystemFilterByDistance
 
 
+def query_number(request, name, type=float, minimum=None, maximum=None):
+    try:
+        value = type(request.query_params[name])
+    except KeyError:
+        raise ValidationError({name: 'This parameter is required.'})
+    except ValueError:
+        raise ValidationError({name: f'A {type.__name__} is required.'})
+    if not math.isfinite(value):
+        raise ValidationError({name: 'A finite number is required.'})
+    if minimum is not None and value < minimum:
+        raise ValidationError({name: f'Must be at least {minimum}.'})
+    if maximum is not None and value > maximum:
+        raise ValidationError({name: f'Must be at most {maximum}.'})
+    return value
+
+def host_position(index, pk):
+    position = index.position(pk)
+    if position is None:
+        raise NotFound(f'Host {pk} does not exist or has no RA, Dec and distance.')
+    return position
+
+def separation_response(self, matches):
+    """The serialized hosts of (host, separation) pairs, each with its separation."""
+    data = self.get_serializer([host for host, _ in matches], many=True).data
+    return Response([{**host, 'separation': separation} for host, (_, separation) in zip(data, matches)])
+
+class SpatialHostList(generics.GenericAPIView):
+    """Hosts found by a spatial search, nearest first, each with its separation."""
+    serializer_class = HostSerializer
+
+    def hosts_response(self, matches):
+        hosts = Host.objects.in_bulk([pk for pk, _ in matches])
+        matches = [(hosts[pk], separation) for pk, separation in matches if pk in hosts]
+        return separation_response(self, matches)
+
+class HostsWithinRadius(SpatialHostList):
+    """The limit hosts nearest to a host (host=pk) or to a point (ra and dec in degrees, distance in pc) within radius pc of it."""
+
+    def get(self, request):
+        radius = query_number(request, 'radius', minimum=0)
+        limit = query_number(request, 'limit', int, minimum=1) if 'limit' in request.query_params else SPATIAL_LIMIT
+        index = host_index()
+        if 'host' in request.query_params:
+            center = host_position(index, query_number(request, 'host', int))
+        else:
+            center = cartesian(query_number(request, 'ra'), query_number(request, 'dec'), query_number(request, 'distance', minimum=0))[0]
+        return self.hosts_response(index.within(center, radius, min(limit, MAX_SPATIAL_LIMIT)))
+
+class HostNearestNeighbors(SpatialHostList):
+    """The k (default 10, at most MAX_SPATIAL_LIMIT) hosts nearest to a host."""
+
+    def get(self, request, pk):
+        k = query_number(request, 'k', int, minimum=1) if 'k' in request.query_params else 10
+        index = host_index()
+        host_position(index, pk)
+        return self.hosts_response(index.nearest(pk, min(k, MAX_SPATIAL_LIMIT)))
+
+class HostsInCone(SpatialHostList):
+    """The limit hosts nearest to ra, dec whose system lies within radius_deg degrees of it, with their separation in degrees."""
+
+    def get(self, request):
+        ra, dec = query_number(request, 'ra'), query_number(request, 'dec')
+        radius = query_number(request, 'radius_deg', minimum=0, maximum=180)
+        limit = query_number(request, 'limit', int, minimum=1) if 'limit' in request.query_params else SPATIAL_LIMIT
+        if not -90 <= dec <= 90:
+            raise ValidationError({'dec': 'Must be between -90 and 90.'})
+        # As a subquery the pixel ranges are searched first even before the tables are analyzed.
+        references = SystemParameterReference.objects.filter(cone_filter(ra, dec, radius))
+        candidates = list(Host.objects.filter(system__parameter_reference__in=references).values_list('pk', RA, DEC))
+        separations = angular_separation(ra, dec, [row[1] for row in candidates], [row[2] for row in candidates]).tolist()
+        matches = sorted((separation, pk) for separation, (pk, _, _) in zip(separations, candidates) if separation <= radius)
+        return self.hosts_response([(pk, separation) for separation, pk in matches[:min(limit, MAX_SPATIAL_LIMIT)]])
+
+class SearchPlanets(generics.GenericAPIView):
+    """Planets matching every word of q in their names, host, discovery or references, best first."""
+    serializer_class = FlatPlanetSerializer
+
+    def get(self, request):
+        limit = query_number(request, 'limit', int, minimum=1) if 'limit' in request.query_params else SEARCH_LIMIT
+        planets = search_planets(request.query_params.get('q', ''), min(limit, 100))
+        return Response(self.get_serializer(planets, many=True).data)
+
+class AutocompleteNames(generics.GenericAPIView):
+    """The planet and host names starting with q, from the in-memory name index; the database is not queried."""
+
+    def get(self, request):
+        limit = query_number(request, 'limit', int, minimum=1) if 'limit' in request.query_params else AUTOCOMPLETE_LIMIT
+        return Response(name_index().complete(request.query_params.get('q', ''), min(limit, 100)))
+
+
 def report_index(request):
     return render(request, 'midterm_app/report_index.html')
 